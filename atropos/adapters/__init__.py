@@ -278,6 +278,7 @@ class Adapter(object):
             alphabet.validate_string(sequence)
         
         self.debug = False
+        self.cache = None
         self.name = _generate_adapter_name() if name is None else name
         self.sequence = sequence
         self.where = where
@@ -335,6 +336,11 @@ class Adapter(object):
         self.debug = True
         self.aligner.enable_debug()
     
+    def enable_cache(self, max_size):
+        """Cache the alignments to up to `max_size` distinct read sequences.
+        """
+        self.cache = align.AlignmentCache(max_size)
+    
     def match_to(self, read):
         """Attempt to match this adapter to the given read.
         
@@ -346,8 +352,27 @@ class Adapter(object):
             match was found given the matching criteria (minimum overlap length,
             maximum error rate).
         """
-        read_seq = read.sequence.upper()
+        read_seq = read.upper_sequence
+        if self.cache is None:
+            alignment = self._align(read_seq, read)
+        else:
+            alignment = self.cache.fetch(read_seq, self._align, read_seq, read)
+        if alignment is None:
+            return None
+        return Match(*alignment, self._front_flag, self, read)
+    
+    def _align(self, read_seq, read):
+        """Align this adapter to an (upper-case) read sequence.
         
+        Args:
+            read_seq: The upper-case sequence of `read`.
+            read: The read, whose cached `upper_bytes` are passed to the
+                aligner.
+        
+        Returns:
+            The tuple (astart, astop, rstart, rstop, matches, errors), or None
+            if there is no match that satisfies the matching criteria.
+        """
         # try to find an exact match first unless wildcards are allowed
         pos = -1
         if not self.adapter_wildcards:
@@ -362,9 +387,7 @@ class Adapter(object):
         
         if pos >= 0:
             seqlen = len(self.sequence)
-            return Match(
-                0, seqlen, pos, pos + seqlen, seqlen, 0, self._front_flag,
-                self, read)
+            return (0, seqlen, pos, pos + seqlen, seqlen, 0)
         
         # try approximate matching
         if not self.indels and self.where in (PREFIX, SUFFIX):
@@ -379,7 +402,7 @@ class Adapter(object):
                     wildcard_ref=self.adapter_wildcards,
                     wildcard_query=self.read_wildcards)
         else:
-            alignment = self.aligner.locate(read_seq)
+            alignment = self.aligner.locate_bytes(read.upper_bytes)
             if self.debug:
                 print(self.aligner.dpmatrix)  # pragma: no cover
         
@@ -393,9 +416,7 @@ class Adapter(object):
                 ) and (
                     self.max_rmp is None or
                     self.match_probability(matches, size) <= self.max_rmp)):
-                return Match(
-                    astart, astop, rstart, rstop, matches, errors,
-                    self._front_flag, self, read)
+                return alignment
         
         return None
     
@@ -438,6 +459,12 @@ class Adapter(object):
     def __len__(self):
         return len(self.sequence)
     
+    @property
+    def max_matches(self):
+        """The largest number of matching bases in any match to this adapter.
+        """
+        return len(self.sequence)
+    
     def random_match_probabilities(self):
         """Estimate probabilities that this adapter matches a random sequence. 
         Indels are not taken into account.
@@ -501,6 +528,8 @@ class Adapter(object):
             stats["errors_back"] = self.errors_back
         if where in (BACK, SUFFIX):
             stats["adjacent_bases"] = self.adjacent_bases
+        if self.cache is not None:
+            stats["alignment_cache"] = self.cache.summarize()
         
         return stats
 
@@ -526,6 +555,13 @@ class ColorspaceAdapter(Adapter):
                 "A 5' colorspace adapter needs to be given in nucleotide space")
         self.aligner.reference = self.sequence
     
+    @property
+    def max_matches(self):
+        # 5' adapters are extended by the color of the primer transition.
+        if self.where == PREFIX:
+            return len(self.sequence) + 1
+        return len(self.sequence)
+    
     def match_to(self, read):
         """Attempt to match this adapter to the given read.
         
@@ -668,6 +704,12 @@ class LinkedAdapter(object):
         self.front_adapter.enable_debug()
         self.back_adapter.enable_debug()
     
+    def enable_cache(self, max_size):
+        """Enable alignment caches on adapters.
+        """
+        self.front_adapter.enable_cache(max_size)
+        self.back_adapter.enable_cache(max_size)
+    
     def match_to(self, read):
         """Match the linked adapters against the given read. If the 'front'
         adapter is not found, the 'back' adapter is not searched for.
@@ -812,7 +854,8 @@ class AdapterCache(object):
         try:
             fasta = urlopen(url).read().decode().split("\n")
             return self.load_from_fasta(fasta)
-        except URLError:
+        except (URLError, ValueError):
+            # ValueError is raised for paths without a URL scheme
             if url.startswith("file:"):
                 url = url[5:]
             return self.load_from_file(url)
@@ -2,8 +2,9 @@
 """
 Alignment module.
 """
-from collections import namedtuple
-from atropos.align._align import Aligner, MultiAligner, compare_prefixes, locate
+from collections import OrderedDict, namedtuple
+from atropos.align._align import (
+    Aligner, MultiAligner, BandedMultiAligner, compare_prefixes, locate)
 from atropos.util import RandomMatchProbability, reverse_complement
 
 # flags for global alignment
@@ -43,6 +44,42 @@ def compare_suffixes(
         len(suffix_ref) - length, len(suffix_ref), len(suffix_query) - length,
         len(suffix_query), matches, errors)
 
+class AlignmentCache(object):
+    """Bounded least-recently-used cache of alignment results. Intended for
+    libraries with many duplicate reads (e.g. amplicon or miRNA), where the
+    same alignment would otherwise be computed over and over.
+    
+    Args:
+        max_size: Maximum number of results to retain.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def fetch(self, key, func, *args):
+        """Returns the cached result for `key`, or calls `func(*args)` and
+        caches its result if there is none.
+        """
+        entries = self.entries
+        try:
+            result = entries[key]
+        except KeyError:
+            self.misses += 1
+            result = entries[key] = func(*args)
+            if len(entries) > self.max_size:
+                entries.popitem(last=False)
+        else:
+            self.hits += 1
+            entries.move_to_end(key)
+        return result
+    
+    def summarize(self):
+        """Returns a summary dict with the hit/miss counts.
+        """
+        return dict(hits=self.hits, misses=self.misses)
+
 # Common match-result object returned by aligners
 
 # TODO creating instances of this class is relatively slow and responsible for
@@ -222,7 +259,8 @@ class InsertAligner(object):
     Args:
         adapter1, adapter2: read1, read2 adapters.
         match_probability: Callable that calculates random match probability
-            given arguments (num_matches, match_len).
+            given arguments (num_matches, match_len). Only used for adapter
+            matches; insert match probabilities are computed by the aligner.
         insert_max_rmp: Max random match probability for the insert match.
         adapter_max_rmp: Max random match probability for the adapter match.
         min_insert_overlap: Minimum number of bases the inserts must overlap
@@ -238,6 +276,8 @@ class InsertAligner(object):
         base_probs: Dict of (match_prob, mismatch_prob), which are the
             probabilities passed to
             :method:`atropos.util.RandomMatchProbability.__call__()`.
+        cache_size: If > 0, the results for up to this many distinct read
+            pairs are cached.
     """
     def __init__(
             self, adapter1, adapter2,
@@ -246,7 +286,7 @@ class InsertAligner(object):
             min_insert_overlap=1, max_insert_mismatch_frac=0.2,
             min_adapter_overlap=1, max_adapter_mismatch_frac=0.2,
             adapter_check_cutoff=9, base_probs=None,
-            adapter_wildcards=True, read_wildcards=False):
+            adapter_wildcards=True, read_wildcards=False, cache_size=0):
         self.adapter1 = adapter1
         self.adapter1_len = len(adapter1)
         self.adapter2 = adapter2
@@ -263,10 +303,10 @@ class InsertAligner(object):
             match_prob=0.25, mismatch_prob=0.75)
         self.adapter_wildcards = adapter_wildcards
         self.read_wildcards = read_wildcards
-        self.aligner = MultiAligner(
-            max_insert_mismatch_frac,
-            START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2,
-            min_insert_overlap)
+        self.aligner = BandedMultiAligner(
+            max_insert_mismatch_frac, min_insert_overlap, insert_max_rmp,
+            **self.base_probs)
+        self.cache = AlignmentCache(cache_size) if cache_size else None
     
     def match_insert(self, seq1, seq2):
         """Use cutadapt aligner for insert and adapter matching.
@@ -277,6 +317,16 @@ class InsertAligner(object):
         Returns:
             A :class:`Match` object, or None if there is no match.
         """
+        if self.cache is None:
+            return self._match_insert(seq1, seq2)
+        match = self.cache.fetch((seq1, seq2), self._match_insert, seq1, seq2)
+        if match and match[1]:
+            # The adapter matches are modified by the caller, so the cached
+            # ones must not be handed out.
+            match = (match[0], match[1].copy(), match[2].copy())
+        return match
+    
+    def _match_insert(self, seq1, seq2):
         len1 = len(seq1)
         len2 = len(seq2)
         seq_len = min(len1, len2)
@@ -364,34 +414,20 @@ class InsertAligner(object):
         # return _match(insert_match, offset, insert_match_size, prob)
         
         # Use an aligner that returns all matches that satisfy the
-        # overlap and error rate thresholds. We sort by matches and
-        # then mismatches, and then check each in turn until we find
-        # one with an adapter match (if any).
-
+        # overlap, error rate, and random-match probability thresholds, in
+        # order of increasing probability. We check each in turn until we
+        # find one with an adapter match (if any).
+        
         insert_matches = self.aligner.locate(seq2_rc, seq1)
-
+        
         if insert_matches:
-            # Filter by random-match probability
-            filtered_matches = []
-            for insert_match in insert_matches:
+            # TODO: compare against sorting by length (which is how
+            # SeqPurge essentially does it).
+            for insert_match, prob in insert_matches:
                 offset = min(insert_match[0], seq_len - insert_match[3])
                 insert_match_size = seq_len - offset
-                prob = self.match_probability(insert_match[4], insert_match_size, **self.base_probs)
-                if prob <= self.insert_max_rmp:
-                    filtered_matches.append((insert_match, offset, insert_match_size, prob))
-            
-            if filtered_matches:
-                if len(filtered_matches) == 1:
-                    return _match(*filtered_matches[0])
-                else:
-                    # Test matches in order of random-match probability.
-                    # TODO: compare against sorting by length (which is how
-                    # SeqPurge essentially does it).
-                    #filtered_matches.sort(key=lambda x: x[2], reverse=True)
-                    filtered_matches.sort(key=lambda x: x[3])
-                    for match_args in filtered_matches:
-                        match = _match(*match_args)
-                        if match:
-                            return match
-            
-            return None
+                match = _match(insert_match, offset, insert_match_size, prob)
+                if match:
+                    return match
+        
+        return None
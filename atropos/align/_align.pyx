@@ -7,7 +7,7 @@
 from cpython.mem cimport PyMem_Malloc, PyMem_Free, PyMem_Realloc
 from cpython.array cimport array, clone
 cdef array ld_array = array('d', [])
-from libc.math cimport ceil
+from libc.math cimport ceil, exp, lgamma, log
 
 DEF START_WITHIN_SEQ1 = 1
 DEF START_WITHIN_SEQ2 = 2
@@ -28,6 +28,12 @@ ctypedef struct _Match:
     int ref_stop
     int query_stop
 
+ctypedef struct _InsertMatch:
+    int ref_start
+    int length
+    int matches
+    double prob
+
 def _acgt_table():
     """
     Return a translation table that maps A, C, G, T characters to the lower
@@ -273,11 +279,18 @@ cdef class Aligner:
 
         The alignment itself is not returned.
         """
+        return self.locate_bytes(query.encode('ascii'))
+
+    def locate_bytes(self, bytes query_bytes):
+        """
+        Same as locate(), but the query is given as ASCII-encoded bytes. This
+        avoids re-encoding the query when the same read is aligned to many
+        adapters.
+        """
         cdef char* s1 = self._reference
-        cdef bytes query_bytes = query.encode('ascii')
         cdef char* s2 = query_bytes
         cdef int m = self.m
-        cdef int n = len(query)
+        cdef int n = len(query_bytes)
         cdef _Entry* column = self.column
         cdef double max_error_rate = self.max_error_rate
         cdef bint start_in_ref = self.flags & START_WITHIN_SEQ1
@@ -348,7 +361,8 @@ cdef class Aligner:
                 column[i].origin = min_n - i
 
         if self.debug:
-            self._dpmatrix = DPMatrix(self.str_reference, query)
+            self._dpmatrix = DPMatrix(
+                self.str_reference, query_bytes.decode('ascii'))
             for i in range(m + 1):
                 self._dpmatrix.set_entry(i, min_n, column[i].cost)
         cdef _Match best
@@ -368,6 +382,7 @@ cdef class Aligner:
         cdef int cost_insertion
         cdef int origin, cost, matches
         cdef int length
+        cdef int first_i
         cdef bint characters_equal
         cdef _Entry tmp_entry
 
@@ -454,20 +469,20 @@ cdef class Aligner:
                             break
                 # column finished
 
-        if max_n == n:
-            first_i = 0 if stop_in_ref else m
-            # search in last column # TODO last?
-            for i in range(first_i, m+1):
-                length = i + min(column[i].origin, 0)
-                cost = column[i].cost
-                matches = column[i].matches
-                if length >= self._min_overlap and cost <= length * max_error_rate and (matches > best.matches or (matches == best.matches and cost < best.cost)):
-                    # update best
-                    best.matches = matches
-                    best.cost = cost
-                    best.origin = column[i].origin
-                    best.ref_stop = i
-                    best.query_stop = n
+            if max_n == n:
+                first_i = 0 if stop_in_ref else m
+                # search in last column # TODO last?
+                for i in range(first_i, m+1):
+                    length = i + min(column[i].origin, 0)
+                    cost = column[i].cost
+                    matches = column[i].matches
+                    if length >= self._min_overlap and cost <= length * max_error_rate and (matches > best.matches or (matches == best.matches and cost < best.cost)):
+                        # update best
+                        best.matches = matches
+                        best.cost = cost
+                        best.origin = column[i].origin
+                        best.ref_stop = i
+                        best.query_stop = n
         
         if best.cost == m + n:
             # best.cost was initialized with this value.
@@ -486,6 +501,12 @@ cdef class Aligner:
         assert best.ref_stop - start1 > 0  # Do not return empty alignments.
         return (start1, best.ref_stop, start2, best.query_stop, best.matches, best.cost)
 
+    def __reduce__(self):
+        return (Aligner, (
+            self.str_reference, self.max_error_rate, self.flags,
+            self.wildcard_ref, self.wildcard_query, self._min_overlap,
+            self._insertion_cost))
+
     def __dealloc__(self):
         PyMem_Free(self.column)
 
@@ -525,16 +546,17 @@ def compare_prefixes(str ref, str query, bint wildcard_ref=False, bint wildcard_
     elif wildcard_ref:
         query_bytes = query_bytes.translate(ACGT_TABLE)
 
-    if compare_ascii:
-        for i in range(length):
-            if ref[i] == query[i]:
-                matches += 1
-    else:
-        r_ptr = ref_bytes
-        q_ptr = query_bytes
-        for i in range(length):
-            if (r_ptr[i] & q_ptr[i]) != 0:
-                matches += 1
+    r_ptr = ref_bytes
+    q_ptr = query_bytes
+    with nogil:
+        if compare_ascii:
+            for i in range(length):
+                if r_ptr[i] == q_ptr[i]:
+                    matches += 1
+        else:
+            for i in range(length):
+                if (r_ptr[i] & q_ptr[i]) != 0:
+                    matches += 1
 
     # length - matches = no. of errors
     return (0, length, 0, length, matches, length - matches)
@@ -770,6 +792,215 @@ cdef class MultiAligner:
         assert _match.ref_stop - start1 > 0  # Do not return empty alignments.
         return (start1, _match.ref_stop, start2, _match.query_stop, _match.matches, _match.cost)
 
+    def __reduce__(self):
+        return (MultiAligner, (
+            self.max_error_rate, self.flags, self._min_overlap))
+
     def __dealloc__(self):
         PyMem_Free(self.column)
         PyMem_Free(self.match_array)
+
+
+cdef double _binomial_tail(
+        int matches, int size, double log_match_prob,
+        double log_mismatch_prob) nogil:
+    """Returns the probability of observing at least `matches` matching bases
+    in `size` random bases. Terms are computed in log space so that long
+    overlaps don't overflow.
+    """
+    cdef double log_nfac
+    cdef double prob = 0.0
+    cdef int i
+    if matches >= size:
+        return exp(size * log_match_prob)
+    log_nfac = lgamma(size + 1)
+    for i in range(matches, size + 1):
+        prob += exp(
+            log_nfac - lgamma(i + 1) - lgamma(size - i + 1) +
+            i * log_match_prob + (size - i) * log_mismatch_prob)
+    return prob
+
+cdef inline bint _better_insert_match(_InsertMatch a, _InsertMatch b) nogil:
+    return a.prob < b.prob or (a.prob == b.prob and a.length < b.length)
+
+cdef class BandedMultiAligner:
+    """Aligner for finding the overlap between the inserts of a read pair.
+    
+    Equivalent to a MultiAligner with flags START_WITHIN_SEQ1 |
+    STOP_WITHIN_SEQ2, except that 1) the random-match probability of each
+    alignment is computed here rather than by the caller, and 2) the search
+    space is pruned: overlap lengths that cannot satisfy both the error rate
+    and `max_rmp` are skipped outright, each diagonal is abandoned as soon as
+    it exceeds its mismatch budget, and once `max_matches` candidates have
+    been found the search stops at the first overlap length that cannot beat
+    the worst of them.
+    
+    Args:
+        max_error_rate: Maximum fraction of mismatches in an alignment.
+        min_overlap: Minimum alignment length.
+        max_rmp: Maximum random-match probability of an alignment.
+        match_prob, mismatch_prob: Probabilities of two random bases
+            matching/not matching.
+    """
+    cdef double max_error_rate
+    cdef int _min_overlap
+    cdef double max_rmp
+    cdef double match_prob
+    cdef double mismatch_prob
+    cdef double log_match_prob
+    cdef double log_mismatch_prob
+    # Maximum number of mismatches allowed for each overlap length, or -1 if
+    # no alignment of that length can qualify.
+    cdef int* max_errors
+    cdef int _max_len
+    cdef _InsertMatch* match_array
+    cdef int _num_matches
+    
+    def __cinit__(
+            self, double max_error_rate, int min_overlap=1,
+            double max_rmp=1.0, double match_prob=0.25,
+            double mismatch_prob=0.75):
+        self.max_error_rate = max_error_rate
+        self._min_overlap = min_overlap
+        self.max_rmp = max_rmp
+        self.match_prob = match_prob
+        self.mismatch_prob = mismatch_prob
+        self.log_match_prob = log(match_prob)
+        self.log_mismatch_prob = log(mismatch_prob)
+        self._max_len = 0
+        self._num_matches = 0
+    
+    def _resize_errors(self, int size):
+        cdef int length, limit, errors
+        if size > self._max_len:
+            mem = <int*> PyMem_Realloc(self.max_errors, (size + 1) * sizeof(int))
+            if not mem:
+                raise MemoryError()
+            self.max_errors = mem
+            for length in range(self._max_len + 1, size + 1):
+                if length < self._min_overlap:
+                    self.max_errors[length] = -1
+                    continue
+                limit = <int> (length * self.max_error_rate)
+                if self.max_rmp >= 1.0:
+                    self.max_errors[length] = limit
+                    continue
+                # The tail probability increases monotonically with the
+                # number of mismatches.
+                errors = -1
+                while errors < limit and _binomial_tail(
+                        length - errors - 1, length, self.log_match_prob,
+                        self.log_mismatch_prob) <= self.max_rmp:
+                    errors += 1
+                self.max_errors[length] = errors
+            self._max_len = size
+    
+    def _resize_matches(self, size):
+        if size > self._num_matches:
+            mem = <_InsertMatch*> PyMem_Realloc(
+                self.match_array, (size + 1) * sizeof(_InsertMatch))
+            if not mem:
+                raise MemoryError()
+            self.match_array = mem
+            self._num_matches = size
+    
+    def locate(self, str reference, str query, int max_matches=100):
+        """
+        locate(reference, query) -> [((refstart, refstop, querystart,
+        querystop, matches, errors), prob), ...]
+        
+        Find alignments of a prefix of the query to a suffix of the reference.
+        
+        Returns:
+            A list of up to `max_matches` (match, random-match probability)
+            tuples ordered by increasing probability, or None if there are no
+            qualifying alignments.
+        """
+        cdef int m = len(reference)
+        cdef int n = len(query)
+        cdef int max_len = min(m, n)
+        if max_len == 0 or max_matches < 1:
+            return None
+        
+        self._resize_errors(max_len)
+        self._resize_matches(max_matches)
+        
+        cdef bytes reference_bytes = reference.encode('ascii')
+        cdef char* s1 = reference_bytes
+        cdef bytes query_bytes = query.encode('ascii')
+        cdef char* s2 = query_bytes
+        
+        cdef int* max_errors = self.max_errors
+        cdef _InsertMatch* match_array = self.match_array
+        cdef double log_match_prob = self.log_match_prob
+        cdef double log_mismatch_prob = self.log_mismatch_prob
+        cdef int num_matches = 0
+        cdef int length, ref_start, i, k, errors
+        cdef _InsertMatch candidate
+        
+        with nogil:
+            # Longer overlaps can reach lower probabilities, so search them
+            # first.
+            for length in range(max_len, 0, -1):
+                k = max_errors[length]
+                if k < 0:
+                    continue
+                if (
+                        num_matches == max_matches and
+                        exp(length * log_match_prob) >
+                        match_array[num_matches - 1].prob):
+                    # Not even an exact match of this length (or any shorter
+                    # one) could displace one of the current candidates.
+                    break
+                
+                ref_start = m - length
+                errors = 0
+                for i in range(length):
+                    if s1[ref_start + i] != s2[i]:
+                        errors += 1
+                        if errors > k:
+                            break
+                if errors > k:
+                    continue
+                
+                candidate.ref_start = ref_start
+                candidate.length = length
+                candidate.matches = length - errors
+                candidate.prob = _binomial_tail(
+                    length - errors, length, log_match_prob,
+                    log_mismatch_prob)
+                
+                if num_matches == max_matches:
+                    if not _better_insert_match(
+                            candidate, match_array[num_matches - 1]):
+                        continue
+                    i = num_matches - 1
+                else:
+                    i = num_matches
+                    num_matches += 1
+                while i > 0 and _better_insert_match(
+                        candidate, match_array[i - 1]):
+                    match_array[i] = match_array[i - 1]
+                    i -= 1
+                match_array[i] = candidate
+        
+        if num_matches == 0:
+            return None
+        
+        return [
+            (
+                (
+                    match_array[i].ref_start, m, 0, match_array[i].length,
+                    match_array[i].matches,
+                    match_array[i].length - match_array[i].matches),
+                match_array[i].prob)
+            for i in range(num_matches)]
+    
+    def __reduce__(self):
+        return (BandedMultiAligner, (
+            self.max_error_rate, self._min_overlap, self.max_rmp,
+            self.match_prob, self.mismatch_prob))
+    
+    def __dealloc__(self):
+        PyMem_Free(self.max_errors)
+        PyMem_Free(self.match_array)
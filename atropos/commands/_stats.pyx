@@ -0,0 +1,216 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Counting kernels for read statistics.
+"""
+from cpython.array cimport array
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+
+def count_positions(array counts, str values, int width):
+    """
+    Increment `counts[i * width + ord(values[i])]` for each position i in
+    `values`. counts is an array('Q') of size at least len(values) * width.
+    """
+    cdef bytes data = values.encode('latin-1')
+    cdef const unsigned char* ptr = data
+    cdef unsigned long long* cnt = counts.data.as_ulonglongs
+    cdef Py_ssize_t size = len(data)
+    cdef Py_ssize_t i
+    cdef bint invalid = False
+    if size * width > len(counts):
+        raise IndexError("Counts array is too small")
+    with nogil:
+        for i in range(size):
+            if ptr[i] >= width:
+                invalid = True
+                break
+        if not invalid:
+            for i in range(size):
+                cnt[i * width + ptr[i]] += 1
+    if invalid:
+        raise ValueError("Invalid character in {}".format(values))
+
+def add_counts(array dest, array src):
+    """
+    Add the values in `src` to the first len(src) values of `dest`. Both are
+    arrays of type 'Q'.
+    """
+    cdef unsigned long long* dptr = dest.data.as_ulonglongs
+    cdef unsigned long long* sptr = src.data.as_ulonglongs
+    cdef Py_ssize_t size = len(src)
+    cdef Py_ssize_t i
+    if size > len(dest):
+        raise IndexError("Destination array is too small")
+    with nogil:
+        for i in range(size):
+            dptr[i] += sptr[i]
+
+cdef inline unsigned long long _mix64(unsigned long long value) nogil:
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9ULL
+    value = (value ^ (value >> 27)) * 0x94d049bb133111ebULL
+    return value ^ (value >> 31)
+
+def hash_sequence(str value):
+    """
+    Returns a 64-bit hash of `value` (FNV-1a followed by a SplitMix64
+    finalizer). Unlike `hash`, this is identical in every process.
+    """
+    cdef bytes data = value.encode('latin-1')
+    cdef const unsigned char* ptr = data
+    cdef Py_ssize_t size = len(data)
+    cdef Py_ssize_t i
+    cdef unsigned long long hashval = 0xcbf29ce484222325ULL
+    with nogil:
+        for i in range(size):
+            hashval = (hashval ^ ptr[i]) * 0x100000001b3ULL
+        hashval = _mix64(hashval)
+    return hashval
+
+def count_min_add(
+        array table, Py_ssize_t width, unsigned long long hashval,
+        unsigned long long count=1):
+    """
+    Add `count` to the cells of a count-min sketch (an array('Q') of
+    depth * width cells) selected by `hashval`, and return the new estimate.
+    """
+    cdef unsigned long long* cells = table.data.as_ulonglongs
+    cdef Py_ssize_t depth = len(table) // width
+    cdef Py_ssize_t row, idx
+    cdef unsigned long long estimate = 0
+    with nogil:
+        for row in range(depth):
+            idx = row * width + <Py_ssize_t>(
+                _mix64(hashval + (row + 1) * 0x9e3779b97f4a7c15ULL) % width)
+            cells[idx] += count
+            if row == 0 or cells[idx] < estimate:
+                estimate = cells[idx]
+    return estimate
+
+def count_min_estimate(
+        array table, Py_ssize_t width, unsigned long long hashval):
+    """
+    Returns the estimated count of `hashval` in a count-min sketch.
+    """
+    cdef unsigned long long* cells = table.data.as_ulonglongs
+    cdef Py_ssize_t depth = len(table) // width
+    cdef Py_ssize_t row, idx
+    cdef unsigned long long estimate = 0
+    with nogil:
+        for row in range(depth):
+            idx = row * width + <Py_ssize_t>(
+                _mix64(hashval + (row + 1) * 0x9e3779b97f4a7c15ULL) % width)
+            if row == 0 or cells[idx] < estimate:
+                estimate = cells[idx]
+    return estimate
+
+cdef unsigned char[256] BASE_CODES
+for _i in range(256):
+    BASE_CODES[_i] = 4
+for _i, _base in enumerate(b'ACGT'):
+    BASE_CODES[_base] = _i
+    BASE_CODES[_base + 32] = _i
+
+cdef Py_ssize_t _encode_kmers(
+        const unsigned char* ptr, Py_ssize_t size, int k,
+        unsigned long long* keys) nogil:
+    """
+    Write pos * 4**k + code for each k-mer in ptr that does not contain an
+    ambiguous base to keys, where code is the 2-bit encoding of the k-mer
+    starting at pos. Returns the number of k-mers written.
+    """
+    cdef unsigned long long mask = (1ULL << (2 * k)) - 1
+    cdef unsigned long long code = 0
+    cdef unsigned char base
+    cdef Py_ssize_t i
+    cdef Py_ssize_t valid = 0
+    cdef Py_ssize_t num_keys = 0
+    for i in range(size):
+        base = BASE_CODES[ptr[i]]
+        if base > 3:
+            valid = 0
+            code = 0
+            continue
+        code = ((code << 2) | base) & mask
+        valid += 1
+        if valid >= k:
+            keys[num_keys] = (
+                (<unsigned long long>(i - k + 1) << (2 * k)) | code)
+            num_keys += 1
+    return num_keys
+
+def kmer_keys(str seq, int k):
+    """
+    Returns an array('Q') with pos * 4**k + code for each k-mer in `seq`
+    that does not contain an ambiguous base, where code is the 2-bit
+    encoding (A=0, C=1, G=2, T=3) of the k-mer starting at pos.
+    """
+    cdef bytes data = seq.encode('latin-1')
+    cdef Py_ssize_t size = len(data)
+    cdef const unsigned char* ptr = data
+    cdef Py_ssize_t num_keys
+    if size < k:
+        return array('Q')
+    cdef array keys = array('Q', bytes(8 * (size - k + 1)))
+    with nogil:
+        num_keys = _encode_kmers(ptr, size, k, keys.data.as_ulonglongs)
+    del keys[num_keys:]
+    return keys
+
+def count_kmers(array counts, str seq, int k):
+    """
+    Increment `counts[pos * 4**k + code]` for each k-mer in `seq` that does
+    not contain an ambiguous base. counts is an array('Q') of size at least
+    (len(seq) - k + 1) * 4**k.
+    """
+    cdef bytes data = seq.encode('latin-1')
+    cdef const unsigned char* ptr = data
+    cdef unsigned long long* cnt = counts.data.as_ulonglongs
+    cdef Py_ssize_t size = len(data)
+    cdef Py_ssize_t num_keys, i
+    cdef unsigned long long* keys
+    if size < k:
+        return
+    if (size - k + 1) << (2 * k) > len(counts):
+        raise IndexError("Counts array is too small")
+    keys = <unsigned long long*> PyMem_Malloc(
+        (size - k + 1) * sizeof(unsigned long long))
+    if not keys:
+        raise MemoryError()
+    try:
+        with nogil:
+            num_keys = _encode_kmers(ptr, size, k, keys)
+            for i in range(num_keys):
+                cnt[keys[i]] += 1
+    finally:
+        PyMem_Free(keys)
+
+def add_error_probs(array sums, array counts, array lut, qualities):
+    """
+    For each quality string in `qualities`, add `lut[ord(quals[i])]` to
+    `sums[i]` and 1 to `counts[i]` for each position i. sums is an
+    array('d'), counts an array('Q') of the same size, and lut an array('d')
+    of 256 values. Positions beyond the size of sums are ignored. Returns the
+    number of bases added.
+    """
+    cdef double* sptr = sums.data.as_doubles
+    cdef unsigned long long* cptr = counts.data.as_ulonglongs
+    cdef double* lptr = lut.data.as_doubles
+    cdef Py_ssize_t max_len = len(sums)
+    cdef Py_ssize_t num_bases = 0
+    cdef Py_ssize_t size, i
+    cdef bytes data
+    cdef const unsigned char* ptr
+    if len(counts) != max_len:
+        raise ValueError("Sums and counts arrays are of different sizes")
+    if len(lut) != 256:
+        raise ValueError("Lookup table must have 256 values")
+    for quals in qualities:
+        data = quals.encode('latin-1')
+        ptr = data
+        size = min(len(data), max_len)
+        with nogil:
+            for i in range(size):
+                sptr[i] += lptr[ptr[i]]
+                cptr[i] += 1
+        num_bases += size
+    return num_bases
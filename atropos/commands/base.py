@@ -2,6 +2,9 @@
 """
 from collections import Sequence
 import copy
+from itertools import chain, islice
+import logging
+import math
 import platform
 import sys
 from atropos import __version__, AtroposError
@@ -11,16 +14,33 @@ from atropos.util import MergingDict, Const, Summarizable, Timing
 
 class Pipeline(object):
     """Base class for analysis pipelines.
+    
+    If `convergence` is set to a :class:`ConvergenceMonitor`, the pipeline
+    stops reading input once the values returned by `convergence_metrics`
+    have converged.
+    
+    Pipelines that set `supports_deltas` can summarize the records they have
+    processed incrementally (see :meth:`delta`).
     """
+    supports_deltas = False
+    
     def __init__(self):
         self.record_counts = {}
         self.bp_counts = {}
+        self.convergence = None
     
     def __call__(self, command_runner, raise_on_error=False, **kwargs):
         self.start(**kwargs)
         try:
             for batch in command_runner.iterator():
                 self.process_batch(batch)
+                if (
+                        self.convergence is not None and
+                        self.convergence.update(*self.convergence_metrics())):
+                    logging.getLogger().info(
+                        "Statistics converged after %d reads",
+                        sum(self.record_counts.values()))
+                    break
         except Exception as err:
             if raise_on_error:
                 raise
@@ -95,8 +115,55 @@ class Pipeline(object):
         """
         raise NotImplementedError()
     
-    def finish(self, summary, **kwargs):
-        """Finish the pipeline, including adding information to the summary.
+    def handle_batch(self, context, records):
+        """Handle a sequence of records all at once. Only pipelines that
+        implement `handle_reads_batch` support this.
+        
+        Args:
+            context: The pipeline context (dict).
+            records: The sequence of records.
+        """
+        raise NotImplementedError()
+    
+    def handle_reads_batch(self, context, reads1, reads2=None):
+        """Handle a batch of reads or read-pairs.
+        
+        Args:
+            context: The pipeline context (dict).
+            reads1, reads2: Lists of reads; reads2 will be None for single-end
+                data.
+        """
+        raise NotImplementedError()
+    
+    def convergence_metrics(self):
+        """Returns the current values of the statistics that are monitored
+        for convergence.
+        
+        Returns:
+            A tuple (metrics, estimate), where metrics is a sequence of numbers
+            and estimate is a tuple (total, count) of cumulative values from
+            which the primary estimate (total / count) is computed.
+        """
+        raise NotImplementedError()
+    
+    def delta(self, summary):
+        """Add information on the records processed since the previous call
+        (or since the pipeline started) to the summary, and reset it, so that
+        it is not added again. Only called on pipelines that set
+        `supports_deltas`, which must extend this method to add (and reset)
+        their own state. The deltas of a worker are merged into the main
+        summary as they arrive, and the final summary of the worker contains
+        only the records processed after the last delta.
+        
+        Args:
+            summary: Summary dict to update.
+        """
+        self.add_counts(summary)
+        self.record_counts = {}
+        self.bp_counts = {}
+    
+    def add_counts(self, summary):
+        """Add the record and base pair counts to the summary.
         
         Args:
             summary: Summary dict to update.
@@ -108,6 +175,118 @@ class Pipeline(object):
             bp_counts=self.bp_counts,
             total_bp_counts=total_bp_counts,
             sum_total_bp_count=sum(total_bp_counts))
+    
+    def finish(self, summary, **kwargs):
+        """Finish the pipeline, including adding information to the summary.
+        
+        Args:
+            summary: Summary dict to update.
+        """
+        self.add_counts(summary)
+        if self.convergence is not None:
+            summary['convergence'] = self.convergence.summarize()
+            summary['convergence']['reads'] = sum(self.record_counts.values())
+
+class ConvergenceMonitor(object):
+    """Decides when summary statistics have stopped changing so that reading
+    can stop early. After each batch, `update` is called with the current
+    values of the monitored metrics; they have converged once the relative
+    change of every metric has stayed below `tolerance` for `window`
+    consecutive batches.
+    
+    The per-batch values of the primary estimate are also recorded, and used
+    to compute a (batch means) 95% confidence interval for the estimate.
+    
+    Args:
+        tolerance: Maximum relative change of a metric between batches.
+        window: Number of consecutive batches that must be within tolerance.
+        estimate_name: Name of the primary estimate.
+    """
+    def __init__(self, tolerance=0.001, window=5, estimate_name='estimate'):
+        self.tolerance = tolerance
+        self.window = window
+        self.estimate_name = estimate_name
+        self.batches = 0
+        self.stable_batches = 0
+        self.max_change = None
+        self._metrics = None
+        self._estimate = (0, 0)
+        self._samples = []
+    
+    @property
+    def converged(self):
+        """Whether the metrics have converged.
+        """
+        return self.stable_batches >= self.window
+    
+    def update(self, metrics, estimate=None):
+        """Update with the current values after a batch.
+        
+        Args:
+            metrics: Sequence of the current values of the metrics.
+            estimate: Tuple (total, count) of the cumulative values from
+                which the primary estimate is computed.
+        
+        Returns:
+            True if the metrics have converged.
+        """
+        self.batches += 1
+        metrics = tuple(metrics)
+        if (
+                self._metrics is None or not metrics or
+                len(metrics) != len(self._metrics)):
+            change = None
+        else:
+            change = max(
+                abs(new - old) / max(abs(new), abs(old)) if new != old else 0
+                for new, old in zip(metrics, self._metrics))
+        self._metrics = metrics
+        self.max_change = change
+        if change is not None and change < self.tolerance:
+            self.stable_batches += 1
+        else:
+            self.stable_batches = 0
+        
+        if estimate is not None:
+            total, count = estimate
+            prev_total, prev_count = self._estimate
+            if count > prev_count:
+                self._samples.append(
+                    (total - prev_total) / (count - prev_count))
+            self._estimate = estimate
+        
+        return self.converged
+    
+    def confidence_interval(self):
+        """Returns the 95% confidence interval of the primary estimate, based
+        on the variance of the per-batch estimates, or None if fewer than two
+        batches have been seen.
+        """
+        total, count = self._estimate
+        num_samples = len(self._samples)
+        if num_samples < 2 or not count:
+            return None
+        mean = sum(self._samples) / num_samples
+        variance = sum(
+            (sample - mean) ** 2 for sample in self._samples
+        ) / (num_samples - 1)
+        half_width = 1.96 * math.sqrt(variance / num_samples)
+        estimate = total / count
+        return (estimate - half_width, estimate + half_width)
+    
+    def summarize(self):
+        """Returns a summary dict.
+        """
+        total, count = self._estimate
+        return dict(
+            tolerance=self.tolerance,
+            window=self.window,
+            batches=self.batches,
+            converged=self.converged,
+            max_change=self.max_change,
+            estimate_name=self.estimate_name,
+            estimate=total / count if count else None,
+            confidence_interval=self.confidence_interval())
 
 class SingleEndPipelineMixin(object):
     """Mixin for pipelines that implements `handle_record` for single-end data.
@@ -115,6 +294,10 @@ class SingleEndPipelineMixin(object):
     def handle_record(self, context, record):
         context['bp'][0] += len(record)
         return self.handle_reads(context, record)
+    
+    def handle_batch(self, context, records):
+        context['bp'][0] += sum(len(record) for record in records)
+        return self.handle_reads_batch(context, records)
 
 class PairedEndPipelineMixin(object):
     """Mixin for pipelines that implements `handle_record` for paired-end data.
@@ -125,6 +308,13 @@ class PairedEndPipelineMixin(object):
         bps[0] += len(read1.sequence)
         bps[1] += len(read2.sequence)
         return self.handle_reads(context, read1, read2)
+    
+    def handle_batch(self, context, records):
+        reads1, reads2 = zip(*records)
+        bps = context['bp']
+        bps[0] += sum(len(read1) for read1 in reads1)
+        bps[1] += sum(len(read2) for read2 in reads2)
+        return self.handle_reads_batch(context, reads1, reads2)
 
 class Summary(MergingDict):
     """Contains summary information.
@@ -253,7 +443,25 @@ class BaseCommandRunner(object):
             if itr is not None:
                 return itr
         return self
-
+    
+    def peek(self, num_records):
+        """Returns (up to) the first `num_records` input records. The records
+        are buffered, and are yielded again by the batch iterator, so they are
+        not read twice. Must be called before the iterator is used.
+        
+        Args:
+            num_records: The number of records to return.
+        
+        Returns:
+            A list of records.
+        """
+        if self.batches > 0:
+            raise AtroposError("Cannot peek once reading has started")
+        records = [record for _, record in islice(self.iterable, num_records)]
+        self.iterable = enumerate(
+            chain(records, (record for _, record in self.iterable)), 1)
+        return records
+    
     def __iter__(self):
         return self
     
@@ -210,6 +210,30 @@ class BaseCommandParser(object):
             help="Specify a sequence alphabet to use for validating inputs. "
                  "Currently, only 'dna' is supported. (no validation)")
     
+    def add_convergence_options(self):
+        """Add options for stopping once statistics have converged.
+        """
+        group = self.add_group(
+            "Convergence", title="Options for stopping early once summary "
+            "statistics have converged")
+        group.add_argument(
+            "--until-converged",
+            action="store_true", default=False,
+            help="Stop reading input once the summary statistics have "
+                 "converged, i.e. their relative change has stayed below "
+                 "'--convergence-tolerance' for '--convergence-batches' "
+                 "consecutive batches. (no)")
+        group.add_argument(
+            "--convergence-tolerance",
+            type=positive(float), default=0.001, metavar="TOL",
+            help="Maximum relative change of any statistic between batches. "
+                 "(0.001)")
+        group.add_argument(
+            "--convergence-batches",
+            type=positive(int), default=5, metavar="N",
+            help="Number of consecutive batches for which the statistics "
+                 "must be within tolerance. (5)")
+    
     def add_command_options(self):
         """Add command-specific options. At the very least,
         "-o, --output" is required.
@@ -1,14 +1,20 @@
 """Detect adapter sequences directly from reads based on kmer frequency.
 """
 from collections import defaultdict
+import copy
 import logging
 import math
 import re
 from atropos.align import Aligner, SEMIGLOBAL
 from atropos.commands.base import (
     BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
+from atropos.commands.multicore import (
+    ParallelPipelineMixin, ParallelPipelineRunner)
+from atropos.commands.detect.kmers import KmerCounter, KmerGraph, KmerSketch
+from atropos.commands.detect.search import PatternSearch
 from atropos.util import (
-    reverse_complement, sequence_complexity, enumerate_range, run_interruptible)
+    Mergeable, reverse_complement, sequence_complexity,
+    enumerate_range, run_interruptible)
 
 # TODO: Test whether using rc=True in parse_known_contaminants is as fast
 # and as accurate as testing both the forward and reverse complement
@@ -16,18 +22,6 @@ from atropos.util import (
 # Also, offer an option of whether to test the reverse complement, with
 # the default being false.
 
-# TODO: I'm not sure that the use of tags in the KhmerDetector is the correct
-# strategy, mostly because I don't fully understand what tags are (they are not
-# documented and only mentioned briefly in the PNAS paper). An alternate
-# strategy is to use CountTable and, upon each kmer addition, test whether its
-# count exceeds some threshold (perhaps by maintaining a running distribution of
-# all kmer counts). These high-abundance kmers could then be profiled using a
-# second pass. Another strategy is to compute summary metrics for reads based on 
-# kmer abundance, as per 
-# http://khmer-recipes.readthedocs.io/en/latest/001-extract-reads-by-coverage/index.html
-# Then take reads in the furthest-right peak and extract common sequences from
-# those.
-
 # TODO: Check out AdapterRemoval2's detection strategy.
 
 # pymer https://github.com/kdmurray91/pymer/tree/master/pymer
@@ -43,12 +37,10 @@ from atropos.util import (
 # TODO: Re-download sequencing_adapters.fa if it has been updated since last
 # download.
 
-# TODO: parallelize adapter detection for multiple input files.
-
 
 class CommandRunner(BaseCommandRunner):
     """
-
+    
     """
     name = 'detect'
     
@@ -65,13 +57,17 @@ class CommandRunner(BaseCommandRunner):
         if not detector:
             if known_contaminants and include == 'known':
                 detector = 'known'
-            elif n_reads <= 50000:
+            elif n_reads <= 5000000:
                 detector = 'heuristic'
             else:
-                detector = 'khmer'
+                detector = 'sketch'
+        elif detector == 'khmer':
+            logging.getLogger().warning(
+                "The khmer detector has been replaced by the sketch detector")
+            detector = 'sketch'
         
         detector_args = dict(known_contaminants=known_contaminants)
-            
+        
         if detector == 'known':
             logging.getLogger().debug(
                 "Detecting contaminants using the known-only algorithm")
@@ -84,10 +80,10 @@ class CommandRunner(BaseCommandRunner):
             detector_args['min_frequency'] = self.min_frequency
             detector_args['min_contaminant_match_frac'] = \
                 self.min_contaminant_match_frac
-        elif detector == 'khmer':
+        elif detector == 'sketch':
             logging.getLogger().debug(
-                "Detecting contaminants using the kmer-based algorithm")
-            detector_class = KhmerDetector
+                "Detecting contaminants using the kmer sketch algorithm")
+            detector_class = SketchDetector
         
         summary_args = dict(
             kmer_size=kmer_size, n_reads=n_reads, 
@@ -109,9 +105,41 @@ class CommandRunner(BaseCommandRunner):
             "Detecting adapters and other potential contaminant "
             "sequences based on %d-mers in %d reads", kmer_size, n_reads)
         
-        # currently only single-threaded operation is supproted
-        self.summary.update(mode='serial', threads=1)
-        return run_interruptible(detector, self, raise_on_error=True)
+        if self.threads is None:
+            self.summary.update(mode='serial', threads=1)
+            return run_interruptible(detector, self, raise_on_error=True)
+        else:
+            self.summary.update(mode='parallel', threads=self.threads)
+            return self.run_parallel(detector)
+    
+    def run_parallel(self, detector):
+        """Execute detect in parallel mode. Worker processes filter the reads
+        and count k-mers (or match known contaminants) in batches; their
+        detectors are then merged, and contaminants are identified in the
+        main process. For the heuristic detector, only the first k-mer
+        counting pass is done by the workers.
+        
+        Args:
+            detector: The :class:`Detector` or :class:`PairedDetector` to
+                copy to the workers.
+        
+        Returns:
+            The return code.
+        """
+        logging.getLogger().debug(
+            "Starting atropos detect in parallel mode with threads=%d, "
+            "timeout=%d", self.threads, self.process_timeout)
+        
+        if self.threads < 2:
+            raise ValueError("'threads' must be >= 2")
+        
+        runner = ParallelPipelineRunner(self, DetectorWorkerPipeline(detector))
+        retcode = runner.run()
+        if retcode == 0:
+            detector = self.summary.pop('detector')
+            self.summary['detect']['matches'] = detector.summarize_matches(
+                threads=self.threads, backend=self.parallel_backend)
+        return retcode
 
 class Match(object):
     """A contaminant match.
@@ -224,6 +252,37 @@ class Match(object):
                 known_seqs=self.known_seqs)
         return summary
 
+def search_matches(matches, read_sequences, longest_match=True):
+    """Set the abundance (the number of reads that contain the match sequence)
+    and, optionally, the longest matching sequence of each of `matches`. All
+    match sequences are searched at once with a single scan of each read.
+    The results are the same as those of :meth:`Match.estimate_abundance`
+    and :meth:`Match.set_longest_match`.
+    
+    Args:
+        matches: Sequence of :class:`Match`es.
+        read_sequences: Iterable of read sequences.
+        longest_match: Whether to also set the longest matching sequences.
+    """
+    if not matches:
+        return
+    search = PatternSearch(match.seq for match in matches)
+    abundances = [0] * len(matches)
+    longest_matches = [None] * len(matches)
+    for read_seq in read_sequences:
+        for idx, start in search.find_first(read_seq):
+            abundances[idx] += 1
+            if longest_match:
+                seqlen = len(matches[idx].seq) - start
+                longest = longest_matches[idx]
+                if longest is None or longest[1] < seqlen:
+                    longest_matches[idx] = (read_seq[start:], seqlen)
+    for match, abundance, longest in zip(
+            matches, abundances, longest_matches):
+        match.abundance = abundance
+        if longest_match:
+            match.longest_match = longest
+
 class ContaminantMatcher(object):
     """Matches a known contaminant against other sequences.
     
@@ -241,7 +300,7 @@ class ContaminantMatcher(object):
         self.n_kmers = len(self.kmers)
         self.kmer_size = kmer_size
         self.matches = 0
-        
+    
     def match(self, seq, seqrc):
         """Returns (num_matches, num_contam_kmers, num_seq_kmers).
         
@@ -281,6 +340,72 @@ class ContaminantMatcher(object):
             match_frac2 = n_matches / len(kmers)
         return (match_frac1, match_frac2, compare_seq)
 
+class ContaminantIndex(object):
+    """Inverted index from kmer to the known contaminants that contain it, for
+    matching many contaminants against a sequence at once.
+    
+    Args:
+        matchers: Sequence of :class:`ContaminantMatcher`s.
+        kmer_size: kmer size.
+    """
+    def __init__(self, matchers, kmer_size):
+        self.matchers = matchers
+        self.kmer_size = kmer_size
+        self.index = defaultdict(list)
+        for idx, matcher in enumerate(matchers):
+            for kmer in matcher.kmers:
+                self.index[kmer].append(idx)
+    
+    def _count_hits(self, kmers):
+        counts = defaultdict(int)
+        for kmer in kmers:
+            for idx in self.index.get(kmer, ()):
+                counts[idx] += 1
+        return counts
+    
+    def match(self, seq, seqrc):
+        """Match all contaminants against a sequence. The results (and the
+        updated match counts of the contaminants) are the same as those of
+        :meth:`ContaminantMatcher.match`, but only contaminants that share at
+        least one kmer with the sequence are returned.
+        
+        Args:
+            seq: The sequence to match.
+            seqrc: The reverse complement of `seq`.
+        
+        Returns:
+            A list of tuples (contaminant, f1, f2, seq), where f1 is the
+            fraction of contaminant kmers that match, f2 is the fraction of
+            sequence kmers that match, and seq is the best matching sequence
+            (either `seq` or `seqrc`), in the order of the contaminants.
+        """
+        kmer_size = self.kmer_size
+        fw_kmers = set(
+            seq[i:(i+kmer_size)] for i in range(len(seq) - kmer_size + 1))
+        rv_kmers = set(
+            seqrc[i:(i+kmer_size)] for i in range(len(seqrc) - kmer_size + 1))
+        fw_counts = self._count_hits(fw_kmers)
+        rv_counts = self._count_hits(rv_kmers)
+        
+        results = []
+        for idx in sorted(set(fw_counts) | set(rv_counts)):
+            contam = self.matchers[idx]
+            fw_matches = fw_counts.get(idx, 0)
+            rv_matches = rv_counts.get(idx, 0)
+            if fw_matches >= rv_matches:
+                n_matches = float(fw_matches)
+                n_kmers = len(fw_kmers)
+                compare_seq = seq
+            else:
+                n_matches = float(rv_matches)
+                n_kmers = len(rv_kmers)
+                compare_seq = seqrc
+            contam.matches += n_matches
+            results.append((
+                contam, n_matches / contam.n_kmers, n_matches / n_kmers,
+                compare_seq))
+        return results
+
 def create_contaminant_matchers(contaminants, kmer_size):
     """Create :class:`ContaminantMatcher`s from sequences.
     
@@ -296,8 +421,10 @@ def create_contaminant_matchers(contaminants, kmer_size):
         for seq, names in contaminants.iter_sequences()
     ]
 
-class Detector(SingleEndPipelineMixin, Pipeline):
-    """Base class for contaminant detectors.
+class Detector(SingleEndPipelineMixin, Pipeline, Mergeable):
+    """Base class for contaminant detectors. Detectors are mergeable, so that
+    reads can be processed in separate workers whose detectors are merged
+    before contaminants are identified.
     
     Args:
         kmer_size: Size of kmers to match.
@@ -311,6 +438,8 @@ class Detector(SingleEndPipelineMixin, Pipeline):
             bases will be removed from any sequencers before looking for 
             matching contaminants.
     """
+    supports_batch = False
+    
     def __init__(
             self, kmer_size=12, n_reads=10000, overrep_cutoff=100,
             include='all', known_contaminants=None, past_end_bases=('A',)):
@@ -389,8 +518,11 @@ class Detector(SingleEndPipelineMixin, Pipeline):
         
         matches = self._get_contaminants()
         
-        for match in matches:
-            match.estimate_abundance(self._read_sequences)
+        # Detectors that do not keep reads leave the abundance unknown.
+        if self._read_sequences:
+            search_matches(
+                [match for match in matches if match.abundance is None],
+                self._read_sequences, longest_match=False)
         
         def _filter(match):
             if match.count < self.min_report_freq:
@@ -429,7 +561,7 @@ class Detector(SingleEndPipelineMixin, Pipeline):
             return True
         
         matches = list(filter(_filter, matches))
-        matches.sort(key=lambda x: len(x) * math.log(x.count), reverse=True)
+        matches.sort(key=lambda x: len(x) * math.log1p(x.count), reverse=True)
         
         if limit is not None:
             matches = matches[:limit]
@@ -444,14 +576,63 @@ class Detector(SingleEndPipelineMixin, Pipeline):
         """
         raise NotImplementedError()
     
-    def finish(self, summary, **kwargs):
-        super().finish(summary)
-        summary['detect']['matches'] = ([
+    def merge(self, other):
+        """Merge the reads seen by another detector of the same type into this
+        one.
+        """
+        if self._read_length is None:
+            self._read_length = other._read_length
+        self._read_sequences.update(other._read_sequences)
+        return self
+    
+    def matching_copy(self):
+        """Returns a shallow copy of this detector without the state that is
+        only needed for counting, to send to another process in which
+        contaminants are identified.
+        """
+        return copy.copy(self)
+    
+    def summarize_matches(self, threads=1, backend=None, **kwargs):
+        """Returns a tuple with a list of match summaries. `threads` and
+        `backend` are ignored, since there is only one set of matches to
+        identify.
+        """
+        return ([
             match.summarize()
             for match in self.matches(**kwargs)
         ],)
+    
+    def finish(self, summary, **kwargs):
+        super().finish(summary)
+        summary['detect']['matches'] = self.summarize_matches(**kwargs)
 
-class PairedDetector(PairedEndPipelineMixin, Pipeline):
+class DetectorWorkerPipeline(ParallelPipelineMixin, Pipeline):
+    """Pipeline that feeds the batches received by a worker to a detector.
+    Instead of matches, the detector itself is added to the summary, so that
+    the detectors of all workers are merged (in the main process) before
+    contaminants are identified.
+    
+    Args:
+        detector: A :class:`Detector` or :class:`PairedDetector`.
+    """
+    def __init__(self, detector):
+        super().__init__()
+        self.detector = detector
+    
+    def handle_records(self, context, records):
+        self.detector.handle_records(context, records)
+    
+    def finish(self, summary, worker=None):
+        super().finish(summary, worker=worker)
+        summary['detector'] = self.detector
+
+def summarize_matches(detector):
+    """Returns the match summaries of `detector`. This is a module-level
+    function so that it can be called in a separate process or thread.
+    """
+    return detector.summarize_matches()[0]
+
+class PairedDetector(PairedEndPipelineMixin, Pipeline, Mergeable):
     """Detector for paired-end reads.
     """
     def __init__(self, detector_class, **kwargs):
@@ -468,28 +649,66 @@ class PairedDetector(PairedEndPipelineMixin, Pipeline):
             self.read1_detector.set_read_length(read1)
             self.read2_detector.set_read_length(read2)
             self._read_length_set = True
-        super().handle_records(context, records)
+        if self.read1_detector.supports_batch:
+            self.handle_batch(context, records)
+        else:
+            super().handle_records(context, records)
     
     def handle_reads(self, context, read1, read2):
         self.read1_detector.handle_reads(context, read1)
         self.read2_detector.handle_reads(context, read2)
     
+    def handle_reads_batch(self, context, reads1, reads2):
+        self.read1_detector.handle_reads_batch(context, reads1)
+        self.read2_detector.handle_reads_batch(context, reads2)
+    
+    def merge(self, other):
+        """Merge the read1 and read2 detectors of another
+        :class:`PairedDetector` into this one.
+        """
+        self.read1_detector.merge(other.read1_detector)
+        self.read2_detector.merge(other.read2_detector)
+        self._read_length_set |= other._read_length_set
+        return self
+    
+    def summarize_matches(self, threads=1, backend='processes', **kwargs):
+        """Returns a tuple with the lists of match summaries for read1 and
+        read2. If `threads` > 1, the matches for read1 and read2 are
+        identified concurrently, in separate processes or threads depending
+        on `backend`. Only the state needed to identify contaminants is sent
+        to the processes.
+        """
+        detectors = (self.read1_detector, self.read2_detector)
+        if threads > 1 and not kwargs:
+            if backend == 'threads':
+                from multiprocessing.pool import ThreadPool as Pool
+            else:
+                from multiprocessing import Pool
+                detectors = tuple(
+                    detector.matching_copy() for detector in detectors)
+            with Pool(2) as pool:
+                return tuple(pool.map(summarize_matches, detectors))
+        return tuple(
+            [match.summarize() for match in detector.matches(**kwargs)]
+            for detector in detectors)
+    
     def finish(self, summary, **kwargs):
         super().finish(summary)
-        summary['detect']['matches'] = ([
-            match.summarize()
-            for match in self.read1_detector.matches(**kwargs)
-        ], [
-            match.summarize()
-            for match in self.read2_detector.matches(**kwargs)
-        ])
+        summary['detect']['matches'] = self.summarize_matches(**kwargs)
 
 class KnownContaminantDetector(Detector):
     """Test known contaminants against reads. This has linear complexity and is
-    more specific than the khmer matcher, but less specific than the heuristic
+    more specific than the sketch matcher, but less specific than the heuristic
     matcher. It's also less sensitive since it does not try to detect unknown
     contaminants.
     
+    Each distinct read is matched against the known contaminants as it is
+    streamed, and only the per-contaminant match counts are kept, so workers
+    do all of the matching and only their counts are merged. Reads are not
+    stored; duplicates are skipped using a set of read hashes, which still
+    grows with the number of distinct reads (but is much smaller than the
+    reads themselves).
+    
     Args:
         known_contaminants: List of :class:`ContaminantMatcher`s.
         min_kmer_match_frac: Minimum fraction of matching kmers required.
@@ -500,6 +719,24 @@ class KnownContaminantDetector(Detector):
         super().__init__(known_contaminants=known_contaminants, **kwargs)
         self.min_kmer_match_frac = min_kmer_match_frac
         self._min_k = min(len(s) for s in known_contaminants.sequences)
+        self._contaminant_index = None
+        self._read_hashes = set()
+        # Counts for each contaminant sequence: the number of kmer matches
+        # (over all reads), and the number of reads that match in the forward
+        # and reverse orientation, or that contain the contaminant.
+        self._kmer_counts = defaultdict(int)
+        self._forward_counts = defaultdict(int)
+        self._reverse_counts = defaultdict(int)
+        self._abundances = defaultdict(int)
+        self._max_match_fracs = defaultdict(int)
+    
+    def __getstate__(self):
+        # The read hashes are only needed to skip duplicates, and the index
+        # can be rebuilt, so neither is sent along with the counts.
+        state = self.__dict__.copy()
+        state['_read_hashes'] = set()
+        state['_contaminant_index'] = None
+        return state
     
     @property
     def min_report_freq(self):
@@ -511,39 +748,156 @@ class KnownContaminantDetector(Detector):
             return seq
         return None
     
+    def handle_reads(self, context, read1, read2=None):
+        seq = self._filter_seq(read1.sequence)
+        if seq:
+            seq_hash = hash(seq)
+            if seq_hash not in self._read_hashes:
+                self._read_hashes.add(seq_hash)
+                self._match_read(seq)
+    
+    def _match_read(self, seq):
+        """Match a distinct read against the known contaminants, and update
+        the counts.
+        """
+        if self._contaminant_index is None:
+            self._contaminant_index = ContaminantIndex(
+                create_contaminant_matchers(
+                    self.known_contaminants, self.kmer_size),
+                self.kmer_size)
+        for contam, match_frac, _, compare_seq in \
+                self._contaminant_index.match(seq, reverse_complement(seq)):
+            contam_seq = contam.seq
+            self._kmer_counts[contam_seq] += int(
+                round(match_frac * contam.n_kmers))
+            if contam_seq in seq:
+                self._abundances[contam_seq] += 1
+            if match_frac > self.min_kmer_match_frac:
+                if compare_seq is seq:
+                    self._forward_counts[contam_seq] += 1
+                else:
+                    self._reverse_counts[contam_seq] += 1
+                if match_frac > self._max_match_fracs[contam_seq]:
+                    self._max_match_fracs[contam_seq] = match_frac
+    
+    def merge(self, other):
+        """Merge the match counts of another :class:`KnownContaminantDetector`
+        into this one. A distinct read seen by more than one detector is
+        counted once by each.
+        """
+        if self._read_length is None:
+            self._read_length = other._read_length
+        for counts, other_counts in (
+                (self._kmer_counts, other._kmer_counts),
+                (self._forward_counts, other._forward_counts),
+                (self._reverse_counts, other._reverse_counts),
+                (self._abundances, other._abundances)):
+            for contam_seq, count in other_counts.items():
+                counts[contam_seq] += count
+        for contam_seq, match_frac in other._max_match_fracs.items():
+            if match_frac > self._max_match_fracs[contam_seq]:
+                self._max_match_fracs[contam_seq] = match_frac
+        return self
+    
+    def matching_copy(self):
+        # Abundances are counted as reads are matched, so the reads are not
+        # needed to identify contaminants.
+        detector = super().matching_copy()
+        detector._read_hashes = set()
+        detector._contaminant_index = None
+        return detector
+    
+    def orientation_counts(self, contam_seq):
+        """Returns a tuple (forward, reverse) with the number of reads that
+        match the contaminant with sequence `contam_seq` in the forward and
+        reverse orientation.
+        """
+        return (
+            self._forward_counts.get(contam_seq, 0),
+            self._reverse_counts.get(contam_seq, 0))
+    
     def _get_contaminants(self):
-        contaminant_matchers = create_contaminant_matchers(
-            self.known_contaminants, self.kmer_size)
-        counts = defaultdict(int)
-        max_match_fracs = defaultdict(int)
-        
-        for seq in self._read_sequences:
-            seqrc = reverse_complement(seq)
-            for contam in contaminant_matchers:
-                match = contam.match(seq, seqrc)
-                if match[0] > self.min_kmer_match_frac:
-                    counts[contam] += 1
-                    if match[0] > max_match_fracs[contam]:
-                        max_match_fracs[contam] = match[0]
+        if self._read_length is None:
+            return []
         
         min_count = math.ceil(
             self.n_reads * (self._read_length - self._min_k + 1) *
             self.overrep_cutoff / float(4**self._min_k))
         
-        return [
-            Match(
-                c[0], match_frac=max_match_fracs[c[0]], 
-                abundance=float(c[1]) / self.n_reads)
-            for c in filter(
-                lambda x: x[1] >= min_count,
-                counts.items()
-            )
-        ]
+        matches = []
+        for contam_seq, names in self.known_contaminants.iter_sequences():
+            count = sum(self.orientation_counts(contam_seq))
+            if count == 0 or count < min_count:
+                continue
+            match = Match(
+                contam_seq, count=self._kmer_counts[contam_seq],
+                abundance=self._abundances[contam_seq])
+            match.set_known(
+                names, [contam_seq], self._max_match_fracs[contam_seq])
+            matches.append(match)
+        return matches
+
+def detect_known_adapters(
+        records, known_contaminants, paired=False, kmer_size=12,
+        min_kmer_match_frac=0.5):
+    """Identify the known adapter that is most common in a sample of reads.
+    This is a quick, in-memory version of `atropos detect --detector known`,
+    used to select the adapters to trim.
+    
+    Args:
+        records: Sequence of records (or of tuples (read1, read2) if `paired`
+            is True).
+        known_contaminants: :class:`AdapterCache` of known adapters.
+        paired: Whether the records are paired-end.
+        kmer_size: Size of kmers to match.
+        min_kmer_match_frac: Minimum fraction of matching kmers required.
+    
+    Returns:
+        A list with, for each read, a list of the detected adapter sequences
+        (empty if no adapter was detected), in the orientation in which they
+        occur in the reads.
+    """
+    detector_args = dict(
+        known_contaminants=known_contaminants, kmer_size=kmer_size,
+        n_reads=len(records), min_kmer_match_frac=min_kmer_match_frac)
+    if paired:
+        detector = PairedDetector(KnownContaminantDetector, **detector_args)
+        detectors = (detector.read1_detector, detector.read2_detector)
+    else:
+        detector = KnownContaminantDetector(**detector_args)
+        detectors = (detector,)
+    detector.process_batch((dict(index=1, source=0, size=len(records)), records))
+    
+    adapters = []
+    for read_detector in detectors:
+        matches = read_detector.matches(limit=1)
+        if not matches:
+            adapters.append([])
+            continue
+        match = matches[0]
+        # Known adapters may be listed in either orientation; use the one
+        # that matches most reads.
+        forward, reverse = read_detector.orientation_counts(match.seq)
+        seq = match.seq if forward >= reverse else reverse_complement(match.seq)
+        logging.getLogger().info(
+            "Detected adapter %s (%s) in %d of %d sampled reads", seq,
+            ', '.join(match.names or ()), max(forward, reverse), len(records))
+        adapters.append([seq])
+    return adapters
 
 class HeuristicDetector(Detector):
-    """Use a heuristic iterative algorithm to arrive at likely contaminants.
-    This is the most accurate algorithm overall, but it has quadratic complexity
-    and becomes too slow/memory-intenstive when n_reads > 50k.
+    """Use a heuristic algorithm to arrive at likely contaminants. This is the
+    most accurate algorithm overall. K-mers are packed into integers and
+    counted in two passes (a fixed-size count-min sketch, then exact counts
+    of only the k-mers that the sketch reports as frequent), and frequent
+    k-mers are extended into longer sequences by walking the k-mer graph.
+    Memory use is dominated by the read sequences themselves.
+    
+    Only the sketch pass is done as reads are streamed (i.e. by the workers,
+    in parallel mode); the exact counts and everything that follows require
+    the distinct reads of all workers, and are computed after merging. All
+    distinct reads are therefore kept in memory (and sent from the workers
+    to the main process), regardless of the number of threads.
     """
     def __init__(
             self, min_frequency=0.001, min_contaminant_match_frac=0.9, 
@@ -551,11 +905,34 @@ class HeuristicDetector(Detector):
         super(HeuristicDetector, self).__init__(**kwargs)
         self.min_frequency = min_frequency
         self.min_contaminant_match_frac = min_contaminant_match_frac
+        self._kmer_counter = None
     
     @property
     def min_report_freq(self):
         return 0.1 * self.n_reads
     
+    def handle_reads(self, context, read1, read2=None):
+        # The first (sketch) counting pass is done as reads are streamed.
+        seq = self._filter_seq(read1.sequence)
+        if seq and seq not in self._read_sequences:
+            self._read_sequences.add(seq)
+            if self._kmer_counter is None:
+                self._kmer_counter = KmerCounter(self.kmer_size)
+            self._kmer_counter.add(seq)
+    
+    def merge(self, other):
+        """Merge another :class:`HeuristicDetector` into this one. A read seen
+        by more than one detector is counted more than once in the merged
+        sketch, which only makes it a looser upper bound; the exact counts
+        are computed from the merged set of distinct reads.
+        """
+        super().merge(other)
+        if self._kmer_counter is None:
+            self._kmer_counter = other._kmer_counter
+        elif other._kmer_counter is not None:
+            self._kmer_counter.merge(other._kmer_counter)
+        return self
+    
     def _get_contaminants(self):
         def _min_count(kmer_size):
             return math.ceil(self.n_reads * max(
@@ -563,58 +940,30 @@ class HeuristicDetector(Detector):
                 (self._read_length - kmer_size + 1) * self.overrep_cutoff /
                 float(4**kmer_size)))
         
+        if self._kmer_counter is None:
+            return []
+        
         kmer_size = self.kmer_size
-        kmers = defaultdict(lambda: [0, set()])
-        
-        for seq in self._read_sequences:
-            for i in range(len(seq) - kmer_size + 1):
-                kmer = seq[i:(i+kmer_size)]
-                kmers[kmer][0] += 1
-                kmers[kmer][1].add(seq)
-        
-        prev = None
-        cur = {}
-        results = {}
-        result_seqs = defaultdict(set)
         min_count = _min_count(kmer_size)
         
-        # Identify candidate kmers for increasing values of k
-        while True:
-            all_seqs = set()
-            for kmer, (count, seqs) in kmers.items():
-                if count > min_count:
-                    cur[kmer] = (count, seqs)
-                    all_seqs.update(seqs)
-            
-            if len(all_seqs) == 0:
-                break
-            
-            if prev:
-                for kmer, (count, seqs) in prev.items():
-                    if (
-                            not any(seq in cur for seq in seqs) and
-                            sequence_complexity(kmer) > 1.0):
-                        results[kmer] = count
-                        result_seqs[kmer].update(seqs)
-            
-            kmer_size += 1
-            kmers = defaultdict(lambda: [0, set()])
-            for seq in all_seqs:
-                for i in range(len(seq) - kmer_size + 1):
-                    kmer = seq[i:(i+kmer_size)]
-                    kmers[kmer][0] += 1
-                    kmers[kmer][1].add(seq)
-            
-            min_count = _min_count(kmer_size)
-            prev = cur
-            cur = {}
+        # Count exactly the k-mers that the sketch reports as being more
+        # frequent than expected.
+        kmers = self._kmer_counter.count_frequent(
+            self._read_sequences, min_count + 1)
         
-        results = list(results.items())
+        # Extend the frequent k-mers into longer candidate sequences by
+        # walking the k-mer graph.
+        results = [
+            (seq, count)
+            for seq, count in KmerGraph(kmers, kmer_size).assemble()
+            if sequence_complexity(seq) > 1.0]
+        
+        if len(results) == 0:
+            return []
         
         # Now merge overlapping sequences by length and frequency to eliminate
         # redundancy in the set of candidate kmers.
         results.sort(key=lambda i: len(i[0]) * math.log(i[1]), reverse=True)
-        cur = results[0]
         merged = []
         unmerged = []
         while len(results) > 1:
@@ -635,9 +984,6 @@ class HeuristicDetector(Detector):
             unmerged = []
         results = merged + results
         
-        if len(results) == 0:
-            return []
-        
         # TODO: For each retained match, pull out the longest sequence that
         # matches to have a better shot of identifying long adapters that
         # appear in full very infrequently
@@ -649,14 +995,15 @@ class HeuristicDetector(Detector):
         min_count = int(results[0][1] * 0.5)
         results = (x for x in results if x[1] >= min_count)
         # Convert to matches
-        matches = [
-            Match(x[0], count=x[1], reads=result_seqs[x[0]]) 
-            for x in results]
+        matches = [Match(x[0], count=x[1]) for x in results]
+        search_matches(matches, self._read_sequences)
         
         if self.known_contaminants:
             # Match to known sequences
-            contaminants = create_contaminant_matchers(
-                self.known_contaminants, self.kmer_size)
+            contaminant_index = ContaminantIndex(
+                create_contaminant_matchers(
+                    self.known_contaminants, self.kmer_size),
+                self.kmer_size)
             known = {}
             unknown = []
             
@@ -664,9 +1011,8 @@ class HeuristicDetector(Detector):
                 """Find best contaminant matches to `seq`.
                 """
                 seqrc = reverse_complement(seq)
-                for contam in contaminants:
-                    match_frac1, match_frac2, compare_seq = contam.match(
-                        seq, seqrc)
+                for contam, match_frac1, match_frac2, compare_seq in \
+                        contaminant_index.match(seq, seqrc):
                     if match_frac1 < best_match_frac[0]:
                         continue
                     if (
@@ -731,40 +1077,66 @@ class HeuristicDetector(Detector):
         
         return matches
 
-class KhmerDetector(Detector):
-    """Identify contaminants based on kmer frequency using a fast kmer counting
-    approach (as implemented in the khmer library). This approach is fast but
-    not as accurate as the other two.
+class SketchDetector(Detector):
+    """Identify contaminants based on kmer frequency using a fixed-size
+    count-min sketch of kmer counts and a tracker of the most frequent kmers.
+    Reads are not stored, so this approach is fast and runs in constant
+    memory, but it is not as accurate as the other two.
+    
+    Args:
+        sketch_width: Number of counters in each row of the sketch.
+        sketch_depth: Number of rows in the sketch.
+        max_tracked: Number of frequent kmers to track.
+        kwargs: Additional arguments to pass to the :class:`Detector`
+            constructor.
     """
+    supports_batch = True
+    
+    def __init__(
+            self, sketch_width=2**22, sketch_depth=4, max_tracked=1000,
+            **kwargs):
+        super().__init__(**kwargs)
+        self.sketch = KmerSketch(
+            self.kmer_size, sketch_width, sketch_depth, max_tracked)
+    
     @property
     def min_report_freq(self):
         return 0.0001
     
+    def handle_records(self, context, records):
+        if context['size'] == 0:
+            return
+        if self._read_length is None:
+            self.set_read_length(records[0])
+        self.handle_batch(context, records)
+    
+    def handle_reads(self, context, read1, read2=None):
+        self.handle_reads_batch(context, (read1,))
+    
+    def handle_reads_batch(self, context, reads1, reads2=None):
+        self.sketch.add_all(
+            seq for seq in (self._filter_seq(read.sequence) for read in reads1)
+            if seq)
+    
+    def merge(self, other):
+        """Merge the sketch of another :class:`SketchDetector` into this one.
+        """
+        super().merge(other)
+        self.sketch.merge(other.sketch)
+        return self
+    
+    def matching_copy(self):
+        detector = super().matching_copy()
+        detector.sketch = self.sketch.tracked_copy()
+        return detector
+    
     def _get_contaminants(self):
-        from khmer import Countgraph, khmer_args
-        # assuming all sequences are same length
-        n_win = self._read_length - self.kmer_size + 1
-        tablesize = self.n_reads * n_win
-        countgraph = Countgraph(
-            self.kmer_size, tablesize, khmer_args.DEFAULT_N_TABLES)
-        countgraph.set_use_bigcount(True)
-        
-        for seq in self._read_sequences:
-            countgraph.consume_and_tag(seq)
-        
-        n_expected = math.ceil(tablesize / float(4**self.kmer_size))
+        num_kmers = self.sketch.num_kmers
+        if num_kmers == 0:
+            return []
+        n_expected = math.ceil(num_kmers / float(4**self.kmer_size))
         min_count = n_expected * self.overrep_cutoff
-        if min_count >= 2**16:
-            raise ValueError(
-                "The minimum count for an over-represented k-kmer {} is "
-                "greater than the max khmer count (2^16)".format(min_count))
-    
-        candidates = {}
-        
-        for tag in countgraph.get_tagset():
-            count = countgraph.get(tag)
-            if count >= min_count:
-                candidates[tag] = count
+        candidates = dict(self.sketch.frequent(min_count))
         
         if self.known_contaminants:
             matches = []
@@ -788,11 +1160,16 @@ class KhmerDetector(Detector):
                 n_kmers = seqlen - self.kmer_size + 1
                 num_matches = 0
                 match_counts = []
+                # The reverse-complement of the k-mer at idx is the k-mer
+                # that ends at seqlen - idx in the reverse-complement of seq.
+                seqrc = reverse_complement(seq)
                 for idx in range(n_kmers):
                     kmer = seq[idx:(idx + self.kmer_size)]
+                    kmer_rc = seqrc[
+                        (seqlen - idx - self.kmer_size):(seqlen - idx)]
                     kmer_count = max(
                         match(kmer),
-                        match(reverse_complement(kmer))
+                        match(kmer_rc)
                     )
                     if kmer_count > 0:
                         num_matches += 1
@@ -801,18 +1178,20 @@ class KhmerDetector(Detector):
                 if num_matches > 0:
                     # not sure what the correct metric is to use here
                     overall_count = sum(match_counts) / float(n_kmers)
-                    matches.append(Match(
-                        seq, count=overall_count / float(tablesize), 
-                        names=names, match_frac=float(num_matches) / n_kmers))
+                    known_match = Match(
+                        seq, count=overall_count / float(num_kmers))
+                    known_match.set_known(
+                        names, [seq], float(num_matches) / n_kmers)
+                    matches.append(known_match)
             
             # Add remaining tags
             for tag in set(candidates.keys()) - seen:
                 matches.append(Match(
-                    tag, count=candidates[tag] / float(tablesize)))
+                    tag, count=candidates[tag] / float(num_kmers)))
         
         else:
             matches = [
-                Match(tag, count=count / float(tablesize))
+                Match(tag, count=count / float(num_kmers))
                 for tag, count in candidates.items()]
         
         return matches
@@ -0,0 +1,222 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Encoding and counting of 2-bit packed k-mers.
+"""
+from cpython.array cimport array, resize_smart
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+
+cdef unsigned char[256] BASE_CODES
+for _i in range(256):
+    BASE_CODES[_i] = 4
+for _i, _base in enumerate(b'ACGT'):
+    BASE_CODES[_base] = _i
+    BASE_CODES[_base + 32] = _i
+
+cdef inline unsigned long long _mix64(unsigned long long value) nogil:
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9ULL
+    value = (value ^ (value >> 27)) * 0x94d049bb133111ebULL
+    return value ^ (value >> 31)
+
+cdef inline Py_ssize_t _cell(
+        unsigned long long code, Py_ssize_t row, Py_ssize_t width) nogil:
+    return row * width + <Py_ssize_t>(
+        _mix64(code + (row + 1) * 0x9e3779b97f4a7c15ULL) % width)
+
+cdef Py_ssize_t _encode(
+        const unsigned char* ptr, Py_ssize_t size, int k,
+        unsigned long long* codes) nogil:
+    """
+    Write the 2-bit code of each k-mer in ptr that does not contain an
+    ambiguous base to codes. Returns the number of codes written.
+    """
+    cdef unsigned long long mask = (
+        0xFFFFFFFFFFFFFFFFULL if k == 32 else (1ULL << (2 * k)) - 1)
+    cdef unsigned long long code = 0
+    cdef unsigned char base
+    cdef Py_ssize_t i
+    cdef Py_ssize_t valid = 0
+    cdef Py_ssize_t num_codes = 0
+    for i in range(size):
+        base = BASE_CODES[ptr[i]]
+        if base > 3:
+            valid = 0
+            code = 0
+            continue
+        code = ((code << 2) | base) & mask
+        valid += 1
+        if valid >= k:
+            codes[num_codes] = code
+            num_codes += 1
+    return num_codes
+
+cdef class _Codes:
+    """
+    Buffer of the k-mer codes of a single sequence.
+    """
+    cdef bytes data
+    cdef unsigned long long* codes
+    cdef Py_ssize_t size
+
+    def __cinit__(self, str seq, int k):
+        if k < 1 or k > 32:
+            raise ValueError("K-mer size must be between 1 and 32")
+        self.data = seq.encode('latin-1')
+        self.size = 0
+        self.codes = NULL
+        cdef Py_ssize_t seqlen = len(self.data)
+        cdef const unsigned char* ptr = self.data
+        if seqlen >= k:
+            self.codes = <unsigned long long*> PyMem_Malloc(
+                (seqlen - k + 1) * sizeof(unsigned long long))
+            if not self.codes:
+                raise MemoryError()
+            with nogil:
+                self.size = _encode(ptr, seqlen, k, self.codes)
+
+    def __dealloc__(self):
+        PyMem_Free(self.codes)
+
+def encode_kmers(str seq, int k):
+    """
+    Returns an array('Q') with the 2-bit code (A=0, C=1, G=2, T=3) of each
+    k-mer in `seq` that does not contain an ambiguous base.
+    """
+    cdef _Codes codes = _Codes(seq, k)
+    cdef array result = array('Q', bytes(8 * codes.size))
+    cdef Py_ssize_t i
+    for i in range(codes.size):
+        result.data.as_ulonglongs[i] = codes.codes[i]
+    return result
+
+def sketch_kmers(array table, Py_ssize_t width, str seq, int k):
+    """
+    Add each k-mer in `seq` to a count-min sketch, which is an array('I') of
+    depth * width (saturating) counters.
+    """
+    cdef _Codes codes = _Codes(seq, k)
+    cdef unsigned int* cells = table.data.as_uints
+    cdef Py_ssize_t depth = len(table) // width
+    cdef Py_ssize_t i, row, idx
+    with nogil:
+        for i in range(codes.size):
+            for row in range(depth):
+                idx = _cell(codes.codes[i], row, width)
+                if cells[idx] < 0xFFFFFFFFU:
+                    cells[idx] += 1
+
+def filter_kmers(
+        array table, Py_ssize_t width, str seq, int k,
+        unsigned int min_count):
+    """
+    Returns an array('Q') with the codes of the k-mers in `seq` whose
+    estimated count in a count-min sketch is at least `min_count`.
+    """
+    cdef _Codes codes = _Codes(seq, k)
+    cdef unsigned int* cells = table.data.as_uints
+    cdef Py_ssize_t depth = len(table) // width
+    cdef Py_ssize_t i, row
+    cdef Py_ssize_t num_frequent = 0
+    cdef bint frequent
+    with nogil:
+        for i in range(codes.size):
+            frequent = True
+            for row in range(depth):
+                if cells[_cell(codes.codes[i], row, width)] < min_count:
+                    frequent = False
+                    break
+            if frequent:
+                codes.codes[num_frequent] = codes.codes[i]
+                num_frequent += 1
+    cdef array result = array('Q', bytes(8 * num_frequent))
+    for i in range(num_frequent):
+        result.data.as_ulonglongs[i] = codes.codes[i]
+    return result
+
+def update_kmers(
+        array table, Py_ssize_t width, sequences, int k,
+        unsigned int min_estimate):
+    """
+    Add each k-mer in each of `sequences` to a count-min sketch (an
+    array('I') of depth * width saturating counters) using conservative
+    update, i.e. only the counters that are below the k-mer's new estimate
+    are incremented.
+
+    Returns:
+        A tuple (num_kmers, codes, estimates), where num_kmers is the number
+        of k-mers added, and codes (array('Q')) and estimates (array('I'))
+        are the codes and new estimates of the k-mers whose new estimate is
+        at least `min_estimate`.
+    """
+    cdef unsigned int* cells = table.data.as_uints
+    cdef Py_ssize_t depth = len(table) // width
+    cdef Py_ssize_t i, row, idx
+    cdef Py_ssize_t num_kmers = 0
+    cdef Py_ssize_t num_results = 0
+    cdef unsigned int estimate
+    cdef unsigned long long code
+    cdef _Codes codes
+    cdef array result_codes = array('Q')
+    cdef array result_estimates = array('I')
+    cdef unsigned long long* codes_ptr
+    cdef unsigned int* estimates_ptr
+    for seq in sequences:
+        codes = _Codes(seq, k)
+        num_kmers += codes.size
+        resize_smart(result_codes, num_results + codes.size)
+        resize_smart(result_estimates, num_results + codes.size)
+        codes_ptr = result_codes.data.as_ulonglongs
+        estimates_ptr = result_estimates.data.as_uints
+        with nogil:
+            for i in range(codes.size):
+                code = codes.codes[i]
+                estimate = 0xFFFFFFFFU
+                for row in range(depth):
+                    idx = _cell(code, row, width)
+                    if cells[idx] < estimate:
+                        estimate = cells[idx]
+                if estimate < 0xFFFFFFFFU:
+                    estimate += 1
+                for row in range(depth):
+                    idx = _cell(code, row, width)
+                    if cells[idx] < estimate:
+                        cells[idx] = estimate
+                if estimate >= min_estimate:
+                    codes_ptr[num_results] = code
+                    estimates_ptr[num_results] = estimate
+                    num_results += 1
+    resize_smart(result_codes, num_results)
+    resize_smart(result_estimates, num_results)
+    return num_kmers, result_codes, result_estimates
+
+def estimate_kmer(array table, Py_ssize_t width, unsigned long long code):
+    """
+    Returns the estimated count of the k-mer with 2-bit `code` in a
+    count-min sketch.
+    """
+    cdef unsigned int* cells = table.data.as_uints
+    cdef Py_ssize_t depth = len(table) // width
+    cdef Py_ssize_t row
+    cdef unsigned int estimate = 0xFFFFFFFFU
+    for row in range(depth):
+        if cells[_cell(code, row, width)] < estimate:
+            estimate = cells[_cell(code, row, width)]
+    return estimate
+
+def add_tables(array dest, array src):
+    """
+    Add the (saturating) counters in `src` to those in `dest`. Both are
+    arrays of type 'I' of the same size.
+    """
+    cdef unsigned int* dptr = dest.data.as_uints
+    cdef unsigned int* sptr = src.data.as_uints
+    cdef Py_ssize_t size = len(src)
+    cdef Py_ssize_t i
+    if size != len(dest):
+        raise ValueError("Tables are of different sizes")
+    with nogil:
+        for i in range(size):
+            if dptr[i] > 0xFFFFFFFFU - sptr[i]:
+                dptr[i] = 0xFFFFFFFFU
+            else:
+                dptr[i] += sptr[i]
@@ -0,0 +1,79 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Scanning of sequences with a multi-pattern (Aho-Corasick) automaton.
+"""
+from cpython.array cimport array
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from libc.string cimport memset
+
+def find_first(
+        array delta, bytes charmap, array out_start, array out_ids,
+        array lengths, str seq):
+    """
+    Find the first occurrence of each pattern in `seq`.
+
+    Args:
+        delta: array('i') of state transitions; the next state after reading
+            a character with code c in state s is delta[s * width + c], where
+            width = len(delta) // (len(out_start) - 1).
+        charmap: Code of each byte value. Bytes that do not occur in any
+            pattern have code width, and return the automaton to the root.
+        out_start, out_ids: array('i')s with the ids of the patterns that end
+            in each state s, i.e. out_ids[out_start[s]:out_start[s + 1]].
+        lengths: array('i') with the length of each pattern.
+        seq: The sequence to scan.
+
+    Returns:
+        An array('i') of alternating pattern ids and start positions, with
+        one pair for each pattern that occurs in `seq`.
+    """
+    cdef bytes data = seq.encode('latin-1')
+    cdef const unsigned char* ptr = data
+    cdef const unsigned char* codes = charmap
+    cdef Py_ssize_t size = len(data)
+    cdef Py_ssize_t num_states = len(out_start) - 1
+    cdef Py_ssize_t width = len(delta) // num_states
+    cdef Py_ssize_t num_patterns = len(lengths)
+    cdef int* trans = delta.data.as_ints
+    cdef int* starts = out_start.data.as_ints
+    cdef int* ids = out_ids.data.as_ints
+    cdef int* lens = lengths.data.as_ints
+    cdef Py_ssize_t i, j, num_hits = 0
+    cdef int state = 0
+    cdef int pattern
+    cdef unsigned char code
+    cdef int* hits
+    cdef unsigned char* seen
+    cdef array result
+    if num_patterns == 0:
+        return array('i')
+    hits = <int*> PyMem_Malloc(2 * num_patterns * sizeof(int))
+    seen = <unsigned char*> PyMem_Malloc(num_patterns)
+    if not hits or not seen:
+        PyMem_Free(hits)
+        PyMem_Free(seen)
+        raise MemoryError()
+    try:
+        with nogil:
+            memset(seen, 0, num_patterns)
+            for i in range(size):
+                code = codes[ptr[i]]
+                if code >= width:
+                    state = 0
+                    continue
+                state = trans[state * width + code]
+                for j in range(starts[state], starts[state + 1]):
+                    pattern = ids[j]
+                    if not seen[pattern]:
+                        seen[pattern] = 1
+                        hits[2 * num_hits] = pattern
+                        hits[2 * num_hits + 1] = i - lens[pattern] + 1
+                        num_hits += 1
+        result = array('i', bytes(8 * num_hits))
+        for i in range(2 * num_hits):
+            result.data.as_ints[i] = hits[i]
+        return result
+    finally:
+        PyMem_Free(hits)
+        PyMem_Free(seen)
@@ -2,8 +2,8 @@
 """
 from atropos.io import STDOUT, STDERR
 from atropos.commands.cli import (
-    BaseCommandParser, positive, readable_url, writeable_file,
-    readwriteable_file, probability)
+    BaseCommandParser, configure_threads, positive, int_or_str, readable_url,
+    writeable_file, readwriteable_file, probability)
 
 class CommandParser(BaseCommandParser):
     name = 'detect'
@@ -27,9 +27,13 @@ you don't know what are the adapter sequences.
         group.add_argument(
             "-d",
             "--detector",
-            choices=('known', 'heuristic', 'khmer'), default=None,
-            help="Which detector to use. (automatically choose based on other "
-                 "options)")
+            choices=('known', 'heuristic', 'sketch', 'khmer'), default=None,
+            help="Which detector to use. The heuristic detector keeps all "
+                 "distinct reads in memory, so memory use grows with "
+                 "--max-reads; the known detector keeps one hash per "
+                 "distinct read; the sketch detector uses constant memory. "
+                 "'khmer' is a deprecated alias for 'sketch'. (automatically "
+                 "choose based on other options)")
         group.add_argument(
             "-k",
             "--kmer-size",
@@ -133,9 +137,49 @@ you don't know what are the adapter sequences.
             type=positive(), default=None,
             help="The maximum number of candidate adapters to report. "
                  "(report all)")
+        
+        group = self.add_group(
+            "Parallel", title="Parallel (multi-core) options")
+        group.add_argument(
+            "-T",
+            "--threads",
+            type=positive(int, True), default=None, metavar="THREADS",
+            help="Number of threads to use for adapter detection. Reads are "
+                 "filtered and k-mers are counted in worker processes, and "
+                 "read1 and read2 of paired-end data are analyzed "
+                 "concurrently. For the heuristic detector, only the first "
+                 "k-mer counting pass runs in the workers, and the distinct "
+                 "reads are still all held in memory by the main process. "
+                 "Set to 0 to use max available threads. (Do not use "
+                 "multithreading)")
+        group.add_argument(
+            "--parallel-backend",
+            choices=("processes", "threads"), default="processes",
+            help="Whether worker threads are run in separate processes, or as "
+                 "threads of the main process. Threads avoid copying batches "
+                 "of reads between processes, but only the k-mer counting "
+                 "routines run outside of the interpreter lock. (processes)")
+        group.add_argument(
+            "--process-timeout",
+            type=positive(int, True), default=60, metavar="SECONDS",
+            help="Number of seconds process should wait before escalating "
+                 "messages to ERROR level. (60)")
+        group.add_argument(
+            "--read-queue-size",
+            type=int_or_str, default=None, metavar="SIZE",
+            help="Size of queue for batches of reads to be processed. "
+                 "(THREADS * 100)")
     
     def validate_command_options(self, options):
         options.report_file = options.output
+        if options.threads is not None:
+            threads = configure_threads(options, self.parser)
+            if options.read_queue_size is None:
+                options.read_queue_size = threads * 100
+            elif (
+                    options.read_queue_size > 0 and
+                    options.read_queue_size < threads):
+                self.parser.error("Read queue size must be >= than 'threads'")
         is_std = options.report_file in (STDOUT, STDERR)
         if options.fasta:
             if is_std and 'perinput' in options.fasta:
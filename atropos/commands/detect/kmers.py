@@ -0,0 +1,355 @@
+"""Counting of 2-bit packed k-mers, and assembly of frequent k-mers into
+longer sequences by walking the k-mer graph.
+"""
+from array import array
+from collections import Counter
+import copy
+
+try:
+    from ._kmers import (
+        encode_kmers, sketch_kmers, filter_kmers, update_kmers, estimate_kmer,
+        add_tables)
+except:
+    BASE_CODES = dict(zip('ACGTacgt', (0, 1, 2, 3) * 2))
+    MASK64 = (1 << 64) - 1
+    
+    def _mix64(value):
+        value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+        value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & MASK64
+        return value ^ (value >> 31)
+    
+    def _cells(code, depth, width):
+        for row in range(depth):
+            yield row * width + (
+                _mix64((code + (row + 1) * 0x9e3779b97f4a7c15) & MASK64) %
+                width)
+    
+    def encode_kmers(seq, k):
+        """Returns an array('Q') with the 2-bit code (A=0, C=1, G=2, T=3) of
+        each k-mer in `seq` that does not contain an ambiguous base.
+        """
+        if k < 1 or k > 32:
+            raise ValueError("K-mer size must be between 1 and 32")
+        codes = array('Q')
+        mask = (1 << (2 * k)) - 1
+        code = valid = 0
+        for base in seq:
+            base_code = BASE_CODES.get(base)
+            if base_code is None:
+                code = valid = 0
+                continue
+            code = ((code << 2) | base_code) & mask
+            valid += 1
+            if valid >= k:
+                codes.append(code)
+        return codes
+    
+    def sketch_kmers(table, width, seq, k):
+        """Add each k-mer in `seq` to a count-min sketch.
+        """
+        depth = len(table) // width
+        for code in encode_kmers(seq, k):
+            for idx in _cells(code, depth, width):
+                if table[idx] < 0xFFFFFFFF:
+                    table[idx] += 1
+    
+    def filter_kmers(table, width, seq, k, min_count):
+        """Returns an array('Q') with the codes of the k-mers in `seq` whose
+        estimated count in a count-min sketch is at least `min_count`.
+        """
+        depth = len(table) // width
+        return array('Q', (
+            code for code in encode_kmers(seq, k)
+            if all(
+                table[idx] >= min_count
+                for idx in _cells(code, depth, width))))
+    
+    def update_kmers(table, width, sequences, k, min_estimate):
+        """Add each k-mer in each of `sequences` to a count-min sketch using
+        conservative update. Returns a tuple (num_kmers, codes, estimates)
+        with the codes and new estimates of the k-mers whose new estimate is
+        at least `min_estimate`.
+        """
+        depth = len(table) // width
+        num_kmers = 0
+        codes = array('Q')
+        estimates = array('I')
+        for seq in sequences:
+            for code in encode_kmers(seq, k):
+                num_kmers += 1
+                cells = list(_cells(code, depth, width))
+                estimate = min(0xFFFFFFFF, min(table[idx] for idx in cells) + 1)
+                for idx in cells:
+                    if table[idx] < estimate:
+                        table[idx] = estimate
+                if estimate >= min_estimate:
+                    codes.append(code)
+                    estimates.append(estimate)
+        return num_kmers, codes, estimates
+    
+    def estimate_kmer(table, width, code):
+        """Returns the estimated count of a k-mer in a count-min sketch.
+        """
+        return min(
+            table[idx] for idx in _cells(code, len(table) // width, width))
+    
+    def add_tables(dest, src):
+        """Add the (saturating) counters in `src` to those in `dest`.
+        """
+        if len(src) != len(dest):
+            raise ValueError("Tables are of different sizes")
+        for idx, count in enumerate(src):
+            dest[idx] = min(0xFFFFFFFF, dest[idx] + count)
+
+MAX_KMER_SIZE = 32
+"""Maximum k-mer size that fits in a 64-bit integer."""
+
+def encode_kmer(kmer):
+    """Returns the 2-bit code of `kmer`.
+    """
+    codes = encode_kmers(kmer, len(kmer))
+    if len(codes) != 1:
+        raise ValueError("Invalid k-mer: {}".format(kmer))
+    return codes[0]
+
+def decode_kmer(code, k):
+    """Returns the k-mer string for the 2-bit `code` of a k-mer of size `k`.
+    """
+    return ''.join(
+        'ACGT'[(code >> (2 * i)) & 3] for i in range(k - 1, -1, -1))
+
+class KmerCounter(object):
+    """Counts the k-mers that occur at least `min_count` times in a
+    collection of sequences, in two passes. The first pass adds all k-mers
+    to a count-min sketch of fixed size; the second counts exactly only
+    those k-mers whose estimated count is at least `min_count`. Since the
+    sketch never underestimates, no frequent k-mer is missed.
+    
+    Args:
+        k: K-mer size.
+        width: Number of counters in each row of the sketch.
+        depth: Number of rows in the sketch.
+    """
+    def __init__(self, k, width=2**22, depth=4):
+        if not 1 <= k <= MAX_KMER_SIZE:
+            raise ValueError(
+                "K-mer size must be between 1 and {}".format(MAX_KMER_SIZE))
+        self.k = k
+        self.width = width
+        self.table = array('I')
+        self.table.frombytes(bytes(width * depth * self.table.itemsize))
+    
+    def add(self, seq):
+        """Add the k-mers in `seq` to the sketch (first pass).
+        """
+        sketch_kmers(self.table, self.width, seq, self.k)
+    
+    def merge(self, other):
+        """Merge the sketch of another :class:`KmerCounter` into this one.
+        """
+        if (self.k, self.width) != (other.k, other.width):
+            raise ValueError("Cannot merge sketches with different parameters")
+        add_tables(self.table, other.table)
+        return self
+    
+    def count_frequent(self, sequences, min_count):
+        """Count the k-mers that occur at least `min_count` times (second
+        pass). `sequences` must be the same sequences that were added.
+        
+        Returns:
+            A dict {code: count}.
+        """
+        counts = Counter()
+        for seq in sequences:
+            counts.update(filter_kmers(
+                self.table, self.width, seq, self.k, min_count))
+        return dict(
+            (code, count)
+            for code, count in counts.items()
+            if count >= min_count)
+
+class KmerSketch(object):
+    """Approximate counts of k-mers in a stream of sequences, in fixed memory.
+    All k-mers are added to a count-min sketch with conservative update, and
+    the (at most `capacity`) k-mers with the highest estimates are tracked.
+    
+    Sketches with the same parameters can be merged, e.g. to combine the
+    sketches of different worker processes. Merging adds the counters, so
+    the merged estimates are still upper bounds of the true counts.
+    
+    Args:
+        k: K-mer size.
+        width: Number of counters in each row of the sketch.
+        depth: Number of rows in the sketch.
+        capacity: Number of frequent k-mers to track.
+    """
+    def __init__(self, k, width=2**22, depth=4, capacity=1000):
+        if not 1 <= k <= MAX_KMER_SIZE:
+            raise ValueError(
+                "K-mer size must be between 1 and {}".format(MAX_KMER_SIZE))
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.table = array('I')
+        self.table.frombytes(bytes(width * depth * self.table.itemsize))
+        self.num_kmers = 0
+        self.tracked = {}
+        self._min_tracked = 1
+    
+    def add(self, seq):
+        """Add the k-mers in `seq`.
+        """
+        self.add_all((seq,))
+    
+    def add_all(self, sequences):
+        """Add the k-mers in each of `sequences`.
+        """
+        num_kmers, codes, estimates = update_kmers(
+            self.table, self.width, sequences, self.k, self._min_tracked)
+        self.num_kmers += num_kmers
+        # Estimates only increase, so later values for the same code win.
+        self.tracked.update(zip(codes, estimates))
+        if len(self.tracked) > 2 * self.capacity:
+            self._prune()
+    
+    def estimate(self, code):
+        """Returns the estimated count of the k-mer with 2-bit `code`.
+        """
+        return estimate_kmer(self.table, self.width, code)
+    
+    def _prune(self):
+        """Keep only the `capacity` tracked k-mers with the highest
+        estimates, and only track k-mers that are at least as frequent from
+        now on.
+        """
+        top = sorted(
+            self.tracked.items(), key=lambda item: (-item[1], item[0])
+        )[:self.capacity]
+        self.tracked = dict(top)
+        if top:
+            self._min_tracked = max(self._min_tracked, top[-1][1])
+    
+    def merge(self, other):
+        """Merge another :class:`KmerSketch` into this one.
+        """
+        if (
+                (self.k, self.width, self.depth) !=
+                (other.k, other.width, other.depth)):
+            raise ValueError("Cannot merge sketches with different parameters")
+        add_tables(self.table, other.table)
+        self.num_kmers += other.num_kmers
+        for code in set(self.tracked) | set(other.tracked):
+            self.tracked[code] = self.estimate(code)
+        self._min_tracked = max(self._min_tracked, other._min_tracked)
+        if len(self.tracked) > self.capacity:
+            self._prune()
+        return self
+    
+    def tracked_copy(self):
+        """Returns a copy of this sketch with the tracked k-mers but without
+        the counters, which can only be used to get the frequent k-mers.
+        """
+        sketch = copy.copy(self)
+        sketch.table = array('I')
+        sketch.tracked = dict(self.tracked)
+        return sketch
+    
+    def frequent(self, min_count=1):
+        """Returns the tracked k-mers with estimated count at least
+        `min_count`.
+        
+        Returns:
+            A list of tuples (kmer, count), in decreasing order of count.
+        """
+        return [
+            (decode_kmer(code, self.k), count)
+            for code, count in sorted(
+                self.tracked.items(), key=lambda item: (-item[1], item[0]))
+            if count >= min_count
+        ][:self.capacity]
+
+class KmerGraph(object):
+    """The de Bruijn graph of a set of k-mers, in which each k-mer is
+    connected to the k-mers that it overlaps by k-1 bases.
+    
+    Args:
+        counts: Dict {code: count} of the k-mers in the graph.
+        k: K-mer size.
+        max_length: Maximum length of an assembled sequence.
+        min_extension_frac: A path is only extended to a neighbor whose count
+            is at least this fraction of the count of the current k-mer. This
+            stops paths at the point where a contaminant joins the variable
+            part of the reads.
+    """
+    def __init__(self, counts, k, max_length=1000, min_extension_frac=0.5):
+        self.counts = counts
+        self.k = k
+        self.max_length = max_length
+        self.min_extension_frac = min_extension_frac
+        self._mask = (1 << (2 * k)) - 1
+        self._high_shift = 2 * (k - 1)
+    
+    def successors(self, code):
+        """Returns the codes of the k-mers that follow `code` in the graph.
+        """
+        prefix = (code << 2) & self._mask
+        return [
+            prefix | base for base in range(4)
+            if prefix | base in self.counts]
+    
+    def predecessors(self, code):
+        """Returns the codes of the k-mers that precede `code` in the graph.
+        """
+        suffix = code >> 2
+        return [
+            (base << self._high_shift) | suffix for base in range(4)
+            if (base << self._high_shift) | suffix in self.counts]
+    
+    def _walk(self, code, neighbors, visited):
+        """Follow the most abundant unvisited neighbor until there are none,
+        or the most abundant one is too rare to extend to.
+        """
+        path = []
+        max_steps = self.max_length - self.k
+        while len(path) < max_steps:
+            candidates = [
+                other for other in neighbors(code) if other not in visited]
+            if not candidates:
+                break
+            best = max(
+                candidates, key=lambda other: (self.counts[other], other))
+            if (self.counts[best] <
+                    self.counts[code] * self.min_extension_frac):
+                break
+            code = best
+            visited.add(code)
+            path.append(code)
+        return path
+    
+    def assemble(self):
+        """Greedily assemble k-mers into longer sequences. Starting from the
+        most abundant k-mer that is not already in a path, the path is
+        extended in both directions by following the most abundant
+        neighboring k-mer that is not already in a path, so that each k-mer
+        is in exactly one path, and each path spells out a sequence of which
+        every k-mer is in the graph.
+        
+        Returns:
+            A list of tuples (sequence, count), where count is the sum of the
+            counts of the k-mers in the sequence.
+        """
+        used = set()
+        results = []
+        for seed in sorted(
+                self.counts, key=lambda code: (-self.counts[code], code)):
+            if seed in used:
+                continue
+            used.add(seed)
+            right = self._walk(seed, self.successors, used)
+            left = self._walk(seed, self.predecessors, used)
+            path = left[::-1] + [seed] + right
+            seq = decode_kmer(path[0], self.k) + ''.join(
+                'ACGT'[code & 3] for code in path[1:])
+            results.append((seq, sum(self.counts[code] for code in path)))
+        return results
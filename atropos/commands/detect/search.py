@@ -0,0 +1,105 @@
+"""Searching for many patterns at once with an Aho-Corasick automaton.
+"""
+from array import array
+from collections import deque
+
+try:
+    from ._search import find_first
+except:
+    def find_first(delta, charmap, out_start, out_ids, lengths, seq):
+        """Returns an array('i') of alternating pattern ids and start
+        positions of the first occurrence of each pattern in `seq`.
+        """
+        num_states = len(out_start) - 1
+        width = len(delta) // num_states
+        seen = set()
+        hits = array('i')
+        state = 0
+        for i, char in enumerate(seq.encode('latin-1')):
+            code = charmap[char]
+            if code >= width:
+                state = 0
+                continue
+            state = delta[state * width + code]
+            for pattern in out_ids[out_start[state]:out_start[state + 1]]:
+                if pattern not in seen:
+                    seen.add(pattern)
+                    hits.extend((pattern, i - lengths[pattern] + 1))
+        return hits
+
+class PatternSearch(object):
+    """Finds the first occurrence of each of a set of patterns in a sequence
+    with a single scan of the sequence, using an Aho-Corasick automaton that
+    is compiled to a table of state transitions.
+    
+    Args:
+        patterns: Sequence of (non-empty) pattern strings.
+    """
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        if any(len(pattern) == 0 for pattern in self.patterns):
+            raise ValueError("Patterns cannot be empty")
+        alphabet = sorted(set(''.join(self.patterns)))
+        width = len(alphabet)
+        if width > 255:
+            raise ValueError("Too many distinct characters in patterns")
+        codes = dict((char, code) for code, char in enumerate(alphabet))
+        charmap = bytearray([width] * 256)
+        for char, code in codes.items():
+            charmap[ord(char)] = code
+        self.charmap = bytes(charmap)
+        
+        # Build the trie of patterns.
+        trie = [{}]
+        outputs = [[]]
+        for idx, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                code = codes[char]
+                if code not in trie[state]:
+                    trie.append({})
+                    outputs.append([])
+                    trie[state][code] = len(trie) - 1
+                state = trie[state][code]
+            outputs[state].append(idx)
+        
+        # Add the failure transitions in breadth-first order, so that each
+        # state's transitions are complete once its children are visited.
+        num_states = len(trie)
+        delta = array('i', bytes(4 * num_states * width))
+        queue = deque()
+        for code in range(width):
+            child = trie[0].get(code)
+            if child is not None:
+                delta[code] = child
+                queue.append((child, 0))
+        while queue:
+            state, fail = queue.popleft()
+            outputs[state].extend(outputs[fail])
+            for code in range(width):
+                child = trie[state].get(code)
+                if child is None:
+                    delta[state * width + code] = delta[fail * width + code]
+                else:
+                    delta[state * width + code] = child
+                    queue.append((child, delta[fail * width + code]))
+        
+        self.delta = delta
+        self.out_start = array('i', [0])
+        self.out_ids = array('i')
+        for output in outputs:
+            self.out_ids.extend(output)
+            self.out_start.append(len(self.out_ids))
+        self.lengths = array('i', (len(pattern) for pattern in self.patterns))
+    
+    def find_first(self, seq):
+        """Find the first occurrence of each pattern in `seq`.
+        
+        Returns:
+            A list of tuples (pattern_index, start), one for each pattern that
+            occurs in `seq`.
+        """
+        hits = find_first(
+            self.delta, self.charmap, self.out_start, self.out_ids,
+            self.lengths, seq)
+        return list(zip(hits[::2], hits[1::2]))
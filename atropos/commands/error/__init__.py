@@ -1,13 +1,19 @@
 """Estimate the empircal error rate.
 """
+from array import array
 from collections import defaultdict
-import csv
+from itertools import repeat
+import logging
+import math
 import re
 from atropos import AtroposError
 from atropos.commands.base import (
-    BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
-from atropos.io import open_output
-from atropos.util import qual2prob, run_interruptible
+    BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin,
+    ConvergenceMonitor)
+from atropos.commands.multicore import (
+    ParallelPipelineMixin, ParallelPipelineRunner)
+from atropos.commands.stats import add_error_probs, hash_sequence
+from atropos.util import Mergeable, run_interruptible
 
 class CommandRunner(BaseCommandRunner):
     name = 'error'
@@ -17,27 +23,66 @@ class CommandRunner(BaseCommandRunner):
             raise ValueError(
                 "Cannot estimate error rate without base qualities")
         
+        estimator_args = dict(max_read_len=self.max_bases)
         if self.algorithm == 'quality':
             estimator_class = BaseQualityErrorEstimator
+            estimator_args['quality_base'] = self.quality_base
         elif self.algorithm == 'shadow':
             estimator_class = ShadowRegressionErrorEstimator
         
-        estimator_args = dict(max_read_len=self.max_bases)
         if self.paired:
             estimator = PairedErrorEstimator(
                 estimator_class=estimator_class, **estimator_args)
         else:
             estimator = estimator_class(**estimator_args)
         
-        self.summary['errorrate'] = estimator_args
+        self.summary['errorrate'] = dict(max_read_len=self.max_bases)
+        
+        if self.threads is None:
+            if self.until_converged:
+                estimator.convergence = ConvergenceMonitor(
+                    self.convergence_tolerance, self.convergence_batches,
+                    'error_rate')
+            self.summary.update(mode='serial', threads=1)
+            return run_interruptible(estimator, self, raise_on_error=True)
+        else:
+            self.summary.update(mode='parallel', threads=self.threads)
+            return self.run_parallel(estimator)
+    
+    def run_parallel(self, estimator):
+        """Execute error in parallel mode. Worker processes collect
+        statistics in batches; their estimators are then merged, and the
+        error rate is estimated in the main process.
+        
+        Args:
+            estimator: The :class:`ErrorEstimator` or
+                :class:`PairedErrorEstimator` to copy to the workers.
+        
+        Returns:
+            The return code.
+        """
+        logging.getLogger().debug(
+            "Starting atropos error in parallel mode with threads=%d, "
+            "timeout=%d", self.threads, self.process_timeout)
+        
+        if self.threads < 2:
+            raise ValueError("'threads' must be >= 2")
         
-        # currently only single-threaded operation is supproted
-        self.summary.update(mode='serial', threads=1)
-        return run_interruptible(estimator, self, raise_on_error=True)
+        runner = ParallelPipelineRunner(
+            self, EstimatorWorkerPipeline(estimator))
+        retcode = runner.run()
+        if retcode == 0:
+            estimator = self.summary.pop('estimator')
+            self.summary['errorrate'].update(estimator.summarize())
+        return retcode
 
-class ErrorEstimator(SingleEndPipelineMixin, Pipeline):
-    """Base class for error estimators.
+class ErrorEstimator(SingleEndPipelineMixin, Pipeline, Mergeable):
+    """Base class for error estimators. Estimators are mergeable, so that
+    reads can be processed in separate workers whose estimators are merged
+    before the error rate is estimated.
     """
+    supports_batch = False
+    
     def __init__(self, max_read_len):
         super().__init__()
         self.total_len = 0
@@ -51,68 +96,151 @@ class ErrorEstimator(SingleEndPipelineMixin, Pipeline):
         """
         raise NotImplementedError()
     
-    def finish(self, summary, **kwargs):
-        super().finish(summary)
+    def merge(self, other):
+        if not isinstance(other, type(self)):
+            raise ValueError("Cannot merge {}".format(other))
+        self.total_len += other.total_len
+        return self
+    
+    def summarize(self):
+        """Returns a dict with the estimate, the total length of the reads
+        and the details of the estimate.
+        """
         estimate, details = self.estimate()
-        summary['errorrate'].update(
-            estimate=(estimate,), 
+        return dict(
+            estimate=(estimate,),
             total_len=(self.total_len,),
             details=(details,))
+    
+    def finish(self, summary, **kwargs):
+        super().finish(summary)
+        summary['errorrate'].update(self.summarize())
 
 class BaseQualityErrorEstimator(ErrorEstimator):
     """Simple error estimation using base qualities. It is well-known that base
     qualities significantly overestimate true error rates, so take the estimate
     with a grain of salt.
+    
+    The error probabilities of the bases of each batch of reads are looked up
+    in a table, and summed separately for each cycle.
+    
+    Args:
+        max_read_len: The maximum number of bases (starting from the 5' end)
+            to consider from each read.
+        quality_base: Base for quality values.
     """
-    def __init__(self, max_read_len=None):
+    supports_batch = True
+    
+    def __init__(self, max_read_len=None, quality_base=33):
         super().__init__(max_read_len)
-        self.total_qual = 0.0
+        self.quality_base = quality_base
+        self.lut = array('d', (
+            10 ** (-(code - quality_base) / 10) for code in range(256)))
+        self.cycle_probs = array('d')
+        self.cycle_counts = array('Q')
+    
+    @property
+    def total_qual(self):
+        """The sum of the error probabilities of all bases.
+        """
+        return sum(self.cycle_probs)
+    
+    def handle_records(self, context, records):
+        self.handle_batch(context, records)
     
     def handle_reads(self, context, read1, read2=None):
-        quals = read1.qualities
-        readlen = len(quals)
-        if self.max_read_len and self.max_read_len < readlen:
-            readlen = self.max_read_len
-            quals = quals[:readlen]
-        self.total_qual += sum(qual2prob(qchar) for qchar in quals)
-        self.total_len += readlen
+        self.handle_reads_batch(context, (read1,))
+    
+    def handle_reads_batch(self, context, reads1, reads2=None):
+        qualities = [read.qualities for read in reads1]
+        if not qualities:
+            return
+        max_len = max(len(quals) for quals in qualities)
+        if self.max_read_len:
+            max_len = min(max_len, self.max_read_len)
+        self._resize(max_len)
+        self.total_len += add_error_probs(
+            self.cycle_probs, self.cycle_counts, self.lut, qualities)
+    
+    def _resize(self, size):
+        extra = size - len(self.cycle_probs)
+        if extra > 0:
+            self.cycle_probs.extend(repeat(0.0, extra))
+            self.cycle_counts.extend(repeat(0, extra))
+    
+    def merge(self, other):
+        super().merge(other)
+        if self.quality_base != other.quality_base:
+            raise ValueError("Cannot merge estimators with different bases")
+        self._resize(len(other.cycle_probs))
+        for cycle, (prob, count) in enumerate(zip(
+                other.cycle_probs, other.cycle_counts)):
+            self.cycle_probs[cycle] += prob
+            self.cycle_counts[cycle] += count
+        return self
     
     def estimate(self):
-        return (self.total_qual / self.total_len, None)
+        per_cycle = [
+            (cycle, prob / count)
+            for cycle, (prob, count) in enumerate(zip(
+                self.cycle_probs, self.cycle_counts), 1)
+            if count > 0]
+        return (self.total_qual / self.total_len, dict(per_cycle=per_cycle))
+    
+    def convergence_metrics(self):
+        total_qual = self.total_qual
+        return (
+            (total_qual / self.total_len if self.total_len else 0,),
+            (total_qual, self.total_len))
 
 # Error estimation using shadow counts
-# DEPRECATED
-# TODO: Replace with Zhu et al. cubic splines method or something faster
+# TODO: Consider the Zhu et al. cubic splines method
 # https://bmcbioinformatics.biomedcentral.com/articles/10.1186/s12859-016-1052-3
 
 FILTER_RE = re.compile("A+|C+|G+|T+|.*N.*")
 
-SHADOW_REGRESSION_R_SCRIPT = """
-library(ShadowRegression)
-errorRates = getErrorRates("{reads}", type="{method}")
-write.table(errorRates$perReadER, "{per_read}", sep="\t", quote=F, col.names=F,
-            row.names=T)
-write.table(errorRates$cycleER, "{per_cycle}", sep="\t", quote=F, col.names=F,
-            row.names=T)
-"""
-
 class ShadowRegressionErrorEstimator(ErrorEstimator):
     """Re-implementation of the shadow regression method described in:
     Wang et al., "Estimation of sequencing error rates in short reads",
         BMC Bioinformatics 2012 13:185, DOI: 10.1186/1471-2105-13-185
     
+    Reads that occur at least `min_founder_count` times are 'founders', and
+    reads that differ from a founder by a single substitution are its
+    'shadows'. The number of shadows of a founder is proportional to the
+    total number of copies of the founder (including its shadows), and the
+    slope `s` of the linear regression of shadow counts on total counts is
+    the fraction of reads with one error among those with at most one error.
+    The same regression, restricted to the shadows that differ from their
+    founder at cycle i, gives a slope `s_i` from which the error rate of
+    cycle i is `s_i / (1 - s + s_i)`.
+    
+    To bound memory, only a uniform sample of (at most `capacity`) distinct
+    read sequences is retained. A sequence is retained if the lowest `level`
+    bits of its hash are zero; the level is increased whenever the sample
+    grows beyond `capacity`. Shadow counts are scaled by the sampling rate.
+    
     Args:
         method: The differences that are considered in the error rate
-            calculation; sub = substitutions, indel = insertions and
-            deletions; all = both substitutions and indels.
+            calculation; only 'sub' (substitutions) is currently supported.
         max_read_len: The maximum number of bases (starting from the 5' end)
             to consider from each read.
+        min_founder_count: The minimum number of copies of a read for it to
+            be considered a founder.
+        capacity: The maximum number of distinct read sequences to retain.
     """
-    def __init__(self, method='sub', max_read_len=None, rscript_exe="Rscript"):
+    def __init__(
+            self, method='sub', max_read_len=None, min_founder_count=2,
+            capacity=2**18):
+        if method != 'sub':
+            raise ValueError(
+                "Unsupported shadow regression method: {}".format(method))
         super().__init__(max_read_len)
-        self.seqs = defaultdict(lambda: 0)
         self.method = method
-        self.rscript_exe = rscript_exe
+        self.min_founder_count = min_founder_count
+        self.capacity = capacity
+        self.seqs = defaultdict(int)
+        self.level = 0
+        self._mask = 0
     
     def handle_reads(self, context, read1, read2=None):
         seq = read1.sequence
@@ -122,65 +250,147 @@ class ShadowRegressionErrorEstimator(ErrorEstimator):
             seq = seq[:readlen]
         if FILTER_RE.fullmatch(seq):
             return
-        self.seqs[seq] += 1
         self.total_len += readlen
+        if self._mask and hash_sequence(seq) & self._mask:
+            return
+        self.seqs[seq] += 1
+        if len(self.seqs) > self.capacity:
+            self._prune(self.level + 1)
+    
+    def _prune(self, level):
+        while True:
+            mask = (1 << level) - 1
+            seqs = defaultdict(int, (
+                (seq, count) for seq, count in self.seqs.items()
+                if not hash_sequence(seq) & mask))
+            if len(seqs) <= self.capacity:
+                break
+            level += 1
+        self.level = level
+        self._mask = mask
+        self.seqs = seqs
+    
+    def merge(self, other):
+        super().merge(other)
+        for seq, count in other.seqs.items():
+            self.seqs[seq] += count
+        level = max(self.level, other.level)
+        if level > self.level or len(self.seqs) > self.capacity:
+            self._prune(level)
+        return self
+    
+    def count_shadows(self):
+        """Identify founders and count their shadows.
+        
+        Returns:
+            A list of tuples (founder, founder_count, shadow_counts), where
+            shadow_counts is a list of the number of shadows that differ from
+            the founder at each cycle, scaled by the sampling rate.
+        """
+        seqs = self.seqs
+        scale = float(2 ** self.level)
+        founders = []
+        shadows = set()
+        candidates = [
+            (seq, count) for seq, count in seqs.items()
+            if count >= self.min_founder_count]
+        candidates.sort(key=lambda item: (-item[1], item[0]))
+        for seq, count in candidates:
+            if seq in shadows:
+                continue
+            shadow_counts = [0.0] * len(seq)
+            for i, base in enumerate(seq):
+                prefix = seq[:i]
+                suffix = seq[i+1:]
+                for other_base in 'ACGT':
+                    if other_base == base:
+                        continue
+                    neighbor = prefix + other_base + suffix
+                    if neighbor in seqs and neighbor not in shadows:
+                        shadows.add(neighbor)
+                        shadow_counts[i] += seqs[neighbor] * scale
+            shadows.add(seq)
+            founders.append((seq, count, shadow_counts))
+        return founders
     
     def estimate(self):
-        # This is a temporary solution that requires R and the
-        # ShadowRegression package. Eventually, this will be
-        # replaced with a pure-python implementation.
-        import os
-        import subprocess
-        import tempfile
+        founders = self.count_shadows()
+        if len(founders) < 3:
+            raise AtroposError(
+                "Too few reads occur at least {} times for shadow "
+                "regression".format(self.min_founder_count))
+        totals = [
+            count + sum(shadow_counts) for _, count, shadow_counts in founders]
+        slope, intercept, stderr = _regress(totals, [
+            sum(shadow_counts) for _, _, shadow_counts in founders])
+        if slope >= 1:
+            raise AtroposError(
+                "Shadow regression slope {} is too large to estimate an "
+                "error rate".format(slope))
         
-        tempfiles = (tempfile.mkstemp()[1] for i in range(4))
-        read_counts, per_read, per_cycle, script_file = tempfiles
-        try:
-            # write counts to a file
-            with open(read_counts, 'wt') as out:
-                self._write_read_counts(out)
-            
-            # execute R script
-            script = SHADOW_REGRESSION_R_SCRIPT.format(
-                reads=read_counts, method=self.method, per_read=per_read,
-                per_cycle=per_cycle)
-            with open(script_file, 'wt') as out:
-                out.write(script)
-            proc = subprocess.Popen(
-                [self.rscript_exe, "--vanilla", script_file],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            with proc:
-                stdout, stderr = proc.communicate()
-                if proc.returncode != 0:
-                    raise AtroposError(
-                        "R script failed: rc={}; stdout={}; stderr={}".format(
-                            proc.returncode, stdout, stderr))
-            
-            # read the results
-            with open(per_read, 'rt') as i:
-                reader = csv.reader(i, delimiter="\t")
-                per_read_error = dict(reader)
-                if len(per_read_error) != 4:
-                    raise AtroposError("Invalid output from R script")
-            with open(per_cycle, 'rt') as i:
-                reader = csv.reader(i, delimiter="\t")
-                per_cycle_error = list(row[0:3] for row in reader)
-                if not per_cycle_error:
-                    raise AtroposError("Invalid output from R script")
-            
-            return (
-                per_read_error["error rate"],
-                dict(per_read=per_read_error, per_cycle=per_cycle_error))
-        finally:
-            for path in tempfiles:
-                os.remove(path)
-    
-    def _write_read_counts(self, fileobj):
-        writer = csv.writer(fileobj, delimiter=" ")
-        writer.writerows(sorted(
-            self.seqs.items(), reverse=True, key=lambda i: i[1]))
+        per_cycle = []
+        max_len = max(len(seq) for seq, _, _ in founders)
+        for cycle in range(max_len):
+            cycle_totals = []
+            cycle_shadows = []
+            for total, (seq, _, shadow_counts) in zip(totals, founders):
+                if cycle < len(seq):
+                    cycle_totals.append(total)
+                    cycle_shadows.append(shadow_counts[cycle])
+            if len(cycle_totals) < 3:
+                break
+            # Later cycles are only covered by the longer founders, which
+            # may be too few (or too uniform) to regress on.
+            try:
+                cycle_slope, _, cycle_stderr = _regress(
+                    cycle_totals, cycle_shadows)
+            except AtroposError:
+                break
+            # The ratio of reads with an error at this cycle to error-free
+            # reads is cycle_slope / (1 - slope), which is rate / (1 - rate).
+            denom = 1 - slope + cycle_slope
+            if denom <= 0:
+                continue
+            per_cycle.append((
+                cycle + 1, cycle_slope / denom, cycle_stderr / denom))
+        
+        if not per_cycle:
+            raise AtroposError(
+                "Could not estimate a per-cycle error rate by shadow "
+                "regression")
+        error_rate = sum(rate for _, rate, _ in per_cycle) / len(per_cycle)
+        mean_len = sum(len(seq) for seq, _, _ in founders) / len(founders)
+        per_read_error = {
+            "intercept": intercept,
+            "slope": slope,
+            "standard error": stderr / ((1 - slope) ** 2 * mean_len),
+            "error rate": error_rate
+        }
+        return (
+            error_rate, dict(per_read=per_read_error, per_cycle=per_cycle))
+
+def _regress(xvals, yvals):
+    """Simple linear regression of `yvals` on `xvals`.
+    
+    Returns:
+        Tuple (slope, intercept, standard error of the slope).
+    """
+    num = len(xvals)
+    xmean = sum(xvals) / num
+    ymean = sum(yvals) / num
+    sxx = sum((x - xmean) ** 2 for x in xvals)
+    if sxx == 0:
+        raise AtroposError(
+            "Shadow regression requires founders with different counts")
+    sxy = sum((x - xmean) * (y - ymean) for x, y in zip(xvals, yvals))
+    slope = sxy / sxx
+    intercept = ymean - slope * xmean
+    ssr = sum(
+        (y - intercept - slope * x) ** 2 for x, y in zip(xvals, yvals))
+    stderr = math.sqrt(ssr / (num - 2) / sxx) if num > 2 else 0.0
+    return slope, intercept, stderr
 
-class PairedErrorEstimator(PairedEndPipelineMixin, Pipeline):
+class PairedErrorEstimator(PairedEndPipelineMixin, Pipeline, Mergeable):
     """Estimator for a pair of input files.
     """
     def __init__(
@@ -189,20 +399,69 @@ class PairedErrorEstimator(PairedEndPipelineMixin, Pipeline):
         self.estimator1 = estimator_class(**kwargs)
         self.estimator2 = estimator_class(**kwargs)
     
+    def handle_records(self, context, records):
+        if self.estimator1.supports_batch:
+            self.handle_batch(context, records)
+        else:
+            super().handle_records(context, records)
+    
     def handle_reads(self, context, read1, read2):
         self.estimator1.handle_reads(context, read1)
         self.estimator2.handle_reads(context, read2)
     
-    def finish(self, summary, **kwargs):
+    def handle_reads_batch(self, context, reads1, reads2):
+        self.estimator1.handle_reads_batch(context, reads1)
+        self.estimator2.handle_reads_batch(context, reads2)
+    
+    def merge(self, other):
+        """Merge the read1 and read2 estimators of another
+        :class:`PairedErrorEstimator` into this one.
+        """
+        self.estimator1.merge(other.estimator1)
+        self.estimator2.merge(other.estimator2)
+        return self
+    
+    def convergence_metrics(self):
+        metrics1, (total1, count1) = self.estimator1.convergence_metrics()
+        metrics2, (total2, count2) = self.estimator2.convergence_metrics()
+        return (
+            tuple(metrics1) + tuple(metrics2),
+            (total1 + total2, count1 + count2))
+    
+    def summarize(self):
         """Estimate error rates.
         
         Returns:
-            Tuple (read1_estimate, read2_estimate).
+            A dict with tuples (read1_value, read2_value) of the estimate, the
+            total length of the reads and the details of the estimate.
         """
-        super().finish(summary)
         estimate1, details1 = self.estimator1.estimate()
         estimate2, details2 = self.estimator2.estimate()
-        summary['errorrate'].update(
+        return dict(
             estimate=(estimate1, estimate2),
             total_len=(self.estimator1.total_len, self.estimator2.total_len),
             details=(details1, details2))
+    
+    def finish(self, summary, **kwargs):
+        super().finish(summary)
+        summary['errorrate'].update(self.summarize())
+
+class EstimatorWorkerPipeline(ParallelPipelineMixin, Pipeline):
+    """Pipeline that feeds the batches received by a worker to an estimator.
+    Instead of the estimate, the estimator itself is added to the summary, so
+    that the estimators of all workers are merged (in the main process)
+    before the error rate is estimated.
+    
+    Args:
+        estimator: An :class:`ErrorEstimator` or :class:`PairedErrorEstimator`.
+    """
+    def __init__(self, estimator):
+        super().__init__()
+        self.estimator = estimator
+    
+    def handle_records(self, context, records):
+        self.estimator.handle_records(context, records)
+    
+    def finish(self, summary, worker=None):
+        super().finish(summary, worker=worker)
+        summary['estimator'] = self.estimator
@@ -1,6 +1,7 @@
 """Command-line interface for the error command.
 """
-from atropos.commands.cli import BaseCommandParser, writeable_file
+from atropos.commands.cli import (
+    BaseCommandParser, configure_threads, positive, int_or_str, writeable_file)
 from atropos.io import STDOUT
 
 class CommandParser(BaseCommandParser):
@@ -19,7 +20,7 @@ error rate."""
     def add_command_options(self):
         parser = self.parser
         parser.set_defaults(
-            max_reads=10000,
+            max_reads=None,
             counter_magnitude="K",
             report_formats=['txt'])
         group = self.add_group("Error Estimation")
@@ -28,8 +29,8 @@ error rate."""
             "--algorithm",
             choices=('quality', 'shadow'), default="quality",
             help="Method for estimating error rates; quality = base qualities, "
-                 "shadow = shadow regression. Be advised that the 'shadow' "
-                 "method is incredibly slow.")
+                 "shadow = shadow regression. The 'shadow' method requires "
+                 "that some reads occur several times, e.g. amplicon data.")
         group.add_argument(
             "-m",
             "--max-bases",
@@ -37,6 +38,34 @@ error rate."""
             help="Maximum number of bases to use in the error calculation, "
                  "starting from the 5' end of the read.")
         
+        self.add_convergence_options()
+        
+        group = self.add_group(
+            "Parallel", title="Parallel (multi-core) options")
+        group.add_argument(
+            "-T",
+            "--threads",
+            type=positive(int, True), default=None, metavar="THREADS",
+            help="Number of threads to use for error estimation. Set to 0 to "
+                 "use max available threads. (Do not use multithreading)")
+        group.add_argument(
+            "--parallel-backend",
+            choices=("processes", "threads"), default="processes",
+            help="Whether worker threads are run in separate processes, or as "
+                 "threads of the main process. Threads avoid copying batches "
+                 "of reads between processes, but only the base quality "
+                 "routines run outside of the interpreter lock. (processes)")
+        group.add_argument(
+            "--process-timeout",
+            type=positive(int, True), default=60, metavar="SECONDS",
+            help="Number of seconds process should wait before escalating "
+                 "messages to ERROR level. (60)")
+        group.add_argument(
+            "--read-queue-size",
+            type=int_or_str, default=None, metavar="SIZE",
+            help="Size of queue for batches of reads to be processed. "
+                 "(THREADS * 100)")
+        
         group = self.add_group("Output")
         group.add_argument(
             "-o",
@@ -57,3 +86,21 @@ error rate."""
     
     def validate_command_options(self, options):
         options.report_file = options.output
+        if options.until_converged:
+            if options.algorithm != 'quality':
+                self.parser.error(
+                    "--until-converged is only supported with the 'quality' "
+                    "algorithm")
+            if options.threads is not None:
+                self.parser.error(
+                    "--until-converged is not supported with multiple threads")
+        elif options.max_reads is None:
+            options.max_reads = 10000
+        if options.threads is not None:
+            threads = configure_threads(options, self.parser)
+            if options.read_queue_size is None:
+                options.read_queue_size = threads * 100
+            elif (
+                    options.read_queue_size > 0 and
+                    options.read_queue_size < threads):
+                self.parser.error("Read queue size must be >= than 'threads'")
@@ -5,7 +5,8 @@ TODO: move reporting functionality out of the ErrorEstimator class.
 from itertools import repeat
 from atropos.commands.reports import BaseReportGenerator
 from atropos.io import open_output
-from atropos.commands.legacy_report import Printer, TitlePrinter
+from atropos.commands.legacy_report import (
+    Printer, TitlePrinter, print_convergence_report)
 
 class ReportGenerator(BaseReportGenerator):
     def generate_text_report(self, fmt, summary, outfile, **kwargs):
@@ -36,6 +37,10 @@ def generate_reports(outstream, summary):
             sum(err * total_len for err, total_len in zip(estimates, total_lens)) / 
             sum(total_lens))
         print("Error rate: {:.2%}".format(overall_err), file=outstream)
+    
+    if 'convergence' in summary:
+        _print.newline()
+        print_convergence_report(summary['convergence'], _print)
 
 def generate_estimator_report(
         outstream, input_idx, estimate, details, _print, _print_title, 
@@ -51,12 +56,15 @@ def generate_estimator_report(
     _print("Error rate: {:.2%}".format(estimate))
     if details:
         _print("Details:\n")
-        per_read = details['per_read']
         per_cycle = details['per_cycle']
         
-        _print_indent("StdErr: {:.2%}".format(per_read['standard error']))
+        if 'per_read' in details:
+            _print_indent("StdErr: {:.2%}".format(
+                details['per_read']['standard error']))
         _print_indent("Per-cycle rates:")
         for cycle in per_cycle:
-            _print_indent(
-                "Cycle: {}, Error: {:.2%}, StdErr: {:.2%}".format(*cycle), 
-                indent=2)
+            if len(cycle) > 2:
+                line = "Cycle: {}, Error: {:.2%}, StdErr: {:.2%}"
+            else:
+                line = "Cycle: {}, Error: {:.2%}"
+            _print_indent(line.format(*cycle), indent=2)
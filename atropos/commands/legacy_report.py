@@ -277,7 +277,36 @@ def print_summary_report(summary, outfile):
     _print("Start time: {}".format(timing['start']))
     _print(*wctime)
     _print("CPU time (main process): {0:.2F} s".format(timing['cpu']))
+    if 'workers' in summary:
+        _print("Worker throughput:")
+        for name, worker in sorted(summary['workers'].items()):
+            _print(
+                "{}: {:,} records in {:.2F} s ({:.0F} records/s)".format(
+                    name, worker['records'], worker['wallclock'],
+                    worker['records'] / max(worker['wallclock'], 1E-6)),
+                indent=INDENT)
     _print()
+    
+    if 'convergence' in summary:
+        print_convergence_report(summary['convergence'], _print)
+        _print()
+
+def print_convergence_report(convergence, _print):
+    """Print a summary of convergence-based early stopping.
+    
+    Args:
+        convergence: The convergence summary dict.
+        _print: The Printer to use.
+    """
+    _print("Statistics {} after {} reads ({} batches).".format(
+        "converged" if convergence['converged'] else "did not converge",
+        convergence['reads'], convergence['batches']))
+    if convergence['estimate'] is not None:
+        interval = convergence['confidence_interval']
+        _print("Estimated {}: {:.4G}{}".format(
+            convergence['estimate_name'].replace('_', ' '),
+            convergence['estimate'],
+            " (95% CI: {:.4G}-{:.4G})".format(*interval) if interval else ""))
 
 def print_trim_report(summary, outfile):
     """Print the trimming report.
@@ -538,7 +567,7 @@ def print_adapter_report(adapters, outfile, paired, total_records, max_width):
             return True
         _print()
         return False
-        
+    
     warning = False
     for pair in range(2 if paired else 1):
         if adapters[pair] is None:
@@ -664,7 +693,7 @@ def print_pre_trim_report(summary, outfile):
             _print("Read {}: {}".format(read, src))
         _print()
         print_stats_report(data, outfile)
-    
+
 def print_post_trim_report(summary, outfile):
     """Print post-trimming stats.
     
@@ -794,6 +823,53 @@ def print_stats_report(data, outfile):
         data['read2']['gc']['hist'])
     _print()
     
+    if 'sketches' in data['read1']:
+        sketches = [data['read1']['sketches']]
+        if paired:
+            sketches.append(data['read2']['sketches'])
+        _print_title("Sequence duplication:", level=2)
+        _print(
+            "Distinct sequences (estimated):",
+            *(sketch['distinct'] for sketch in sketches))
+        _print(
+            "Duplicate sequences (%):",
+            *(sketch['duplicate_pct'] for sketch in sketches))
+        _print()
+        _print_title(
+            "Sequence duplication levels (% of distinct, % of total)",
+            level=2)
+        for level in sketches[0]['duplication_levels']['rows'].keys():
+            _print(level, *(
+                pct
+                for sketch in sketches
+                for pct in sketch['duplication_levels']['rows'][level]))
+        _print()
+        for read, sketch in enumerate(sketches, 1):
+            _print_title(
+                "Read {} overrepresented sequences".format(read), level=2)
+            if sketch['overrepresented']:
+                _print('Sequence', 'Count', '%', header=True)
+                for seq, count, pct in sketch['overrepresented']:
+                    _print(seq, count, pct)
+            else:
+                _print("None")
+            _print()
+    
+    if 'kmers' in data['read1']:
+        for read in (1, 2) if paired else (1,):
+            kmers = data['read{}'.format(read)]['kmers']
+            _print_title(
+                "Read {} positionally enriched {}-mers".format(
+                    read, kmers['k']),
+                level=2)
+            if kmers['rows']:
+                _print(*kmers['columns'], header=True)
+                for row in kmers['rows']:
+                    _print(*row[:4], 'yes' if row[4] else 'no')
+            else:
+                _print("None")
+            _print()
+    
     if 'tile_sequence_qualities' in data['read1']:
         _print_tile_histogram(
             "Read 1 per-tile sequence qualities (%)",
@@ -1,10 +1,13 @@
 """Classes and methods to support parallelization of operations.
 """
+import copy
 import inspect
 import logging
 from multiprocessing import Process, Value, Queue
 import os
+import queue
 from queue import Empty, Full
+from threading import Thread
 import time
 from atropos import AtroposError
 from atropos.util import run_interruptible
@@ -12,6 +15,9 @@ from atropos.util import run_interruptible
 RETRY_INTERVAL = 5
 """Max time to wait between retrying operations."""
 
+SUMMARY_INTERVAL = 30
+"""Min time between the summary deltas sent by a worker."""
+
 # Control values
 CONTROL_ACTIVE = 0
 """Controlled process should run normally."""
@@ -140,35 +146,52 @@ class ParallelPipelineMixin(object):
     def start(self, **kwargs):
         super().start(**kwargs)
         self.seen_batches = set()
+        self.num_records = 0
+        self.start_time = time.time()
     
     def process_batch(self, batch):
         self.seen_batches.add(batch[0]['index'])
+        self.num_records += batch[0]['size']
         super().process_batch(batch)
     
     def finish(self, summary, worker=None):
         super().finish(summary, worker=worker)
+        wallclock = time.time() - self.start_time
+        records = self.num_records
         logging.getLogger().debug(
-            "%s finished; processed %d batches, %d reads",
-            worker.name, len(self.seen_batches),
-            sum(self.record_counts.values()))
+            "%s finished; processed %d batches, %d reads in %.2f s",
+            worker.name, len(self.seen_batches), records, wallclock)
+        summary['workers'] = {
+            worker.name: dict(
+                batches=len(self.seen_batches),
+                records=records,
+                wallclock=wallclock)
+        }
 
-class WorkerProcess(Process):
-    """Parent class for worker processes that execute Pipelines.
+class WorkerMixin(object):
+    """Implements the `run` method of workers that execute Pipelines. Must be
+    mixed in with Process or Thread.
     
     Args:
-        index: A unique ID for the process.
+        index: A unique ID for the worker.
         input_queue: Queue with batches of records to process.
         pipeline: The pipeline to execute.
         summary_queue: Queue where summary information is written.
         timeout: Time to wait upon queue full/empty.
+        summary_interval: If the pipeline supports deltas, the min number of
+            seconds between the summary deltas sent by the worker.
+        kwargs: Additional arguments to the Process/Thread constructor.
     """
-    def __init__(self, index, input_queue, pipeline, summary_queue, timeout):
-        super().__init__(name="Worker process {}".format(index))
+    def __init__(
+            self, index, input_queue, pipeline, summary_queue, timeout,
+            summary_interval=SUMMARY_INTERVAL, **kwargs):
+        super().__init__(**kwargs)
         self.index = index
         self.input_queue = input_queue
         self.pipeline = pipeline
         self.summary_queue = summary_queue
         self.timeout = timeout
+        self.summary_interval = summary_interval
     
     def run(self):
         logging.getLogger().debug(
@@ -186,12 +209,16 @@ class WorkerProcess(Process):
                     timeout=self.timeout)
                 yield batch
         
-        def enqueue_summary():
-            """Enqueue a summary dict.
+        def enqueue_summary(summary, final=True):
+            """Enqueue a summary dict. Only the final summary includes the
+            batches processed by the worker.
             """
             enqueue(
                 self.summary_queue,
-                (self.index, self.pipeline.seen_batches, summary),
+                (
+                    self.index,
+                    self.pipeline.seen_batches if final else None,
+                    summary, final),
                 wait_message="{} waiting to queue summary {{}}".format(
                     self.name),
                 timeout=self.timeout
@@ -199,6 +226,8 @@ class WorkerProcess(Process):
         
         try:
             self.pipeline.start(worker=self)
+            send_deltas = self.pipeline.supports_deltas
+            last_delta = time.time()
             
             try:
                 for batch in iter_batches():
@@ -208,6 +237,15 @@ class WorkerProcess(Process):
                         "%s processing batch %d of size %d",
                         self.name, batch[0]['index'], batch[0]['size'])
                     self.pipeline.process_batch(batch)
+                    if (
+                            send_deltas and
+                            time.time() - last_delta >= self.summary_interval):
+                        delta = {}
+                        self.pipeline.delta(delta)
+                        logging.getLogger().debug(
+                            "%s sending summary delta", self.name)
+                        enqueue_summary(delta, final=False)
+                        last_delta = time.time()
             finally:
                 self.pipeline.finish(summary, worker=self)
             
@@ -218,26 +256,75 @@ class WorkerProcess(Process):
             summary['exception'] = err
         
         logging.getLogger().debug("%s sending summary", self.name)
-        enqueue_summary()
+        enqueue_summary(summary)
+
+class WorkerProcess(WorkerMixin, Process):
+    """Parent class for worker processes that execute Pipelines.
+    """
+    def __init__(
+            self, index, input_queue, pipeline, summary_queue, timeout,
+            summary_interval=SUMMARY_INTERVAL):
+        super().__init__(
+            index, input_queue, pipeline, summary_queue, timeout,
+            summary_interval, name="Worker process {}".format(index))
+
+class WorkerThread(WorkerMixin, Thread):
+    """Worker that executes a Pipeline in a thread of the main process. Batches
+    and summaries are passed between threads without being serialized. Each
+    thread works on its own copy of the pipeline, so pipelines must be
+    deep-copyable.
+    """
+    def __init__(
+            self, index, input_queue, pipeline, summary_queue, timeout,
+            summary_interval=SUMMARY_INTERVAL):
+        super().__init__(
+            index, input_queue, copy.deepcopy(pipeline), summary_queue,
+            timeout, summary_interval, name="Worker thread {}".format(index),
+            daemon=True)
+
+PARALLEL_BACKENDS = dict(
+    processes=(Queue, WorkerProcess),
+    threads=(queue.Queue, WorkerThread))
+"""Queue and worker classes for each parallel backend."""
 
 class ParallelPipelineRunner(object):
     """Run a pipeline in parallel.
     
+    Workers send their summaries to the main process when they finish. Workers
+    that execute a pipeline that supports deltas also send the summary of the
+    records they have processed so far every `summary_interval` seconds; these
+    are merged while the main process is still reading, so that only the
+    summaries of the last few batches remain to be merged at the end.
+    
     Args:
         reader: A :class:`BatchReader`.
         pipeline: A :class:`Pipeline`.
         threads: Number of threads to use. If None, the value will be taken
             from command_runner.
+        backend: 'processes' to run workers in separate processes, or
+            'threads' to run them in threads of the main process. If None,
+            the value will be taken from command_runner.
+        summary_interval: Min number of seconds between the summary deltas
+            sent by each worker.
     """
-    def __init__(self, command_runner, pipeline, threads=None):
+    def __init__(
+            self, command_runner, pipeline, threads=None, backend=None,
+            summary_interval=SUMMARY_INTERVAL):
         self.command_runner = command_runner
         self.pipeline = pipeline
         self.threads = threads or command_runner.threads
         self.timeout = max(command_runner.process_timeout, RETRY_INTERVAL)
+        self.summary_interval = summary_interval
+        self.backend = backend or command_runner.parallel_backend
+        if self.backend not in PARALLEL_BACKENDS:
+            raise ValueError(
+                "Invalid parallel backend: {}".format(self.backend))
+        queue_class, self.worker_class = PARALLEL_BACKENDS[self.backend]
         # Queue by which batches of reads are sent to worker processes
-        self.input_queue = Queue(command_runner.read_queue_size)
-        # Queue for processes to send summary information back to main process
-        self.summary_queue = Queue(self.threads)
+        self.input_queue = queue_class(command_runner.read_queue_size)
+        # Queue for processes to send summary information back to main
+        # process; it is unbounded since workers may send several summaries
+        self.summary_queue = queue_class()
         self.worker_processes = None
         self.num_batches = None
         self.seen_summaries = None
@@ -258,6 +345,46 @@ class ParallelPipelineRunner(object):
         """
         pass
     
+    def merge_summary(self, item):
+        """Merge a summary (or summary delta) from a worker into the summary of
+        the command runner.
+        
+        Args:
+            item: Tuple (worker_index, worker_batches, worker_summary, final).
+        """
+        worker_index, worker_batches, worker_summary, final = item
+        if worker_summary is None:
+            raise MulticoreError(
+                "Worker process {} died unexpectedly".format(worker_index))
+        elif (
+                'exception' in worker_summary and
+                worker_summary['exception'] is not None):
+            raise AtroposError(
+                "Worker process {} died unexpectedly".format(worker_index),
+                worker_summary['exception'])
+        else:
+            logging.getLogger().debug(
+                "Processing summary%s for worker %d",
+                "" if final else " delta", worker_index)
+        summary = self.command_runner.summary
+        summary.merge(worker_summary)
+        if final:
+            self.seen_summaries.add(worker_index)
+            self.seen_batches |= worker_batches
+        else:
+            logging.getLogger().info(
+                "Processed %d records", summary['total_record_count'])
+    
+    def merge_deltas(self):
+        """Merge all summaries that are currently in the summary queue.
+        """
+        while True:
+            try:
+                item = self.summary_queue.get(block=False)
+            except Empty:
+                break
+            self.merge_summary(item)
+    
     def run(self):
         """Run the pipeline.
         
@@ -283,12 +410,23 @@ class ParallelPipelineRunner(object):
         # Start worker processes, reserve a thread for the reader process,
         # which we will get back after it completes
         worker_args = (
-            self.input_queue, self.pipeline, self.summary_queue, self.timeout)
-        self.worker_processes = launch_workers(self.threads - 1, worker_args)
+            self.input_queue, self.pipeline, self.summary_queue, self.timeout,
+            self.summary_interval)
+        self.worker_processes = launch_workers(
+            self.threads - 1, worker_args, worker_class=self.worker_class)
+        
+        self.seen_summaries = set()
+        self.seen_batches = set()
+        
+        def iter_batches():
+            """Merge pending summary deltas before yielding each batch.
+            """
+            for batch in self.command_runner.iterator():
+                self.merge_deltas()
+                yield batch
         
         self.num_batches = enqueue_all(
-            self.command_runner.iterator(), self.input_queue, self.timeout,
-            self.ensure_alive)
+            iter_batches(), self.input_queue, self.timeout, self.ensure_alive)
         
         logging.getLogger().debug(
             "Main loop complete; saw %d batches", self.num_batches)
@@ -302,10 +440,11 @@ class ParallelPipelineRunner(object):
         
         # Now that the reader process is done, it essentially
         # frees up another thread to use for a worker
-        self.worker_processes.extend(
-            launch_workers(1, worker_args, offset=self.threads-1))
+        self.worker_processes.extend(launch_workers(
+            1, worker_args, offset=self.threads-1,
+            worker_class=self.worker_class))
         
-        # Wait for all summaries to be available on queue
+        # Wait for the final summaries of all workers
         def summary_timeout_callback():
             """Ensure that workers are still alive.
             """
@@ -316,49 +455,16 @@ class ParallelPipelineRunner(object):
                     alive=False)
             except Exception as err:
                 logging.getLogger().error(err)
-            
-        wait_on(
-            self.summary_queue.full,
-            wait_message="Waiting on worker summaries {}",
-            timeout=self.timeout,
-            wait=True,
-            timeout_callback=summary_timeout_callback)
         
-        # Process summary information from worker processes
         logging.getLogger().debug(
             "Processing summary information from worker processes")
         
-        self.seen_summaries = set()
-        self.seen_batches = set()
-        
-        def summary_fail_callback():
-            """Raises AtroposError with workers that did not report summaries.
-            """
-            missing_summaries = (
-                set(range(1, self.threads)) - self.seen_summaries)
-            raise AtroposError(
-                "Missing summaries from processes %s",
-                ",".join(str(summ) for summ in missing_summaries))
-        
-        for _ in range(1, self.threads+1):
-            batch = dequeue(
-                self.summary_queue, fail_callback=summary_fail_callback)
-            worker_index, worker_batches, worker_summary = batch
-            if worker_summary is None:
-                raise MulticoreError(
-                    "Worker process {} died unexpectedly".format(worker_index))
-            elif (
-                    'exception' in worker_summary and
-                    worker_summary['exception'] is not None):
-                raise AtroposError(
-                    "Worker process {} died unexpectedly".format(worker_index),
-                    worker_summary['exception'])
-            else:
-                logging.getLogger().debug(
-                    "Processing summary for worker %d", worker_index)
-            self.seen_summaries.add(worker_index)
-            self.seen_batches |= worker_batches
-            self.command_runner.summary.merge(worker_summary)
+        while len(self.seen_summaries) < self.threads:
+            self.merge_summary(dequeue(
+                self.summary_queue,
+                wait_message="Waiting on worker summaries {}",
+                timeout=self.timeout,
+                timeout_callback=summary_timeout_callback))
         
         # Check if any batches were missed
         if self.num_batches > 0:
@@ -528,9 +634,14 @@ def dequeue(
     return wait_on(condition, wait_message=wait_message, **kwargs)
 
 def kill(process, retcode, timeout):
-    """Kill a process if it fails to terminate on its own.
+    """Kill a process if it fails to terminate on its own. Threads cannot be
+    killed; they are daemon threads, so they do not prevent the program from
+    exiting.
     """
-    if retcode <= 1:
+    if isinstance(process, Thread):
+        if retcode <= 1:
+            process.join(timeout)
+    elif retcode <= 1:
         wait_on_process(process, timeout, terminate=True)
     elif process.is_alive():
         process.terminate()
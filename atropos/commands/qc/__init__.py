@@ -3,7 +3,8 @@
 """
 import logging
 from atropos.commands.base import (
-    BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin)
+    BaseCommandRunner, Pipeline, SingleEndPipelineMixin, PairedEndPipelineMixin,
+    ConvergenceMonitor)
 from atropos.commands.stats import (
     SingleEndReadStatistics, PairedEndReadStatistics)
 from atropos.util import run_interruptible
@@ -11,6 +12,8 @@ from atropos.util import run_interruptible
 class QcPipeline(Pipeline):
     """Base Pipeline for the qc command.
     """
+    supports_deltas = True
+    
     def __init__(self, read_statistics_class, **kwargs):
         super().__init__()
         self.read_statistics_class = read_statistics_class
@@ -25,11 +28,41 @@ class QcPipeline(Pipeline):
     def handle_reads(self, context, read1, read2=None):
         self._get_stats(context['source']).collect(read1, read2)
     
-    def finish(self, summary, **kwargs):
+    def convergence_metrics(self):
+        metrics = []
+        total = count = 0
+        for stats in self.stats.values():
+            stats_metrics, (stats_total, stats_count) = \
+                stats.convergence_metrics()
+            metrics.extend(stats_metrics)
+            total += stats_total
+            count += stats_count
+        return (metrics, (total, count))
+    
+    def delta(self, summary):
+        super().delta(summary)
+        summary['stats'] = self.stats
+        self.stats = {}
+    
+    def finish(self, summary, worker=None, **kwargs):
         super().finish(summary)
-        summary['pre'] = dict(
-            (source, stats.summarize())
-            for source, stats in self.stats.items())
+        if worker is None:
+            summary['pre'] = summarize_stats(self.stats)
+        else:
+            # The statistics themselves are added to the summary of a worker,
+            # so that they are merged (in the main process) before they are
+            # summarized.
+            summary['stats'] = self.stats
+
+def summarize_stats(stats):
+    """Returns a dict with the summary of the statistics for each source.
+    
+    Args:
+        stats: Dict {source: read_statistics}.
+    """
+    return dict(
+        (source, source_stats.summarize())
+        for source, source_stats in stats.items())
 
 class SingleEndQcPipeline(SingleEndPipelineMixin, QcPipeline):
     """QcPipeline for single-end data.
@@ -53,13 +86,20 @@ class CommandRunner(BaseCommandRunner):
             pipeline_class = SingleEndQcPipeline
         pipeline_args = dict(
             qualities=self.delivers_qualities,
-            quality_base=self.quality_base)
+            quality_base=self.quality_base,
+            sketches=True,
+            kmers=True)
         if self.stats:
             pipeline_args.update(self.stats)
         
         if self.threads is None:
             self.summary.update(mode='serial', threads=1)
             pipeline = pipeline_class(**pipeline_args)
+            if self.until_converged:
+                pipeline.convergence = ConvergenceMonitor(
+                    self.convergence_tolerance, self.convergence_batches,
+                    'mean_base_quality' if self.delivers_qualities
+                    else 'gc_fraction')
             return run_interruptible(pipeline, self)
         else:
             self.summary.update(mode='parallel', threads=self.threads)
@@ -80,7 +120,7 @@ class CommandRunner(BaseCommandRunner):
         
         logging.getLogger().debug(
             "Starting atropos qc in parallel mode with threads=%d, timeout=%d",
-            self.threads, self.timeout)
+            self.threads, self.process_timeout)
         
         if self.threads < 2:
             raise ValueError("'threads' must be >= 2")
@@ -88,7 +128,10 @@ class CommandRunner(BaseCommandRunner):
         # Start worker processes, reserve a thread for the reader process,
         # which we will get back after it completes
         pipeline_class = type(
-            'QcPipelineImpl', (ParallelPipelineMixin, pipeline_class))
+            'QcPipelineImpl', (ParallelPipelineMixin, pipeline_class), {})
         pipeline = pipeline_class(**pipeline_args)
         runner = ParallelPipelineRunner(self, pipeline)
-        return runner.run()
+        retcode = runner.run()
+        if retcode == 0:
+            self.summary['pre'] = summarize_stats(self.summary.pop('stats'))
+        return retcode
@@ -44,7 +44,14 @@ your raw data.
                  "'pre:tiles' means to also collect tile-level statistics "
                  "(Illumina data only), and 'pre:tiles=<regexp>' means to use "
                  "the specified regular expression to extract key portions of "
-                 "read names to collect the tile statistics.")
+                 "read names to collect the tile statistics. Sequence "
+                 "duplication and overrepresented sequences are estimated "
+                 "using fixed-memory sketches; 'sketches=false' disables "
+                 "them. Positional k-mer profiles are collected for 5-mers; "
+                 "'kmers=<k>' sets the k-mer size and 'kmers=false' disables "
+                 "them.")
+        
+        self.add_convergence_options()
         
         group = self.add_group(
             "Parallel", title="Parallel (multi-core) options")
@@ -54,6 +61,14 @@ your raw data.
             type=positive(int, True), default=None, metavar="THREADS",
             help="Number of threads to use for read trimming. Set to 0 to use "
                  "max available threads. (Do not use multithreading)")
+        group.add_argument(
+            "--parallel-backend",
+            choices=("processes", "threads"), default="processes",
+            help="Whether worker threads are run in separate processes, or as "
+                 "threads of the main process. Threads avoid copying batches "
+                 "of reads between processes, but only the alignment and "
+                 "trimming routines run outside of the interpreter lock. "
+                 "(processes)")
         group.add_argument(
             "--process-timeout",
             type=positive(int, True), default=60, metavar="SECONDS",
@@ -67,6 +82,9 @@ your raw data.
     
     def validate_command_options(self, options):
         options.report_file = options.output
+        if options.until_converged and options.threads is not None:
+            self.parser.error(
+                "--until-converged is not supported with multiple threads")
         if options.threads is not None:
             threads = configure_threads(options, self.parser)
             if options.read_queue_size is None:
@@ -1,58 +1,254 @@
 # coding: utf-8
 """Collect statistics to use in the QC report.
 """
+from array import array
+from bisect import bisect_right
+from collections import Counter, defaultdict
+import math
 import re
 from atropos.util import (
-    CountingDict, NestedDict, Histogram, Mergeable, Summarizable, ordered_dict, 
-    qual2int)
+    NestedDict, Histogram, Mergeable, Summarizable, ordered_dict, qual2int)
+
+try:
+    from ._stats import (
+        count_positions, add_counts, hash_sequence, count_min_add,
+        count_min_estimate, kmer_keys, count_kmers, add_error_probs)
+except:
+    def count_positions(counts, values, width):
+        """Increment `counts[i * width + ord(values[i])]` for each position i
+        in `values`.
+        """
+        if len(values) * width > len(counts):
+            raise IndexError("Counts array is too small")
+        offsets = tuple(ord(char) for char in values)
+        if offsets and max(offsets) >= width:
+            raise ValueError("Invalid character in {}".format(values))
+        for i, offset in enumerate(offsets):
+            counts[i * width + offset] += 1
+    
+    def add_counts(dest, src):
+        """Add the values in `src` to the first len(src) values of `dest`.
+        """
+        if len(src) > len(dest):
+            raise IndexError("Destination array is too small")
+        for i, count in enumerate(src):
+            dest[i] += count
+    
+    MASK64 = (1 << 64) - 1
+    
+    def _mix64(value):
+        value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+        value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & MASK64
+        return value ^ (value >> 31)
+    
+    def hash_sequence(value):
+        """Returns a 64-bit hash of `value` (FNV-1a followed by a SplitMix64
+        finalizer). Unlike `hash`, this is identical in every process.
+        """
+        hashval = 0xcbf29ce484222325
+        for byte in value.encode('latin-1'):
+            hashval = ((hashval ^ byte) * 0x100000001b3) & MASK64
+        return _mix64(hashval)
+    
+    def _count_min_cells(table, width, hashval):
+        for row in range(len(table) // width):
+            yield row * width + (
+                _mix64((hashval + (row + 1) * 0x9e3779b97f4a7c15) & MASK64) %
+                width)
+    
+    def count_min_add(table, width, hashval, count=1):
+        """Add `count` to the cells of a count-min sketch selected by
+        `hashval`, and return the new estimate.
+        """
+        cells = tuple(_count_min_cells(table, width, hashval))
+        for idx in cells:
+            table[idx] += count
+        return min(table[idx] for idx in cells)
+    
+    def count_min_estimate(table, width, hashval):
+        """Returns the estimated count of `hashval` in a count-min sketch.
+        """
+        return min(
+            table[idx] for idx in _count_min_cells(table, width, hashval))
+    
+    BASE_CODES = dict(zip('ACGTacgt', (0, 1, 2, 3) * 2))
+    
+    def kmer_keys(seq, k):
+        """Returns an array('Q') with pos * 4**k + code for each k-mer in
+        `seq` that does not contain an ambiguous base, where code is the
+        2-bit encoding (A=0, C=1, G=2, T=3) of the k-mer starting at pos.
+        """
+        keys = array('Q')
+        mask = (1 << (2 * k)) - 1
+        code = valid = 0
+        for i, base in enumerate(seq):
+            base_code = BASE_CODES.get(base)
+            if base_code is None:
+                code = valid = 0
+                continue
+            code = ((code << 2) | base_code) & mask
+            valid += 1
+            if valid >= k:
+                keys.append(((i - k + 1) << (2 * k)) | code)
+        return keys
+    
+    def count_kmers(counts, seq, k):
+        """Increment `counts[pos * 4**k + code]` for each k-mer in `seq` that
+        does not contain an ambiguous base.
+        """
+        if len(seq) >= k and (len(seq) - k + 1) << (2 * k) > len(counts):
+            raise IndexError("Counts array is too small")
+        for key in kmer_keys(seq, k):
+            counts[key] += 1
+    
+    def add_error_probs(sums, counts, lut, qualities):
+        """For each quality string in `qualities`, add `lut[ord(quals[i])]`
+        to `sums[i]` and 1 to `counts[i]` for each position i. Positions
+        beyond the size of sums are ignored. Returns the number of bases
+        added.
+        """
+        if len(counts) != len(sums):
+            raise ValueError("Sums and counts arrays are of different sizes")
+        if len(lut) != 256:
+            raise ValueError("Lookup table must have 256 values")
+        max_len = len(sums)
+        num_bases = 0
+        for quals in qualities:
+            for i, qchar in enumerate(quals[:max_len]):
+                sums[i] += lut[ord(qchar)]
+                counts[i] += 1
+            num_bases += min(len(quals), max_len)
+        return num_bases
 
 DEFAULT_TILE_KEY_REGEXP = r"^(?:[^\:]+\:){4}([^\:]+)"
 """Regexp for the default Illumina read name format."""
 
-class PositionDicts(Mergeable, Summarizable):
-    """A sequence of dicts, one for each position in a sequence.
+NUM_SYMBOLS = 128
+"""Number of (ASCII) symbols that are counted at each position."""
+
+MAX_KMER_SIZE = 16
+"""Maximum k-mer size for k-mer profiles."""
+
+MAX_DENSE_KMER_SIZE = 6
+"""Maximum k-mer size for which k-mer profiles are stored in a dense array."""
+
+class PositionCounts(Mergeable, Summarizable):
+    """Counts of each symbol (nucleotide or quality character) at each
+    position of a sequence. Counts are stored in a flat array of unsigned
+    integers of size positions * NUM_SYMBOLS, such that merging is a simple
+    element-wise addition.
     
     Args:
         is_qualities: Whether values are base qualities.
         quality_base: Base for quality values.
     """
     def __init__(self, is_qualities=False, quality_base=33):
-        self.dicts = []
+        self.counts = array('Q')
+        self.size = 0
         self.is_qualities = is_qualities
         self.quality_base = quality_base
     
-    def __getitem__(self, idx):
-        if idx >= len(self.dicts):
-            self.extend(idx+1)
-        return self.dicts[idx]
+    def __len__(self):
+        return self.size
     
     def extend(self, size):
-        """Extend the number of bases to `size`.
+        """Extend the number of positions to `size`.
         """
-        diff = size - len(self.dicts)
+        diff = size - self.size
         if diff > 0:
-            for _ in range(diff):
-                self.dicts.append(self.dict_class())
+            self.counts.frombytes(
+                bytes(diff * NUM_SYMBOLS * self.counts.itemsize))
+            self.size = size
+    
+    def add(self, values):
+        """Count the symbols in `values` at positions 0..len(values).
+        
+        Args:
+            values: A string of nucleotides or quality characters.
+        """
+        if len(values) > self.size:
+            self.extend(len(values))
+        count_positions(self.counts, values, NUM_SYMBOLS)
     
     def merge(self, other):
-        if not isinstance(other, BaseCountingDicts):
+        if not isinstance(other, PositionCounts):
             raise ValueError(
                 "Cannot merge object of type {}".format(type(other)))
-        other_len = len(other.dicts)
-        min_len = min(len(self.dicts), other_len)
-        for i in range(min_len):
-            self.dicts[i].merge(other.dicts[i])
-        if other_len > min_len:
-            self.dicts.extend(other.dicts[min_len:other_len])
+        self.extend(other.size)
+        add_counts(self.counts, other.counts)
+        return self
     
-    def summarize(self):
-        raise NotImplementedError()
-
-class BaseCountingDicts(PositionDicts):
-    """A PositionDicts in which the items are CountingDicts that count the
-    number of items associated with each nucleotide base.
-    """
-    dict_class = CountingDict
+    def symbols(self):
+        """Returns the set of symbols with a non-zero count at any position.
+        """
+        totals = self.totals()
+        return set(
+            chr(code) for code, count in enumerate(totals) if count > 0)
+    
+    def totals(self):
+        """Returns a list with the count of each symbol summed over all
+        positions.
+        """
+        totals = [0] * NUM_SYMBOLS
+        counts = self.counts
+        for code in range(NUM_SYMBOLS):
+            totals[code] = sum(counts[code::NUM_SYMBOLS])
+        return totals
+    
+    def total(self, symbols=None):
+        """Returns the total count of `symbols` (or of all symbols if None)
+        over all positions.
+        """
+        if symbols is None:
+            return sum(self.counts)
+        totals = self.totals()
+        return sum(totals[ord(symbol)] for symbol in symbols)
+    
+    def fractions(self, symbols):
+        """Returns a list with the fraction of each of `symbols` at each
+        position.
+        """
+        codes = tuple(ord(symbol) for symbol in symbols)
+        fractions = []
+        for pos in range(self.size):
+            row = self.counts[pos * NUM_SYMBOLS:(pos + 1) * NUM_SYMBOLS]
+            total = sum(row)
+            fractions.extend(
+                row[code] / total if total else 0 for code in codes)
+        return fractions
+    
+    def means(self, offset=0):
+        """Returns a list with the mean value at each position, where the
+        value of a symbol is its ordinal minus `offset`.
+        """
+        means = []
+        for pos in range(self.size):
+            row = self.counts[pos * NUM_SYMBOLS:(pos + 1) * NUM_SYMBOLS]
+            total = sum(row)
+            if total:
+                weighted = sum(
+                    code * count for code, count in enumerate(row) if count)
+                means.append(weighted / total - offset)
+            else:
+                means.append(0)
+        return means
+    
+    def row(self, idx, keys):
+        """Returns a tuple of the counts of `keys` at position `idx`, or zeros
+        if `idx` is beyond the end of the array.
+        """
+        if idx >= self.size:
+            return (0,) * len(keys)
+        offset = idx * NUM_SYMBOLS
+        counts = self.counts
+        return tuple(counts[offset + ord(key)] for key in keys)
+    
+    def columns(self, keys):
+        """Returns the column headers for `keys`.
+        """
+        if self.is_qualities:
+            return tuple(qual2int(k, self.quality_base) for k in keys)
+        return keys
     
     def summarize(self):
         """Flatten into a table with N rows (where N is the size of the
@@ -62,39 +258,61 @@ class BaseCountingDicts(PositionDicts):
             A tuple of (columns, [rows]), where each row is
             (position, (base_counts...))
         """
-        keys = set()
-        for dict_item in self.dicts:
-            keys.update(dict_item.keys())
+        keys = self.symbols()
         if self.is_qualities:
             keys = tuple(sorted(keys))
-            columns = tuple(qual2int(k, self.quality_base) for k in keys)
         else:
             acgt = ('A','C','G','T')
             n_val = ('N',)
-            columns = keys = acgt + tuple(keys - set(acgt + n_val)) + n_val
+            keys = acgt + tuple(sorted(keys - set(acgt + n_val))) + n_val
         return dict(
-            columns=columns,
+            columns=self.columns(keys),
             rows=ordered_dict(
-                (idx, tuple(dict_item.get(key, 0) for key in keys))
-                for idx, dict_item in enumerate(self.dicts, 1)))
+                (idx, self.row(idx - 1, keys))
+                for idx in range(1, self.size + 1)))
 
-class BaseNestedDicts(PositionDicts):
-    """A PositionDicts in which items are NestedDicts.
+class TilePositionCounts(Mergeable, Summarizable):
+    """A :class:`PositionCounts` for each tile.
+    
+    Args:
+        is_qualities: Whether values are base qualities.
+        quality_base: Base for quality values.
     """
-    dict_class = NestedDict
+    def __init__(self, is_qualities=False, quality_base=33):
+        self.tiles = {}
+        self.is_qualities = is_qualities
+        self.quality_base = quality_base
+    
+    def __len__(self):
+        return max((len(counts) for counts in self.tiles.values()), default=0)
+    
+    def __getitem__(self, tile):
+        if tile not in self.tiles:
+            self.tiles[tile] = PositionCounts(
+                self.is_qualities, self.quality_base)
+        return self.tiles[tile]
+    
+    def add(self, tile, values):
+        """Count the symbols in `values` for `tile`.
+        """
+        self[tile].add(values)
+    
+    def merge(self, other):
+        if not isinstance(other, TilePositionCounts):
+            raise ValueError(
+                "Cannot merge object of type {}".format(type(other)))
+        for tile, counts in other.tiles.items():
+            self[tile].merge(counts)
+        return self
     
     def summarize(self):
         """Flatten into a table of N*K rows, where N is the sequence size and
-        K is the union of keys in the nested dicts, and the columns are counts
-        by nucleotide.
+        K is the number of tiles, and the columns are counts by nucleotide.
         """
-        keys1 = set()
+        keys1 = tuple(sorted(self.tiles.keys()))
         keys2 = set()
-        for dict1 in self.dicts:
-            keys1.update(dict1.keys())
-            for dict2 in dict1.values():
-                keys2.update(dict2.keys())
-        keys1 = tuple(sorted(keys1))
+        for counts in self.tiles.values():
+            keys2.update(counts.symbols())
         keys2 = tuple(sorted(keys2))
         if self.is_qualities:
             columns = tuple(qual2int(k, self.quality_base) for k in keys2)
@@ -105,12 +323,433 @@ class BaseNestedDicts(PositionDicts):
             columns2=keys1,
             rows=ordered_dict(
                 (idx, ordered_dict(
-                    (key1, tuple(dict_item[key1].get(key2, 0) for key2 in keys2))
+                    (key1, self.tiles[key1].row(idx - 1, keys2))
                     for key1 in keys1))
-                for idx, dict_item in enumerate(self.dicts, 1)))
+                for idx in range(1, len(self) + 1)))
+
+DUPLICATION_LEVELS = (
+    1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 50, 100, 500, 1000, 5000, 10000)
+"""Lower bounds of the bins of the duplication level histogram."""
+
+class HyperLogLog(Mergeable):
+    """Estimates the number of distinct values that have been added, using a
+    HyperLogLog sketch (Flajolet et al. 2007) of 2**`precision` one-byte
+    registers. The relative error is about 1.04 / sqrt(2**`precision`).
+    
+    Args:
+        precision: Number of hash bits that are used to select a register.
+    """
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = array('B', bytes(1 << precision))
+        self._rank_bits = 64 - precision
+        self._rank_mask = (1 << self._rank_bits) - 1
+    
+    def add_hash(self, hashval):
+        """Add a 64-bit hash value.
+        """
+        idx = hashval >> self._rank_bits
+        rank = self._rank_bits - (hashval & self._rank_mask).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+    
+    def merge(self, other):
+        if (
+                not isinstance(other, HyperLogLog) or
+                other.precision != self.precision):
+            raise ValueError("Cannot merge {}".format(other))
+        self.registers = array(
+            'B', map(max, self.registers, other.registers))
+        return self
+    
+    def estimate(self):
+        """Returns the estimated number of distinct values.
+        """
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        raw = alpha * num_registers * num_registers / sum(
+            2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if zeros and raw <= 2.5 * num_registers:
+            # Small range correction (linear counting)
+            return round(num_registers * math.log(num_registers / zeros))
+        return round(raw)
+
+class CountMinSketch(Mergeable):
+    """Estimates the number of times each value has been added using a
+    count-min sketch (Cormode and Muthukrishnan 2005) of `depth` rows of
+    `width` counters. Estimates are never too small, and exceed the true
+    count by at most 2 * N / `width` with probability 1 - 2**-`depth`,
+    where N is the total count.
+    
+    Args:
+        width: Number of counters in each row.
+        depth: Number of rows.
+    """
+    def __init__(self, width=2**17, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array('Q')
+        self.table.frombytes(bytes(width * depth * self.table.itemsize))
+    
+    def add_hash(self, hashval, count=1):
+        """Add `count` occurrences of a 64-bit hash value.
+        
+        Returns:
+            The new estimated count of `hashval`.
+        """
+        return count_min_add(self.table, self.width, hashval, count)
+    
+    def estimate_hash(self, hashval):
+        """Returns the estimated count of a 64-bit hash value.
+        """
+        return count_min_estimate(self.table, self.width, hashval)
+    
+    def merge(self, other):
+        if (
+                not isinstance(other, CountMinSketch) or
+                other.width != self.width or other.depth != self.depth):
+            raise ValueError("Cannot merge {}".format(other))
+        add_counts(self.table, other.table)
+        return self
+
+class HeavyHitters(Mergeable):
+    """Tracks the most frequent values using at most `capacity` counters
+    (the Misra-Gries algorithm, the deterministic counterpart of
+    Space-Saving). Every value that makes up more than 1 / (`capacity` + 1)
+    of the total count is guaranteed to be retained. Counts are lower
+    bounds on the true counts.
+    
+    Args:
+        capacity: Maximum number of values to track.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counters = {}
+    
+    def __iter__(self):
+        return iter(self.counters.items())
+    
+    def add(self, value):
+        """Add one occurrence of `value`.
+        """
+        counters = self.counters
+        if value in counters:
+            counters[value] += 1
+        elif len(counters) < self.capacity:
+            counters[value] = 1
+        else:
+            # Decrement all counters; the cost is amortized over the
+            # occurrences that were added to them.
+            self.counters = dict(
+                (key, count - 1)
+                for key, count in counters.items()
+                if count > 1)
+    
+    def merge(self, other):
+        if not isinstance(other, HeavyHitters):
+            raise ValueError("Cannot merge {}".format(other))
+        counters = self.counters
+        for key, count in other.counters.items():
+            counters[key] = counters.get(key, 0) + count
+        if len(counters) > self.capacity:
+            # Subtract the (capacity+1)-th largest count (Agarwal et al. 2012)
+            offset = sorted(counters.values(), reverse=True)[self.capacity]
+            self.counters = dict(
+                (key, count - offset)
+                for key, count in counters.items()
+                if count > offset)
+        return self
+
+class DistinctSample(Mergeable):
+    """A uniform sample of distinct 64-bit hash values. A hash value is
+    retained if its lowest `level` bits are zero; the level is increased
+    whenever the sample grows beyond `capacity` values.
+    
+    Args:
+        capacity: Maximum number of hash values to retain.
+    """
+    def __init__(self, capacity=2**14):
+        self.capacity = capacity
+        self.level = 0
+        self.hashes = set()
+        self._mask = 0
+    
+    def __len__(self):
+        return len(self.hashes)
+    
+    def __iter__(self):
+        return iter(self.hashes)
+    
+    @property
+    def rate(self):
+        """The fraction of distinct values that are retained.
+        """
+        return 2.0 ** -self.level
+    
+    def add_hash(self, hashval):
+        """Add a 64-bit hash value.
+        """
+        if not hashval & self._mask:
+            self.hashes.add(hashval)
+            if len(self.hashes) > self.capacity:
+                self._prune(self.level + 1)
+    
+    def _prune(self, level):
+        while True:
+            mask = (1 << level) - 1
+            hashes = set(
+                hashval for hashval in self.hashes if not hashval & mask)
+            if len(hashes) <= self.capacity:
+                break
+            level += 1
+        self.level = level
+        self._mask = mask
+        self.hashes = hashes
+    
+    def merge(self, other):
+        if not isinstance(other, DistinctSample):
+            raise ValueError("Cannot merge {}".format(other))
+        self.hashes.update(other.hashes)
+        self._prune(max(self.level, other.level))
+        return self
+
+class SequenceSketches(Mergeable, Summarizable):
+    """Fixed-memory estimates of the number of distinct sequences, sequence
+    duplication levels and overrepresented sequences, similar to the
+    equivalent FastQC modules.
+    
+    Args:
+        overrepresented_fraction: Minimum fraction of all sequences for a
+            sequence to be reported as overrepresented.
+        capacity: Maximum number of candidate overrepresented sequences.
+        sample_size: Maximum number of distinct sequences sampled for the
+            duplication level histogram.
+        width: Width of the count-min sketch.
+        precision: Precision of the HyperLogLog sketch.
+    """
+    def __init__(
+            self, overrepresented_fraction=0.001, capacity=1000,
+            sample_size=2**14, width=2**17, precision=14):
+        self.overrepresented_fraction = overrepresented_fraction
+        self.count = 0
+        self.distinct = HyperLogLog(precision)
+        self.counts = CountMinSketch(width)
+        self.heavy_hitters = HeavyHitters(capacity)
+        self.sample = DistinctSample(sample_size)
+    
+    def add(self, seq):
+        """Add a sequence.
+        """
+        hashval = hash_sequence(seq)
+        self.count += 1
+        self.distinct.add_hash(hashval)
+        self.counts.add_hash(hashval)
+        self.heavy_hitters.add(seq)
+        self.sample.add_hash(hashval)
+    
+    def merge(self, other):
+        if not isinstance(other, SequenceSketches):
+            raise ValueError(
+                "Cannot merge object of type {}".format(type(other)))
+        self.count += other.count
+        self.distinct.merge(other.distinct)
+        self.counts.merge(other.counts)
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.sample.merge(other.sample)
+        return self
+    
+    def summarize(self):
+        """Returns a summary dict with the estimated number of distinct
+        sequences, the percentage of duplicate sequences, a histogram of
+        duplication levels (the percentage of distinct and of all sequences
+        at each level), and a tuple of (sequence, count, percentage) for each
+        overrepresented sequence.
+        """
+        distinct = min(self.distinct.estimate(), self.count)
+        
+        num_levels = len(DUPLICATION_LEVELS)
+        distinct_counts = [0] * num_levels
+        total_counts = [0] * num_levels
+        for hashval in self.sample:
+            count = self.counts.estimate_hash(hashval)
+            level = bisect_right(DUPLICATION_LEVELS, count) - 1
+            distinct_counts[level] += 1
+            total_counts[level] += count
+        num_distinct = max(1, sum(distinct_counts))
+        num_total = max(1, sum(total_counts))
+        
+        overrepresented = []
+        min_count = max(2, self.overrepresented_fraction * self.count)
+        for seq, _ in self.heavy_hitters:
+            count = self.counts.estimate_hash(hash_sequence(seq))
+            if count >= min_count:
+                overrepresented.append(
+                    (seq, count, round(count * 100 / self.count, 2)))
+        overrepresented.sort(key=lambda item: (-item[1], item[0]))
+        
+        return dict(
+            distinct=distinct,
+            duplicate_pct=(
+                round((1 - distinct / self.count) * 100, 2)
+                if self.count else 0),
+            duplication_levels=dict(
+                columns=('Distinct', 'Total'),
+                rows=ordered_dict(
+                    (
+                        '>{}'.format(lower) if lower >= 10 else str(lower),
+                        (
+                            round(distinct_counts[i] * 100 / num_distinct, 2),
+                            round(total_counts[i] * 100 / num_total, 2)))
+                    for i, lower in enumerate(DUPLICATION_LEVELS))),
+            overrepresented=tuple(overrepresented))
+
+class KmerProfile(Mergeable, Summarizable):
+    """Counts of each k-mer at each position of a sequence, used to find
+    k-mers whose frequency depends on position (e.g. adapter sequence, which
+    becomes more frequent towards the 3' end of reads). K-mers are 2-bit
+    encoded, and k-mers containing ambiguous bases are ignored. For
+    k <= MAX_DENSE_KMER_SIZE, counts are kept in a dense array of
+    positions * 4**k counters; for larger k, in a Counter keyed by
+    position * 4**k + k-mer.
+    
+    Args:
+        k: K-mer size.
+        min_enrichment: Minimum ratio of observed to expected count at any
+            position for a k-mer to be reported.
+        min_count: Minimum count of a k-mer at a position for that position
+            to be considered.
+        max_reported: Maximum number of k-mers to report.
+    """
+    def __init__(self, k=5, min_enrichment=5, min_count=10, max_reported=20):
+        if not 1 <= k <= MAX_KMER_SIZE:
+            raise ValueError(
+                "K-mer size must be between 1 and {}".format(MAX_KMER_SIZE))
+        self.k = k
+        self.min_enrichment = min_enrichment
+        self.min_count = min_count
+        self.max_reported = max_reported
+        self.dense = k <= MAX_DENSE_KMER_SIZE
+        self.size = 0
+        if self.dense:
+            self.counts = array('Q')
+        else:
+            self.counts = Counter()
+    
+    def _extend(self, size):
+        diff = size - self.size
+        if diff > 0:
+            self.counts.frombytes(
+                bytes(diff * (4 ** self.k) * self.counts.itemsize))
+            self.size = size
+    
+    def add(self, seq):
+        """Count the k-mers in `seq`.
+        """
+        if self.dense:
+            self._extend(len(seq) - self.k + 1)
+            count_kmers(self.counts, seq, self.k)
+        else:
+            self.counts.update(kmer_keys(seq, self.k))
+    
+    def merge(self, other):
+        if not isinstance(other, KmerProfile) or other.k != self.k:
+            raise ValueError("Cannot merge {}".format(other))
+        if self.dense:
+            self._extend(other.size)
+            add_counts(self.counts, other.counts)
+        else:
+            self.counts.update(other.counts)
+        return self
+    
+    def decode(self, code):
+        """Returns the k-mer string for a 2-bit encoded k-mer.
+        """
+        return ''.join(
+            'ACGT'[(code >> (2 * i)) & 3] for i in range(self.k - 1, -1, -1))
+    
+    def _items(self):
+        """Yields (position, code, count) for each non-zero count.
+        """
+        shift = 2 * self.k
+        mask = (1 << shift) - 1
+        if self.dense:
+            items = (
+                (key, count)
+                for key, count in enumerate(self.counts) if count)
+        else:
+            items = self.counts.items()
+        for key, count in items:
+            yield (key >> shift, key & mask, count)
+    
+    def summarize(self):
+        """Returns a summary dict with a table of the k-mers with the highest
+        positional enrichment. Columns are the k-mer, its total count, the
+        maximum ratio of observed to expected count at any position, that
+        (1-based) position, and whether the k-mer is enriched towards the 3'
+        end like adapter sequence.
+        """
+        kmer_positions = defaultdict(dict)
+        kmer_totals = Counter()
+        position_totals = Counter()
+        for pos, code, count in self._items():
+            kmer_positions[code][pos] = count
+            kmer_totals[code] += count
+            position_totals[pos] += count
+        total = sum(kmer_totals.values())
+        midpoint = (max(position_totals) + 1) // 2 if position_totals else 0
+        total_3p = sum(
+            count for pos, count in position_totals.items() if pos >= midpoint)
+        total_5p = total - total_3p
+        
+        enriched = []
+        for code, positions in kmer_positions.items():
+            freq = kmer_totals[code] / total
+            max_ratio = max_pos = None
+            for pos, count in positions.items():
+                if count < self.min_count:
+                    continue
+                ratio = count / (position_totals[pos] * freq)
+                if max_ratio is None or ratio > max_ratio:
+                    max_ratio, max_pos = ratio, pos
+            if max_ratio is None or max_ratio < self.min_enrichment:
+                continue
+            # Adapter read-through makes a k-mer more frequent in the 3' half
+            # of reads than in the 5' half.
+            count_3p = sum(
+                count for pos, count in positions.items() if pos >= midpoint)
+            ratio_3p = count_3p / (total_3p * freq) if total_3p else 0
+            ratio_5p = (
+                (kmer_totals[code] - count_3p) / (total_5p * freq)
+                if total_5p else 0)
+            adapter_like = max_pos >= midpoint and ratio_3p >= 2 * ratio_5p
+            enriched.append((
+                self.decode(code), kmer_totals[code], round(max_ratio, 2),
+                max_pos + 1, adapter_like))
+        enriched.sort(key=lambda row: (-row[2], row[0]))
+        
+        return dict(
+            k=self.k,
+            columns=(
+                'K-mer', 'Count', 'Max Obs/Exp', 'Max Position', 'Adapter'),
+            rows=tuple(enriched[:self.max_reported]))
+
+def parse_bool(value):
+    """Converts 'true'/'false' (and similar) strings to bool; other values
+    are returned unchanged.
+    """
+    if isinstance(value, str):
+        lower = value.lower()
+        if lower in ('true', 'yes'):
+            return True
+        if lower in ('false', 'no'):
+            return False
+    return value
 
-class ReadStatistics(object):
-    """Accumulates statistics on sequencing reads.
+class ReadStatistics(Mergeable):
+    """Accumulates statistics on sequencing reads. Statistics are mergeable,
+    so that reads can be processed in separate workers whose statistics are
+    merged before being summarized.
     
     Args:
         qualities: Whether to collect base quality statistics.
@@ -118,8 +757,16 @@ class ReadStatistics(object):
             regular expression is used, otherwise must be a regular expression
             string or compiled re for extracting the tile ID from the read name.
             Only applies to Illumina sequences.
+        sketches: Whether to estimate sequence duplication levels and
+            overrepresented sequences. Either a bool, 'true'/'false', or a
+            dict of keyword arguments for :class:`SequenceSketches`.
+        kmers: Whether to collect positional k-mer profiles. Either a bool,
+            'true'/'false', the k-mer size, or a dict of keyword arguments for
+            :class:`KmerProfile`.
     """
-    def __init__(self, qualities=None, quality_base=33, tiles=None):
+    def __init__(
+            self, qualities=None, quality_base=33, tiles=None, sketches=False,
+            kmers=False):
         # max read length
         self.max_read_len = 0
         # read count
@@ -129,7 +776,23 @@ class ReadStatistics(object):
         # per-sequence GC percentage
         self.sequence_gc = Histogram()
         # per-position base composition
-        self.bases = BaseCountingDicts()
+        self.bases = PositionCounts()
+        # distinct/duplicate/overrepresented sequences
+        sketches = parse_bool(sketches)
+        self.sketches = None
+        if isinstance(sketches, dict):
+            self.sketches = SequenceSketches(**sketches)
+        elif sketches:
+            self.sketches = SequenceSketches()
+        # positional k-mer profiles
+        kmers = parse_bool(kmers)
+        self.kmers = None
+        if isinstance(kmers, dict):
+            self.kmers = KmerProfile(**kmers)
+        elif kmers is True:
+            self.kmers = KmerProfile()
+        elif kmers:
+            self.kmers = KmerProfile(int(kmers))
         
         # whether to collect base quality stats
         self.qualities = qualities
@@ -153,10 +816,10 @@ class ReadStatistics(object):
         # per-sequence mean qualities
         self.sequence_qualities = Histogram()
         # per-position quality composition
-        self.base_qualities = BaseCountingDicts(
+        self.base_qualities = PositionCounts(
             is_qualities=True, quality_base=self.quality_base)
         if self.tile_key_regexp:
-            self.tile_base_qualities = BaseNestedDicts(
+            self.tile_base_qualities = TilePositionCounts(
                 is_qualities=True, quality_base=self.quality_base)
             self.tile_sequence_qualities = NestedDict()
     
@@ -166,17 +829,16 @@ class ReadStatistics(object):
     # returned.
     
     def _gc_pct(self):
-        return (
-            sum(base['C'] + base['G'] for base in self.bases) /
-            self.total_bases)
+        return self.bases.total('CG') / self.total_bases
     
     def _total_bases(self):
-        return sum(
-            length * count
-            for base in self.bases
-            for length, count in base.items())
+        return self.bases.total()
     
     def __getattr__(self, name):
+        if name.startswith('_'):
+            # Don't compute private or special attributes; this is also
+            # required for copying and pickling.
+            raise AttributeError(name)
         if name not in self._cache:
             func_name = '_' + name
             if not hasattr(self, func_name):
@@ -209,17 +871,27 @@ class ReadStatistics(object):
             self.sequence_gc[gc_pct] += 1
             
             if seqlen > self.max_read_len:
-                self._extend_bases(seqlen)
+                self.max_read_len = seqlen
             
-            quals = tile = None
+            # per-base nucleotide composition
+            self.bases.add(seq)
             
-            if self.qualities:
-                quals = record.qualities
+            if self.sketches is not None:
+                self.sketches.add(seq)
+            
+            # positional k-mer profiles
+            if self.kmers is not None:
+                self.kmers.add(seq)
+            
+            quals = record.qualities
+            tile = None
+            if self.qualities and quals:
                 # mean read quality
                 # NOTE: we use round here, as opposed to FastQC which uses
                 # floor, resulting in slightly different quality profiles
                 meanqual = round(
-                    sum(ord(q) - self.quality_base for q in quals) / seqlen)
+                    (sum(quals.encode('latin-1')) -
+                     self.quality_base * seqlen) / seqlen)
                 self.sequence_qualities[meanqual] += 1
                 # tile ID
                 if self.track_tiles:
@@ -230,39 +902,65 @@ class ReadStatistics(object):
                     else:
                         raise ValueError("{} did not match {}".format(
                             self.tile_key_regexp, record.name))
-        
-            # per-base nucleotide and quality composition
-            for i, (base, qual) in enumerate(zip(seq, quals)):
-                self.add_base(i, base, qual, tile)
-        
-        # TODO: positional k-mer profiles
+                
+                # per-base quality composition
+                self.base_qualities.add(quals)
+                if tile:
+                    self.tile_base_qualities.add(tile, quals)
     
     def collect(self, read1, read2=None):
         """Collect statistics on a pair of reads.
         """
         raise NotImplementedError()
     
-    def add_base(self, i, base, qual=None, tile=None):
-        """Add per-base information.
-        
-        Args:
-            i: Position
-            base: Nucleotide
-            qual: Quality
-            tile: Tile ID
-        """
-        self.bases[i][base] += 1
-        if qual:
-            self.base_qualities[i][qual] += 1
-            if tile:
-                self.tile_base_qualities[i][tile][qual] += 1
-    
-    def _extend_bases(self, new_size):
-        self.bases.extend(new_size)
-        if self.qualities:
-            self.base_qualities.extend(new_size)
-            if self.track_tiles:
-                self.tile_base_qualities.extend(new_size)
+    def merge(self, other):
+        if not isinstance(other, ReadStatistics):
+            raise ValueError(
+                "Cannot merge object of type {}".format(type(other)))
+        self.count += other.count
+        self.max_read_len = max(self.max_read_len, other.max_read_len)
+        self.sequence_lengths.merge(other.sequence_lengths)
+        self.sequence_gc.merge(other.sequence_gc)
+        self.bases.merge(other.bases)
+        if self.sketches is None:
+            self.sketches = other.sketches
+        elif other.sketches is not None:
+            self.sketches.merge(other.sketches)
+        if self.kmers is None:
+            self.kmers = other.kmers
+        elif other.kmers is not None:
+            self.kmers.merge(other.kmers)
+        if other.base_qualities is not None:
+            if self.base_qualities is None:
+                self.qualities = True
+                self._init_qualities()
+            self.sequence_qualities.merge(other.sequence_qualities)
+            self.base_qualities.merge(other.base_qualities)
+            if self.track_tiles and other.track_tiles:
+                self.tile_base_qualities.merge(other.tile_base_qualities)
+                self.tile_sequence_qualities.merge(
+                    other.tile_sequence_qualities)
+        self._cache.clear()
+        return self
+    
+    def convergence_metrics(self):
+        """Returns the statistics that are monitored for convergence: the
+        per-position base composition and mean base quality, along with the
+        (total, count) of base qualities (or of G/C bases, if qualities are
+        not being collected).
+        """
+        metrics = self.bases.fractions('ACGT')
+        if self.base_qualities is not None:
+            metrics.extend(self.base_qualities.means(self.quality_base))
+            totals = self.base_qualities.totals()
+            count = sum(totals)
+            estimate = (
+                sum(code * total for code, total in enumerate(totals)) -
+                self.quality_base * count,
+                count)
+        else:
+            estimate = (self.bases.total('CG'), self.bases.total())
+        return (metrics, estimate)
     
     def summarize(self):
         """Returns a summary dict.
@@ -272,6 +970,10 @@ class ReadStatistics(object):
             lengths=self.sequence_lengths.summarize(),
             gc=self.sequence_gc.summarize(),
             bases=self.bases)
+        if self.sketches is not None:
+            summary['sketches'] = self.sketches
+        if self.kmers is not None:
+            summary['kmers'] = self.kmers
         if self.sequence_qualities:
             summary['qualities'] = self.sequence_qualities
         if self.base_qualities:
@@ -290,7 +992,7 @@ class SingleEndReadStatistics(ReadStatistics):
     def summarize(self):
         return dict(read1=super().summarize())
 
-class PairedEndReadStatistics(object):
+class PairedEndReadStatistics(Mergeable):
     """ReadStatistics for paired-end data.
     """
     def __init__(self, **kwargs):
@@ -303,6 +1005,21 @@ class PairedEndReadStatistics(object):
         self.read1.collect_record(read1)
         self.read2.collect_record(read2)
     
+    def merge(self, other):
+        if not isinstance(other, PairedEndReadStatistics):
+            raise ValueError(
+                "Cannot merge object of type {}".format(type(other)))
+        self.read1.merge(other.read1)
+        self.read2.merge(other.read2)
+        return self
+    
+    def convergence_metrics(self):
+        """Returns the combined convergence metrics of both reads.
+        """
+        metrics1, (total1, count1) = self.read1.convergence_metrics()
+        metrics2, (total2, count2) = self.read2.convergence_metrics()
+        return (metrics1 + metrics2, (total1 + total2, count1 + count2))
+    
     def summarize(self):
         """Returns a summary dict.
         """
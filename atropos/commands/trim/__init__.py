@@ -5,6 +5,7 @@ import logging
 import os
 import sys
 import textwrap
+from atropos import AtroposError
 from atropos.commands.base import (
     BaseCommandRunner, Summary, Pipeline, SingleEndPipelineMixin,
     PairedEndPipelineMixin)
@@ -45,12 +46,26 @@ class TrimPipeline(Pipeline):
         context['results'] = defaultdict(lambda: [])
     
     def handle_records(self, context, records):
-        super().handle_records(context, records)
+        if self.record_handler.supports_batch:
+            try:
+                self.handle_batch(context, records)
+            except AtroposError:
+                # Already identifies the record that failed
+                raise
+            except Exception as err:
+                raise AtroposError(
+                    "An error occurred in batch {}".format(
+                    context['index'])) from err
+        else:
+            super().handle_records(context, records)
         self.result_handler.write_result(context['index'], context['results'])
     
     def handle_reads(self, context, read1, read2=None):
         return self.record_handler.handle_record(context, read1, read2)
     
+    def handle_reads_batch(self, context, reads1, reads2=None):
+        return self.record_handler.handle_records(context, reads1, reads2)
+    
     def finish(self, summary, **kwargs):
         self.result_handler.finish()
         super().finish(summary)
@@ -72,6 +87,32 @@ class RecordHandler(object):
         self.formatters.format(context['results'], dest, *reads)
         return (dest, reads)
     
+    @property
+    def supports_batch(self):
+        """Whether records can be handled a batch at a time, which is the case
+        when all of the modifiers support it.
+        """
+        return self.modifiers.supports_batch
+    
+    def handle_records(self, context, reads1, reads2=None):
+        """Handle a batch of reads/pairs.
+        
+        Returns:
+            A list of tuples (dest, reads), one per read/pair.
+        """
+        results = []
+        for idx, reads in enumerate(
+                self.modifiers.modify_batch(reads1, reads2)):
+            try:
+                dest = self.filters.filter(*reads)
+                self.formatters.format(context['results'], dest, *reads)
+            except Exception as err:
+                raise AtroposError(
+                    "An error occurred at record {} of batch {}".format(
+                    idx, context['index'])) from err
+            results.append((dest, reads))
+        return results
+    
     def summarize(self):
         """Returns a summary dict.
         """
@@ -112,12 +153,42 @@ class StatsRecordHandlerWrapper(object):
                 self.pre, context['source'], read1, read2, **self.pre_kwargs)
         dest, reads = self.record_handler.handle_record(context, read1, read2)
         if self.post is not None:
-            if dest not in self.post:
-                self.post[dest] = {}
-            self.collect(
-                self.post[dest], context['source'], *reads, **self.post_kwargs)
+            self.collect_post(context, dest, reads)
         return (dest, reads)
     
+    @property
+    def supports_batch(self):
+        """Whether the wrapped record handler supports batches.
+        """
+        return self.record_handler.supports_batch
+    
+    def handle_records(self, context, reads1, reads2=None):
+        """Handle a batch of reads/pairs.
+        """
+        if self.pre is not None:
+            if reads2 is None:
+                for read1 in reads1:
+                    self.collect(
+                        self.pre, context['source'], read1, **self.pre_kwargs)
+            else:
+                for read1, read2 in zip(reads1, reads2):
+                    self.collect(
+                        self.pre, context['source'], read1, read2,
+                        **self.pre_kwargs)
+        results = self.record_handler.handle_records(context, reads1, reads2)
+        if self.post is not None:
+            for dest, reads in results:
+                self.collect_post(context, dest, reads)
+        return results
+    
+    def collect_post(self, context, dest, reads):
+        """Collect post-trimming stats on a read/pair.
+        """
+        if dest not in self.post:
+            self.post[dest] = {}
+        self.collect(
+            self.post[dest], context['source'], *reads, **self.post_kwargs)
+    
     def collect(self, stats, source, read1, read2=None, **kwargs):
         """Collect stats on a pair of reads.
         
@@ -291,8 +362,17 @@ class CommandRunner(BaseCommandRunner):
         has_adapters2 = options.adapters2 or options.anywhere2 or options.front2
         
         adapters1 = adapters2 = []
-        if has_adapters1 or has_adapters2:
+        if has_adapters1 or has_adapters2 or options.auto_adapters:
             adapter_cache = super().load_known_adapters()
+            
+            if options.auto_adapters:
+                detected = self.detect_adapters(adapter_cache)
+                options.adapters = options.adapters + detected[0]
+                has_adapters1 = bool(has_adapters1 or detected[0])
+                if options.paired:
+                    options.adapters2 = options.adapters2 + detected[1]
+                    has_adapters2 = bool(has_adapters2 or detected[1])
+            
             parser_args = dict(
                 colorspace=options.colorspace,
                 max_error_rate=options.error_rate,
@@ -345,6 +425,10 @@ class CommandRunner(BaseCommandRunner):
             for adapter in adapters1 + adapters2:
                 adapter.enable_debug()
         
+        if options.alignment_cache_size:
+            for adapter in adapters1 + adapters2:
+                adapter.enable_cache(options.alignment_cache_size)
+        
         if options.paired:
             modifiers = PairedEndModifiers(options.paired)
         else:
@@ -380,6 +464,7 @@ class CommandRunner(BaseCommandRunner):
                             options.insert_match_adapter_error_rate,
                         match_probability=match_probability,
                         insert_max_rmp=options.insert_max_rmp,
+                        cache_size=options.alignment_cache_size,
                         read_wildcards=options.match_read_wildcards,
                         adapter_wildcards=options.match_adapter_wildcards)
                 else:
@@ -597,6 +682,32 @@ class CommandRunner(BaseCommandRunner):
             self.summary.update(mode='parallel', threads=options.threads)
             return self.run_parallel(record_handler, writers, mixin_class)
     
+    def detect_adapters(self, adapter_cache):
+        """Detect the 3' adapters to trim by matching the known adapters
+        against the first `auto_adapters_reads` records. The records are
+        buffered, so they are still trimmed.
+        
+        Args:
+            adapter_cache: :class:`AdapterCache` of known adapters.
+        
+        Returns:
+            A list with the detected adapter sequences for each read.
+        """
+        from atropos.commands.detect import detect_known_adapters
+        num_reads = self.options.auto_adapters_reads
+        if self.max_reads:
+            num_reads = min(num_reads, self.max_reads)
+        records = self.peek(num_reads)
+        if not records or adapter_cache.empty:
+            logging.getLogger().warning(
+                "Could not detect adapters: no reads or no known adapters")
+            return [[], []]
+        detected = detect_known_adapters(
+            records, adapter_cache, paired=bool(self.options.paired))
+        self.summary['auto_adapters'] = dict(
+            reads=len(records), adapters=detected)
+        return detected
+    
     def run_parallel(self, record_handler, writers, mixin_class):
         """Parallel implementation of run_atropos. Works as follows:
         
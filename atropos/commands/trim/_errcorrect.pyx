@@ -0,0 +1,153 @@
+# kate: syntax Python;
+# cython: profile=False, emit_code_comments=False
+"""
+Error correction of overlapping read pairs.
+"""
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from atropos.util import BASE_COMPLEMENTS
+
+cdef char[256] COMPLEMENT
+for _i in range(256):
+    COMPLEMENT[_i] = <char> <unsigned char> _i
+for _base, _comp in BASE_COMPLEMENTS.items():
+    COMPLEMENT[ord(_base)] = ord(_comp)
+
+DEF ACTION_N = 0
+DEF ACTION_CONSERVATIVE = 1
+DEF ACTION_LIBERAL = 2
+
+def correct_overlap(
+        bytearray seq1, bytearray seq2, qual1, qual2, int r1_start,
+        int r1_end, int r2_start, int r2_end, str mismatch_action,
+        int min_qual_difference=1):
+    """
+    Correct mismatches between the overlapping parts of two reads. seq1[r1_start:r1_end]
+    is compared to the reverse-complement of seq2[r2_start:r2_end]. Sequences (and
+    qualities, if not None) are modified in place.
+
+    mismatch_action is one of 'N' (replace both bases with N), 'conservative'
+    (replace the base with lower quality, if the quality difference is at least
+    min_qual_difference) or 'liberal' (like conservative, but when the qualities
+    are too close, use the base from the read with the higher mean quality in the
+    overlap). A base that is N is always replaced with the other read's base.
+
+    Return tuple (r1_changed, r2_changed) with the number of bases changed in each read.
+    """
+    cdef bint has_quals = qual1 is not None and qual2 is not None
+    cdef int action
+    if mismatch_action == 'N':
+        action = ACTION_N
+    elif mismatch_action == 'conservative':
+        action = ACTION_CONSERVATIVE
+    elif mismatch_action == 'liberal':
+        action = ACTION_LIBERAL
+    else:
+        raise ValueError("Invalid mismatch action: {}".format(mismatch_action))
+    if action != ACTION_N and not has_quals:
+        raise ValueError(
+            "Cannot perform quality-based error correction on reads "
+            "lacking quality information")
+
+    if (
+            r1_start < 0 or r2_start < 0 or r1_end > len(seq1) or
+            r2_end > len(seq2)):
+        raise IndexError("Overlap extends beyond the end of a read")
+    if has_quals and (len(qual1) != len(seq1) or len(qual2) != len(seq2)):
+        raise ValueError("Sequence and quality lengths differ")
+
+    cdef char* s1 = seq1
+    cdef char* s2 = seq2
+    cdef char* q1 = NULL
+    cdef char* q2 = NULL
+    cdef bytearray qual1_bytes, qual2_bytes
+    if has_quals:
+        qual1_bytes = qual1
+        qual2_bytes = qual2
+        q1 = qual1_bytes
+        q2 = qual2_bytes
+
+    cdef int size = min(r1_end - r1_start, r2_end - r2_start)
+    cdef int r1_changed = 0
+    cdef int r2_changed = 0
+    cdef int num_equal = 0
+    cdef int* quals_equal = NULL
+    cdef int k, i, j, diff
+    cdef char base1, base2
+    cdef double mean_qual1, mean_qual2
+
+    if size <= 0:
+        return (0, 0)
+    if action == ACTION_LIBERAL:
+        quals_equal = <int*> PyMem_Malloc(size * sizeof(int))
+        if not quals_equal:
+            raise MemoryError()
+
+    try:
+        with nogil:
+            for k in range(size):
+                i = r1_start + k
+                j = r2_end - 1 - k
+                base1 = s1[i]
+                base2 = COMPLEMENT[<unsigned char> s2[j]]
+                if base1 == base2:
+                    continue
+                if action == ACTION_N:
+                    s1[i] = b'N'
+                    s2[j] = b'N'
+                    r1_changed += 1
+                    r2_changed += 1
+                elif base1 == b'N':
+                    s1[i] = base2
+                    if has_quals:
+                        q1[i] = q2[j]
+                    r1_changed += 1
+                elif base2 == b'N':
+                    s2[j] = COMPLEMENT[<unsigned char> base1]
+                    if has_quals:
+                        q2[j] = q1[i]
+                    r2_changed += 1
+                elif has_quals:
+                    diff = q1[i] - q2[j]
+                    if diff >= min_qual_difference:
+                        s2[j] = COMPLEMENT[<unsigned char> base1]
+                        q2[j] = q1[i]
+                        r2_changed += 1
+                    elif diff <= -min_qual_difference:
+                        s1[i] = base2
+                        q1[i] = q2[j]
+                        r1_changed += 1
+                    elif action == ACTION_LIBERAL:
+                        quals_equal[num_equal] = k
+                        num_equal += 1
+
+            if num_equal > 0:
+                mean_qual1 = 0
+                for i in range(r1_start, r1_end):
+                    mean_qual1 += q1[i]
+                mean_qual1 /= (r1_end - r1_start)
+                mean_qual2 = 0
+                for j in range(r2_start, r2_end):
+                    mean_qual2 += q2[j]
+                mean_qual2 /= (r2_end - r2_start)
+                # Only make the corrections if one read is significantly better
+                # than the other.
+                if mean_qual1 - mean_qual2 > 1:
+                    # read1 is better than read2
+                    for k in range(num_equal):
+                        i = r1_start + quals_equal[k]
+                        j = r2_end - 1 - quals_equal[k]
+                        s2[j] = COMPLEMENT[<unsigned char> s1[i]]
+                        q2[j] = q1[i]
+                        r2_changed += 1
+                elif mean_qual1 - mean_qual2 < -1:
+                    # read2 is better than read1
+                    for k in range(num_equal):
+                        i = r1_start + quals_equal[k]
+                        j = r2_end - 1 - quals_equal[k]
+                        s1[i] = COMPLEMENT[<unsigned char> s2[j]]
+                        q1[i] = q2[j]
+                        r1_changed += 1
+    finally:
+        PyMem_Free(quals_equal)
+
+    return (r1_changed, r2_changed)
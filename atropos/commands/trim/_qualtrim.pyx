@@ -3,49 +3,89 @@
 """
 Quality trimming.
 """
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
 
-def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int base=33):
-    """
-    Find the positions at which to trim low-quality ends from a nucleotide sequence.
-    Return tuple (start, stop) that indicates the good-quality segment.
-
-    Qualities are assumed to be ASCII-encoded as chr(qual + base).
-
-    The algorithm is the same as the one used by BWA within the function
-    'bwa_trim_read':
-    - Subtract the cutoff value from all qualities.
-    - Compute partial sums from all indices to the end of the sequence.
-    - Trim sequence at the index at which the sum is minimal.
-    """
-    cdef int s
-    cdef int max_qual
-    cdef int stop = len(qualities)
+cdef void _quality_trim(
+        const char* qualities, int length, int cutoff_front, int cutoff_back,
+        int base, int* start_out, int* stop_out) nogil:
+    cdef int s, max_qual, i
     cdef int start = 0
-    cdef int i
+    cdef int stop = length
 
-    # find trim position for 5' end
     s = 0
     max_qual = 0
-    for i in range(len(qualities)):
-        s += cutoff_front - (ord(qualities[i]) - base)
+    for i in range(length):
+        s += cutoff_front - (qualities[i] - base)
         if s < 0:
             break
         if s > max_qual:
             max_qual = s
             start = i + 1
 
-    # same for 3' end
     max_qual = 0
     s = 0
-    for i in reversed(range(len(qualities))):
-        s += cutoff_back - (ord(qualities[i]) - base)
+    for i in range(length - 1, -1, -1):
+        s += cutoff_back - (qualities[i] - base)
         if s < 0:
             break
         if s > max_qual:
             max_qual = s
             stop = i
     if start >= stop:
-        start, stop = 0, 0
+        start = stop = 0
+    start_out[0] = start
+    stop_out[0] = stop
+
+cdef int _nextseq_trim(
+        const char* bases, const char* qualities, int length, int cutoff,
+        int base) nogil:
+    cdef int s = 0
+    cdef int max_qual = 0
+    cdef int max_i = length
+    cdef int i, q
+    for i in range(length - 1, -1, -1):
+        q = qualities[i] - base
+        if bases[i] == b'G':
+            q = cutoff - 1
+        s += cutoff - q
+        if s < 0:
+            break
+        if s > max_qual:
+            max_qual = s
+            max_i = i
+    return max_i
+
+cdef int* _pack_offsets(strings) except NULL:
+    cdef int n = len(strings)
+    cdef int* offsets = <int*> PyMem_Malloc((n + 1) * sizeof(int))
+    cdef int i
+    if not offsets:
+        raise MemoryError()
+    offsets[0] = 0
+    for i in range(n):
+        offsets[i + 1] = offsets[i] + len(strings[i])
+    return offsets
+
+def quality_trim_index(str qualities, int cutoff_front, int cutoff_back, int base=33):
+    """
+    Find the positions at which to trim low-quality ends from a nucleotide sequence.
+    Return tuple (start, stop) that indicates the good-quality segment.
+
+    Qualities are assumed to be ASCII-encoded as chr(qual + base).
+
+    The algorithm is the same as the one used by BWA within the function
+    'bwa_trim_read':
+    - Subtract the cutoff value from all qualities.
+    - Compute partial sums from all indices to the end of the sequence.
+    - Trim sequence at the index at which the sum is minimal.
+    """
+    cdef bytes qual_bytes = qualities.encode('ascii')
+    cdef const char* quals = qual_bytes
+    cdef int length = len(qual_bytes)
+    cdef int start, stop
+    with nogil:
+        _quality_trim(
+            quals, length, cutoff_front, cutoff_back, base, &start, &stop)
     return (start, stop)
 
 
@@ -60,25 +100,71 @@ def nextseq_trim_index(sequence, int cutoff, int base=33):
     This routine works as the one above, but counts qualities belonging to 'G'
     bases as being equal to cutoff - 1.
     """
-    bases = sequence.sequence
-    qualities = sequence.qualities
-    cdef:
-        int s = 0
-        int max_qual = 0
-        int max_i = len(qualities)
-        int i, q
+    cdef bytes base_bytes = sequence.sequence.encode('ascii')
+    cdef bytes qual_bytes = sequence.qualities.encode('ascii')
+    cdef const char* bases = base_bytes
+    cdef const char* quals = qual_bytes
+    cdef int length = len(qual_bytes)
+    cdef int stop
+    with nogil:
+        stop = _nextseq_trim(bases, quals, length, cutoff, base)
+    return stop
 
-    s = 0
-    max_qual = 0
-    max_i = len(qualities)
-    for i in reversed(xrange(max_i)):
-        q = ord(qualities[i]) - base
-        if bases[i] == 'G':
-            q = cutoff - 1
-        s += cutoff - q
-        if s < 0:
-            break
-        if s > max_qual:
-            max_qual = s
-            max_i = i
-    return max_i
+
+def quality_trim_indices(qualities, int cutoff_front, int cutoff_back, int base=33):
+    """
+    Batch version of quality_trim_index. The qualities of all the reads are
+    packed into a single buffer, which is scanned without holding the GIL.
+
+    Return a list with one tuple (start, stop) per string in qualities.
+    """
+    cdef int n = len(qualities)
+    cdef bytes packed = "".join(qualities).encode('ascii')
+    cdef const char* quals = packed
+    cdef int* offsets = _pack_offsets(qualities)
+    cdef int* bounds = <int*> PyMem_Malloc(2 * n * sizeof(int) + 1)
+    cdef int i
+    if not bounds:
+        PyMem_Free(offsets)
+        raise MemoryError()
+    try:
+        with nogil:
+            for i in range(n):
+                _quality_trim(
+                    quals + offsets[i], offsets[i + 1] - offsets[i],
+                    cutoff_front, cutoff_back, base,
+                    &bounds[2 * i], &bounds[2 * i + 1])
+        return [(bounds[2 * i], bounds[2 * i + 1]) for i in range(n)]
+    finally:
+        PyMem_Free(offsets)
+        PyMem_Free(bounds)
+
+
+def nextseq_trim_indices(reads, int cutoff, int base=33):
+    """
+    Batch version of nextseq_trim_index. Return a list with one trim index per
+    read.
+    """
+    cdef int n = len(reads)
+    qualities = [read.qualities for read in reads]
+    cdef bytes packed_bases = "".join(
+        [read.sequence for read in reads]).encode('ascii')
+    cdef bytes packed_quals = "".join(qualities).encode('ascii')
+    cdef const char* bases = packed_bases
+    cdef const char* quals = packed_quals
+    cdef int* offsets = _pack_offsets(qualities)
+    cdef int* stops = <int*> PyMem_Malloc(n * sizeof(int) + 1)
+    cdef int i
+    if not stops:
+        PyMem_Free(offsets)
+        raise MemoryError()
+    try:
+        with nogil:
+            for i in range(n):
+                stops[i] = _nextseq_trim(
+                    bases + offsets[i], quals + offsets[i],
+                    offsets[i + 1] - offsets[i], cutoff, base)
+        return [stops[i] for i in range(n)]
+    finally:
+        PyMem_Free(offsets)
+        PyMem_Free(stops)
@@ -99,6 +99,16 @@ standard output.
             action="store_false", dest="cache_adapters", default=True,
             help="Don't cache adapters list as '.adapters' in the working "
                  "directory.")
+        group.add_argument(
+            "--auto-adapters",
+            action="store_true", default=False,
+            help="Detect the 3' adapter of each read by matching the known "
+                 "adapters against the first reads of the input, and trim "
+                 "it in addition to any adapters given with -a/-A. (no)")
+        group.add_argument(
+            "--auto-adapters-reads",
+            type=positive(int), default=10000, metavar="N",
+            help="Number of reads to sample for --auto-adapters. (10000)")
         group.add_argument(
             "--no-trim",
             action='store_const', dest='action', const=None,
@@ -193,6 +203,13 @@ standard output.
             help="Maximum allowed error rate for matching adapters after "
                  "successful insert match (no. of errors divided by the length "
                  "of the matching region). (0.2)")
+        group.add_argument(
+            "--alignment-cache-size",
+            type=positive(int, True), default=0, metavar="N",
+            help="Cache the adapter/insert alignments of up to N distinct "
+                 "reads (or read pairs) per process. Speeds up trimming of "
+                 "libraries with many duplicate reads, such as amplicon or "
+                 "miRNA libraries. (0 = no caching)")
         
         # Arguments for merging and error correction
         # TODO: add RMP parameter for MergeOverlap
@@ -409,7 +426,10 @@ standard output.
                  "tile-level statistics (Illumina data only), and "
                  "'pre:tiles=<regexp>' means to use the specified regular "
                  "expression to extract key portions of read names to "
-                 "collect the tile statistics.")
+                 "collect the tile statistics. 'pre:sketches' estimates "
+                 "sequence duplication and overrepresented sequences using "
+                 "fixed-memory sketches, and 'pre:kmers=<k>' collects "
+                 "positional k-mer profiles.")
         
         group = self.add_group("Colorspace options")
         group.add_argument(
@@ -552,6 +572,14 @@ standard output.
             type=positive(int, True), default=None, metavar="THREADS",
             help="Number of threads to use for read trimming. Set to 0 to use "
                  "max available threads. (Do not use multithreading)")
+        group.add_argument(
+            "--parallel-backend",
+            choices=("processes", "threads"), default="processes",
+            help="Whether worker threads are run in separate processes, or as "
+                 "threads of the main process. Threads avoid copying batches "
+                 "of reads between processes, but only the alignment and "
+                 "trimming routines run outside of the interpreter lock. "
+                 "(processes)")
         group.add_argument(
             "--no-writer-process",
             action="store_false", dest="writer_process", default=True,
@@ -626,6 +654,7 @@ standard output.
             # Any of these options switch off legacy mode
             if (options.adapters2 or options.front2 or options.anywhere2 or
                     options.cut2 or options.cut_min2 or
+                    options.auto_adapters or
                     options.quality_cutoff or options.trim_n or
                     options.interleaved_input or options.pair_filter or
                     options.too_short_paired_output or
@@ -0,0 +1,110 @@
+# coding: utf-8
+"""Error correction of overlapping read pairs.
+"""
+# Import cythonized functions, defaulting to pure python implementations.
+try:
+    from ._errcorrect import correct_overlap
+
+except:
+    import logging
+    from atropos.util import BASE_COMPLEMENTS
+    
+    logging.getLogger().debug(
+        "Import failed for cythonized error correction functions")
+    
+    COMPLEMENT = bytes(
+        ord(BASE_COMPLEMENTS.get(chr(i), chr(i))) for i in range(256))
+    
+    def correct_overlap(
+            seq1, seq2, qual1, qual2, r1_start, r1_end, r2_start, r2_end,
+            mismatch_action, min_qual_difference=1):
+        """Correct mismatches between the overlapping parts of two reads.
+        seq1[r1_start:r1_end] is compared to the reverse-complement of
+        seq2[r2_start:r2_end]. Sequences (and qualities, if not None) are
+        bytearrays that are modified in place.
+        
+        Args:
+            seq1, seq2: The read sequences.
+            qual1, qual2: The read qualities, or None.
+            r1_start, r1_end, r2_start, r2_end: The overlapping regions.
+            mismatch_action: 'N', 'conservative', or 'liberal'. See
+                :class:`atropos.commands.trim.modifiers.ErrorCorrectorMixin`.
+            min_qual_difference: The minimum difference in base quality
+                required to replace one base with the other.
+        
+        Returns:
+            Tuple (r1_changed, r2_changed) with the number of bases changed
+            in each read.
+        """
+        has_quals = qual1 is not None and qual2 is not None
+        if mismatch_action not in ('N', 'conservative', 'liberal'):
+            raise ValueError(
+                "Invalid mismatch action: {}".format(mismatch_action))
+        if mismatch_action != 'N' and not has_quals:
+            raise ValueError(
+                "Cannot perform quality-based error correction on reads "
+                "lacking quality information")
+        if (
+                r1_start < 0 or r2_start < 0 or r1_end > len(seq1) or
+                r2_end > len(seq2)):
+            raise IndexError("Overlap extends beyond the end of a read")
+        
+        base_n = ord('N')
+        r1_changed = 0
+        r2_changed = 0
+        quals_equal = []
+        
+        for i, j in zip(
+                range(r1_start, r1_end), range(r2_end - 1, r2_start - 1, -1)):
+            base1 = seq1[i]
+            base2 = COMPLEMENT[seq2[j]]
+            if base1 == base2:
+                continue
+            if mismatch_action == 'N':
+                seq1[i] = base_n
+                seq2[j] = base_n
+                r1_changed += 1
+                r2_changed += 1
+            elif base1 == base_n:
+                seq1[i] = base2
+                if has_quals:
+                    qual1[i] = qual2[j]
+                r1_changed += 1
+            elif base2 == base_n:
+                seq2[j] = COMPLEMENT[base1]
+                if has_quals:
+                    qual2[j] = qual1[i]
+                r2_changed += 1
+            elif has_quals:
+                diff = qual1[i] - qual2[j]
+                if diff >= min_qual_difference:
+                    seq2[j] = COMPLEMENT[base1]
+                    qual2[j] = qual1[i]
+                    r2_changed += 1
+                elif diff <= -min_qual_difference:
+                    seq1[i] = base2
+                    qual1[i] = qual2[j]
+                    r1_changed += 1
+                elif mismatch_action == 'liberal':
+                    quals_equal.append((i, j))
+        
+        if quals_equal:
+            mean_qual1 = sum(qual1[r1_start:r1_end]) / (r1_end - r1_start)
+            mean_qual2 = sum(qual2[r2_start:r2_end]) / (r2_end - r2_start)
+            # Only make the corrections if one read is significantly better
+            # than the other.
+            diff = mean_qual1 - mean_qual2
+            if diff > 1:
+                # read1 is better than read2
+                for i, j in quals_equal:
+                    seq2[j] = COMPLEMENT[seq1[i]]
+                    qual2[j] = qual1[i]
+                    r2_changed += 1
+            elif diff < -1:
+                # read2 is better than read1
+                for i, j in quals_equal:
+                    seq1[i] = COMPLEMENT[seq2[j]]
+                    qual1[i] = qual2[j]
+                    r1_changed += 1
+        
+        return (r1_changed, r2_changed)
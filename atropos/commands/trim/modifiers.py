@@ -11,14 +11,22 @@ from atropos import AtroposError
 from atropos.align import (
     Aligner, InsertAligner, SEMIGLOBAL, START_WITHIN_SEQ1, STOP_WITHIN_SEQ2)
 from atropos.util import (
-    BASE_COMPLEMENTS, reverse_complement, mean, quals2ints)
-from .qualtrim import quality_trim_index, nextseq_trim_index
+    reverse_complement, mean, quals2ints)
+from .errcorrect import correct_overlap
+from .qualtrim import (
+    quality_trim_index, nextseq_trim_index, quality_trim_indices,
+    nextseq_trim_indices)
 
 # Base classes
 
 class Modifier(object):
     """Base clas for modifiers.
+    
+    Modifiers that can process a batch of reads more efficiently than one read
+    at a time override `modify_batch` and set `supports_batch` to True.
     """
+    supports_batch = False
+    
     @property
     def name(self):
         """Modifier name.
@@ -31,6 +39,17 @@ class Modifier(object):
         """
         return getattr(self, 'display_str', self.name)
     
+    def modify_batch(self, reads):
+        """Modify a batch of reads.
+        
+        Args:
+            reads: A list of reads.
+        
+        Returns:
+            A list of the modified reads.
+        """
+        return [self(read) for read in reads]
+    
     def summarize(self):
         """Returns a summary of the modifier's activity as a dict.
         """
@@ -41,6 +60,21 @@ class ReadPairModifier(Modifier):
     """
     def __call__(self, read1, read2):
         raise NotImplementedError()
+    
+    def modify_batch(self, reads1, reads2):
+        """Modify a batch of read pairs.
+        
+        Args:
+            reads1, reads2: Lists of the first and second reads.
+        
+        Returns:
+            A tuple of lists (reads1, reads2) of the modified reads.
+        """
+        reads1 = list(reads1)
+        reads2 = list(reads2)
+        for idx, (read1, read2) in enumerate(zip(reads1, reads2)):
+            reads1[idx], reads2[idx] = self(read1, read2)
+        return (reads1, reads2)
 
 class Trimmer(Modifier):
     """Base class of modifiers that trim bases from reads.
@@ -92,33 +126,78 @@ class AdapterCutter(Modifier):
     """Repeatedly find one of multiple adapters in reads. The number of times
     the search is repeated is specified by the times parameter.
     
+    Adapters are tried in descending order of how often they have been the
+    best match, which is recomputed every `reorder_interval` searches. An
+    adapter is not tried if it cannot match more bases than the best match
+    found so far. Ties are broken in favor of the adapter that was listed
+    first, so the result is the same as trying every adapter in order.
+    
     Args:
         adapters: List of Adapter objects.
         times: Number of times to trim.
         action: What to do with a found adapter: None, 'trim', or 'mask'
+        reorder_interval: Number of searches between reorderings of the
+            adapters.
     """
-    def __init__(self, adapters=None, times=1, action='trim'):
+    def __init__(
+            self, adapters=None, times=1, action='trim',
+            reorder_interval=10000):
         super(AdapterCutter, self).__init__()
         self.adapters = adapters or []
         self.times = times
         self.action = action
         self.with_adapters = 0
-
+        self.reorder_interval = reorder_interval
+        # Upper bound on the number of matches of each adapter, or None if
+        # it's unknown (e.g. for linked adapters).
+        self._max_matches = [
+            getattr(adapter, 'max_matches', None) for adapter in self.adapters]
+        self._order = list(range(len(self.adapters)))
+        self._best_counts = [0] * len(self.adapters)
+        self._searches = 0
+        self.skipped_evaluations = 0
+    
+    def _reorder(self):
+        """Sort the adapters by the number of times each was the best match.
+        """
+        counts = self._best_counts
+        self._order.sort(key=lambda idx: (-counts[idx], idx))
+    
     def _best_match(self, read):
         """Find the best matching adapter in the given read.
         
         Returns:
             Either a Match instance or None if there are no matches.
         """
+        self._searches += 1
+        if self._searches % self.reorder_interval == 0:
+            self._reorder()
+        
+        read_len = len(read)
         best = None
-        for adapter in self.adapters:
-            match = adapter.match_to(read)
+        best_idx = None
+        for idx in self._order:
+            if best is not None:
+                max_matches = self._max_matches[idx]
+                if max_matches is not None:
+                    max_matches = min(max_matches, read_len)
+                    if max_matches < best.matches or (
+                            max_matches == best.matches and idx > best_idx):
+                        self.skipped_evaluations += 1
+                        continue
+            
+            match = self.adapters[idx].match_to(read)
             if match is None:
                 continue
             
             # the no. of matches determines which adapter fits best
-            if best is None or match.matches > best.matches:
+            if best is None or match.matches > best.matches or (
+                    match.matches == best.matches and idx < best_idx):
                 best = match
+                best_idx = idx
+        
+        if best is not None:
+            self._best_counts[best_idx] += 1
         return best
 
     def __call__(self, read):
@@ -192,6 +271,7 @@ class AdapterCutter(Modifier):
             adapters_summary[adapter.name] = adapter.summarize()
         return dict(
             records_with_adapters=self.with_adapters,
+            skipped_evaluations=self.skipped_evaluations,
             adapters=adapters_summary)
 
 # Other error correction approaches:
@@ -211,8 +291,7 @@ class ErrorCorrectorMixin(object):
     """
     def __init__(self, mismatch_action=None, min_qual_difference=1):
         self.mismatch_action = mismatch_action
-        self.r1r2_min_qual_difference = min_qual_difference
-        self.r2r1_min_qual_difference = -1 * min_qual_difference
+        self.min_qual_difference = min_qual_difference
         self.corrected_pairs = 0
         self.corrected_bp = [0, 0]
     
@@ -227,127 +306,58 @@ class ErrorCorrectorMixin(object):
                 before correcting. This is necessary when the insert match is
                 based on truncated sequences (e.g. when it was generated by
                 InsertAligner).
+        
+        Returns:
+            Tuple (r1_changed, r2_changed) with the number of bases changed
+            in each read.
         """
         # Do not attempt to correct an already corrected read
         if read1.corrected > 0 or read2.corrected > 0:
-            return
+            return (0, 0)
         
         # read2 reverse-complement is the reference, read1 is the query
-        r1_seq = list(read1.sequence)
-        r2_seq = list(read2.sequence)
-        len1 = len(r1_seq)
+        r1_seq = bytearray(read1.sequence, 'ascii')
+        r2_seq = bytearray(read2.sequence, 'ascii')
         len2 = len(r2_seq)
-
+        
         has_quals = read1.qualities and read2.qualities
         if has_quals:
-            r1_qual = list(read1.qualities)
-            r2_qual = list(read2.qualities)
+            r1_qual = bytearray(read1.qualities, 'ascii')
+            r2_qual = bytearray(read2.qualities, 'ascii')
         elif self.mismatch_action in ('liberal', 'conservative'):
             raise ValueError(
                 "Cannot perform quality-based error correction on reads "
                 "lacking quality information")
-
-        if truncate_seqs:
-            if len1 > len2:
-                r1_seq = r1_seq[:len2]
-                if has_quals:
-                    r1_qual = r1_qual[:len2]
-            elif len2 > len1:
-                r2_seq = r2_seq[:len1]
-                if has_quals:
-                    r2_qual = r2_qual[:len1]
-                len2 = len1
-
-        r1_start = insert_match[2]
-        r1_end = insert_match[3]
-        r1_changed = 0
-        r2_start = len2 - insert_match[1]
-        r2_end = len2 - insert_match[0]
-        r2_changed = 0
-        quals_equal = []
+        else:
+            r1_qual = r2_qual = None
         
-        for i, j in zip(
-                range(r1_start, r1_end), range(r2_end - 1, r2_start - 1, -1)):
-            base1 = r1_seq[i]
-            base2 = BASE_COMPLEMENTS[r2_seq[j]]
-            if base1 == base2:
-                continue
-            if self.mismatch_action == 'N':
-                r1_seq[i] = 'N'
-                r2_seq[j] = 'N'
-                r1_changed += 1
-                r2_changed += 1
-            elif base1 == 'N':
-                r1_seq[i] = base2
-                if has_quals:
-                    r1_qual[i] = r2_qual[j]
-                r1_changed += 1
-            elif base2 == 'N':
-                r2_seq[j] = BASE_COMPLEMENTS[base1]
-                if has_quals:
-                    r2_qual[j] = r1_qual[i]
-                r2_changed += 1
-            elif has_quals:
-                diff = ord(r1_qual[i]) - ord(r2_qual[j])
-                if diff >= self.r1r2_min_qual_difference:
-                    r2_seq[j] = BASE_COMPLEMENTS[base1]
-                    r2_qual[j] = r1_qual[i]
-                    r2_changed += 1
-                elif diff <= self.r2r1_min_qual_difference:
-                    r1_seq[i] = base2
-                    r1_qual[i] = r2_qual[j]
-                    r1_changed += 1
-                elif self.mismatch_action == 'liberal':
-                    quals_equal.append((i, j, base1, base2))
+        if truncate_seqs:
+            # The insert match is relative to sequences truncated to the same
+            # length. Bases beyond the truncated length are not modified.
+            len2 = min(len(r1_seq), len2)
         
-        if quals_equal:
-            mean_qual1 = mean([ord(b) for b in r1_qual[r1_start:r1_end]])
-            mean_qual2 = mean([ord(b) for b in r2_qual[r2_start:r2_end]])
-            # Only make the corrections if one read is significantly better
-            # than the other.
-            # TODO: this method of determining whether one read is better
-            # than the other is crude - come up with something better.
-            diff = mean_qual1 - mean_qual2
-            if diff > 1:
-                # read1 is better than read2
-                for i, j, base1, base2 in quals_equal:
-                    r2_seq[j] = BASE_COMPLEMENTS[base1]
-                    r2_qual[j] = r1_qual[i]
-                    r2_changed += 1
-            elif diff < -1:
-                # read2 is better than read1
-                for i, j, base1, base2 in quals_equal:
-                    r1_seq[i] = base2
-                    r1_qual[i] = r2_qual[j]
-                    r1_changed += 1
+        r1_changed, r2_changed = correct_overlap(
+            r1_seq, r2_seq, r1_qual, r2_qual,
+            insert_match[2], insert_match[3],
+            len2 - insert_match[1], len2 - insert_match[0],
+            self.mismatch_action, self.min_qual_difference)
         
         if r1_changed or r2_changed:
             self.corrected_pairs += 1
-
-            def update_read(read, seq, qual, seq_len, read_num, num_changed):
+            
+            def update_read(read, seq, qual, read_num, num_changed):
                 self.corrected_bp[read_num] += num_changed
                 read.corrected = num_changed
-                new_seq = ''.join(seq)
-                partial = truncate_seqs and len(read.sequence) > seq_len
-                if partial:
-                    read.sequence = new_seq + read.sequence[seq_len:]
-                else:
-                    read.sequence = new_seq
+                read.sequence = seq.decode('ascii')
                 if has_quals:
-                    new_qual = ''.join(qual)
-                    if partial:
-                        read.qualities = new_qual + read.qualities[seq_len:]
-                    else:
-                        read.qualities = new_qual
-
+                    read.qualities = qual.decode('ascii')
+            
             if r1_changed:
-                update_read(
-                    read1, r1_seq, r1_qual if has_quals else None, len1, 0,
-                    r1_changed)
+                update_read(read1, r1_seq, r1_qual, 0, r1_changed)
             if r2_changed:
-                update_read(
-                    read2, r2_seq, r2_qual if has_quals else None, len2, 1,
-                    r2_changed)
+                update_read(read2, r2_seq, r2_qual, 1, r2_changed)
+        
+        return (r1_changed, r2_changed)
     
     def summarize(self):
         """Returns a summary dict.
@@ -445,12 +455,32 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
                     read_lengths[1], 0, adapter_match1.rstart)
                 correct_errors = True
         
+        num_corrected = 0
         if correct_errors:
-            self.correct_errors(read1, read2, insert_match, truncate_seqs=True)
+            r1_changed, r2_changed = self.correct_errors(
+                read1, read2, insert_match, truncate_seqs=True)
+            # With the 'N' action, each mismatch changes both reads.
+            num_corrected = r1_changed
+            if self.mismatch_action != 'N':
+                num_corrected += r2_changed
+        
+        read1 = self.trim(read1, self.adapter1, adapter_match1, 0)
+        read2 = self.trim(read2, self.adapter2, adapter_match2, 1)
+        
+        if match:
+            # Save the overlap so that MergeOverlapping doesn't have to realign
+            # the reads. Adapters are only trimmed from the 3' ends, so the
+            # overlap is always between the first `insert_size` bases of
+            # read1 and the last `insert_size` bases of read2's
+            # reverse-complement.
+            insert_size = insert_match[3]
+            len2 = len(read2)
+            read1.insert_match = read2.insert_match = (
+                len2 - insert_size, len2, 0, insert_size,
+                insert_match[4] + num_corrected,
+                insert_match[5] - num_corrected)
         
-        return (
-            self.trim(read1, self.adapter1, adapter_match1, 0),
-            self.trim(read2, self.adapter2, adapter_match2, 1))
+        return (read1, read2)
     
     def trim(self, read, adapter, match, read_idx):
         """Trim an adapter from a read.
@@ -504,6 +534,8 @@ class InsertAdapterCutter(ReadPairModifier, ErrorCorrectorMixin):
         summary = dict(
             records_with_adapters=self.with_adapters,
             adapters=adapters_summary)
+        if self.aligner.cache is not None:
+            summary['alignment_cache'] = self.aligner.cache.summarize()
         if self.mismatch_action:
             summary.update(ErrorCorrectorMixin.summarize(self))
         return summary
@@ -573,6 +605,7 @@ class UnconditionalCutter(Trimmer):
     read.
     """
     display_str = "Cut unconditionally"
+    supports_batch = True
     
     def __init__(self, lengths=None):
         super().__init__()
@@ -583,6 +616,12 @@ class UnconditionalCutter(Trimmer):
     
     def __call__(self, read):
         return self.clip(read, self.front_length, self.back_length)
+    
+    def modify_batch(self, reads):
+        clip = self.clip
+        front = self.front_length
+        back = self.back_length
+        return [clip(read, front, back) for read in reads]
 
 class MinCutter(Trimmer):
     """Ensure that a minimum number of bases have been trimmed off each end.
@@ -709,6 +748,8 @@ class DoubleEncoder(Modifier):
 class ZeroCapper(Modifier):
     """Change negative quality values of a read to zero
     """
+    supports_batch = True
+    
     def __init__(self, quality_base=33):
         qbase = quality_base
         self.zero_cap_trans = str.maketrans(
@@ -718,6 +759,13 @@ class ZeroCapper(Modifier):
         read = read[:]
         read.qualities = read.qualities.translate(self.zero_cap_trans)
         return read
+    
+    def modify_batch(self, reads):
+        trans = self.zero_cap_trans
+        reads = [read[:] for read in reads]
+        for read in reads:
+            read.qualities = read.qualities.translate(trans)
+        return reads
 
 class PrimerTrimmer(Trimmer):
     """Trims primer base from colorspace reads.
@@ -733,6 +781,7 @@ class NextseqQualityTrimmer(Trimmer):
     """NextSeq-specific quality trimmer.
     """
     display_str = "Quality trimmed (NextSeq)"
+    supports_batch = True
     
     def __init__(self, cutoff=0, base=33):
         super(NextseqQualityTrimmer, self).__init__()
@@ -744,11 +793,21 @@ class NextseqQualityTrimmer(Trimmer):
             return read
         stop = nextseq_trim_index(read, self.cutoff, self.base)
         return self.subseq(read, end=stop)
+    
+    def modify_batch(self, reads):
+        reads = list(reads)
+        nonempty = [idx for idx, read in enumerate(reads) if len(read) > 0]
+        stops = nextseq_trim_indices(
+            [reads[idx] for idx in nonempty], self.cutoff, self.base)
+        for idx, stop in zip(nonempty, stops):
+            reads[idx] = self.subseq(reads[idx], end=stop)
+        return reads
 
 class QualityTrimmer(Trimmer):
     """Trim bases from the start/end of reads based on their qualities.
     """
     display_str = "Quality-trimmed"
+    supports_batch = True
     
     def __init__(self, cutoff_front=0, cutoff_back=0, base=33):
         super(QualityTrimmer, self).__init__()
@@ -762,11 +821,22 @@ class QualityTrimmer(Trimmer):
         start, stop = quality_trim_index(
             read.qualities, self.cutoff_front, self.cutoff_back, self.base)
         return self.subseq(read, start, stop)
+    
+    def modify_batch(self, reads):
+        reads = list(reads)
+        nonempty = [idx for idx, read in enumerate(reads) if len(read) > 0]
+        bounds = quality_trim_indices(
+            [reads[idx].qualities for idx in nonempty], self.cutoff_front,
+            self.cutoff_back, self.base)
+        for idx, (start, stop) in zip(nonempty, bounds):
+            reads[idx] = self.subseq(reads[idx], start, stop)
+        return reads
 
 class NEndTrimmer(Trimmer):
     """Trims Ns from the 3' and 5' end of reads.
     """
     display_str = "End Ns trimmed"
+    supports_batch = True
     
     def __init__(self):
         super(NEndTrimmer, self).__init__()
@@ -782,6 +852,19 @@ class NEndTrimmer(Trimmer):
         start_cut = start_cut.end() if start_cut else 0
         end_cut = end_cut.start() if end_cut else len(read)
         return self.subseq(read, start_cut, end_cut)
+    
+    def modify_batch(self, reads):
+        # Equivalent to the regular expressions in __call__, but without the
+        # per-read overhead of matching them.
+        reads = list(reads)
+        for idx, read in enumerate(reads):
+            sequence = read.sequence
+            if not sequence or (sequence[0] != 'N' and sequence[-1] != 'N'):
+                continue
+            start_cut = len(sequence) - len(sequence.lstrip('N'))
+            end_cut = len(sequence.rstrip('N'))
+            reads[idx] = self.subseq(read, start_cut, end_cut)
+        return reads
 
 class RRBSTrimmer(MinCutter):
     """Sequences that are adapter-trimmed are further trimmed 2 bp on the 3'
@@ -858,16 +941,29 @@ class SwiftBisulfiteTrimmer(ReadPairModifier):
             self._read1_cutter.trimmed_bases,
             self._read2_cutter.trimmed_bases))
 
-# TODO: InsertAdapterCutter should save the insert match, and
-# MergeOverlapping should use that rather than doing another alignment
-
 class MergeOverlapping(ReadPairModifier, ErrorCorrectorMixin):
     """Merge overlaping reads. The merged reads are stored in read1.
+    
+    If the overlap has already been determined by InsertAdapterCutter, it is
+    used as-is; otherwise the reads are aligned.
     """
     def __init__(self, min_overlap=0.9, error_rate=0.1, mismatch_action=None):
         ErrorCorrectorMixin.__init__(self, mismatch_action)
         self.min_overlap = int(min_overlap) if min_overlap > 1 else min_overlap
         self.error_rate = error_rate
+        # Aligners are reused between reads, with one per set of flags.
+        self._aligners = {}
+    
+    def _align(self, read1, read2_rc, aflags):
+        """Align read1 to the reverse-complement of read2.
+        """
+        aligner = self._aligners.get(aflags, None)
+        if aligner is None:
+            aligner = self._aligners[aflags] = Aligner(
+                read2_rc, self.error_rate, aflags)
+        else:
+            aligner.reference = read2_rc
+        return aligner.locate(read1.sequence)
     
     def __call__(self, read1, read2):
         len1 = len(read1.sequence)
@@ -881,17 +977,22 @@ class MergeOverlapping(ReadPairModifier, ErrorCorrectorMixin):
         
         insert_matched = read1.insert_overlap and read2.insert_overlap
         
-        if insert_matched:
-            # If we've already determined that there is an insert overlap
-            # with a 3' overhang, we can constrain our alignment
-            aflags = START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2
-        else:
-            aflags = SEMIGLOBAL
         # align read1 to read2 reverse-complement to be compatible with
         # InsertAligner
         read2_rc = reverse_complement(read2.sequence)
-        aligner = Aligner(read2_rc, self.error_rate, aflags)
-        alignment = aligner.locate(read1.sequence)
+        
+        if (
+                read1.insert_match is not None and
+                read1.insert_match is read2.insert_match):
+            alignment = read1.insert_match
+        else:
+            if insert_matched:
+                # If we've already determined that there is an insert overlap
+                # with a 3' overhang, we can constrain our alignment
+                aflags = START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2
+            else:
+                aflags = SEMIGLOBAL
+            alignment = self._align(read1, read2_rc, aflags)
         
         if alignment:
             r2_start, r2_stop, r1_start, r1_stop, matches, errors = alignment
@@ -907,18 +1008,16 @@ class MergeOverlapping(ReadPairModifier, ErrorCorrectorMixin):
                 elif r1_start == 0 and r1_stop == len1:
                     # r1 is fully contained in r2
                     read1.sequence = read2_rc
-                    read1.qualities = "".join(reversed(read2.qualities))
+                    read1.qualities = read2.qualities[::-1]
                 elif r1_start > 0:
                     read1.sequence += read2_rc[r2_stop:]
                     if read1.qualities and read2.qualities:
-                        read1.qualities += "".join(
-                            reversed(read2.qualities))[r2_stop:]
+                        read1.qualities += read2.qualities[::-1][r2_stop:]
                 elif r2_start > 0:
                     read1.sequence = read2_rc + read1.sequence[r1_stop:]
                     if read1.qualities and read2.qualities:
                         read1.qualities = (
-                            "".join(reversed(read2.qualities)) +
-                            read1.qualities[r1_stop:])
+                            read2.qualities[::-1] + read1.qualities[r1_stop:])
                 else:
                     raise AtroposError(
                         "Invalid alignment while trying to merge read "
@@ -926,6 +1025,7 @@ class MergeOverlapping(ReadPairModifier, ErrorCorrectorMixin):
                             read1.name, ",".join(str(i) for i in alignment)))
                 
                 read1.merged = True
+                read1.insert_match = None
                 read2 = None
                 
         return (read1, read2)
@@ -1028,6 +1128,29 @@ class Modifiers(object):
         """
         raise NotImplementedError()
     
+    @property
+    def supports_batch(self):
+        """Whether all registered modifiers have a batch implementation.
+        """
+        for mods in self.modifiers:
+            if isinstance(mods, ReadPairModifier):
+                mods = (mods,)
+            if not all(mod.supports_batch for mod in mods if mod is not None):
+                return False
+        return True
+    
+    def modify_batch(self, reads1, reads2=None):
+        """Apply registered modifiers to a batch of reads/pairs. Each modifier
+        is applied to the whole batch before the next one.
+        
+        Args:
+            reads1, reads2: Lists of the reads to modify.
+        
+        Returns:
+            A list of tuples of modified reads, as returned by `modify`.
+        """
+        raise NotImplementedError()
+    
     def summarize(self):
         """Returns a summary dict.
         """
@@ -1050,6 +1173,11 @@ class SingleEndModifiers(Modifiers):
             read1 = mods[0](read1)
         return (read1,)
     
+    def modify_batch(self, reads1, reads2=None):
+        for mods in self.modifiers:
+            reads1 = mods[0].modify_batch(reads1)
+        return [(read1,) for read1 in reads1]
+    
     def summarize(self):
         summary = {}
         for mods in self.modifiers:
@@ -1104,6 +1232,17 @@ class PairedEndModifiers(Modifiers):
                     read2 = mods[1](read2)
         return (read1, read2)
     
+    def modify_batch(self, reads1, reads2=None):
+        for mods in self.modifiers:
+            if isinstance(mods, ReadPairModifier):
+                reads1, reads2 = mods.modify_batch(reads1, reads2)
+            else:
+                if mods[0] is not None:
+                    reads1 = mods[0].modify_batch(reads1)
+                if mods[1] is not None:
+                    reads2 = mods[1].modify_batch(reads2)
+        return list(zip(reads1, reads2))
+    
     def summarize(self):
         summary = {}
         for mods in self.modifiers:
@@ -54,6 +54,10 @@ class QueueResultHandler(ResultHandler):
         self.message = None
         self.timeout = None
     
+    def __deepcopy__(self, memo):
+        # Copies share the same queue.
+        return QueueResultHandler(self.queue)
+    
     def start(self, worker):
         self.message = "{} waiting to queue result {{}}".format(
             worker.name)
@@ -3,7 +3,9 @@
 """
 # Import cythonized functions, defaulting to pure python implementations.
 try:
-    from ._qualtrim import quality_trim_index, nextseq_trim_index
+    from ._qualtrim import (
+        quality_trim_index, nextseq_trim_index, quality_trim_indices,
+        nextseq_trim_indices)
 
 except:
     import logging
@@ -81,3 +83,21 @@ except:
                 max_qual = score
                 max_i = idx
         return max_i
+    
+    def quality_trim_indices(qualities, cutoff_front, cutoff_back, base=33):
+        """Batch version of :func:`quality_trim_index`.
+        
+        Returns:
+            A list with one tuple (start, stop) per string in `qualities`.
+        """
+        return [
+            quality_trim_index(quals, cutoff_front, cutoff_back, base)
+            for quals in qualities]
+    
+    def nextseq_trim_indices(reads, cutoff, base=33):
+        """Batch version of :func:`nextseq_trim_index`.
+        
+        Returns:
+            A list with one trim index per read.
+        """
+        return [nextseq_trim_index(read, cutoff, base) for read in reads]
@@ -13,11 +13,16 @@ cdef class Sequence(object):
 
     If an adapter has been matched to the sequence, the 'match' attribute is
     set to the corresponding Match instance.
+
+    If the inserts of a read pair have been found to overlap, the
+    'insert_match' attribute of both reads is set to the alignment of read1
+    to the reverse-complement of read2, in the same format returned by
+    Aligner.locate. It is not carried over to sequences derived from this one.
     """
     cdef:
         public str name
-        public str sequence
-        public str qualities
+        str _sequence
+        str _qualities
         public str name2
         public int original_length
         public object match
@@ -26,10 +31,22 @@ cdef class Sequence(object):
         public bint insert_overlap
         public bint merged
         public int corrected
+        public object insert_match
+        # A sliced Sequence shares the strings of the Sequence it was sliced
+        # from, and only records the [_start, _end) offsets into them. The
+        # strings are sliced the first time they are accessed.
+        int _start
+        int _end
+        bint _seq_view
+        bint _qual_view
+        # Upper-case forms of the sequence, computed on first use.
+        str _upper
+        bytes _upper_bytes
     
     def __init__(self, str name, str sequence, str qualities=None, str name2='',
                  original_length=None, match=None, match_info=None, clipped=None,
-                 insert_overlap=False, merged=False, corrected=0, alphabet=None):
+                 insert_overlap=False, merged=False, corrected=0, alphabet=None,
+                 insert_match=None):
         
         # Validate sequence and qualities lengths are equal
         if qualities is not None:
@@ -49,8 +66,8 @@ cdef class Sequence(object):
             sequence = alphabet.resolve_string(sequence)
         
         self.name = name
-        self.sequence = sequence
-        self.qualities = qualities
+        self._sequence = sequence
+        self._qualities = qualities
         self.name2 = name2
         self.original_length = original_length or len(sequence)
         self.match = match
@@ -59,6 +76,49 @@ cdef class Sequence(object):
         self.insert_overlap = insert_overlap
         self.merged = merged
         self.corrected = corrected
+        self.insert_match = insert_match
+    
+    property sequence:
+        def __get__(self):
+            if self._seq_view:
+                self._sequence = self._sequence[self._start:self._end]
+                self._seq_view = False
+            return self._sequence
+        
+        def __set__(self, str value):
+            self._sequence = value
+            self._seq_view = False
+            self._upper = None
+            self._upper_bytes = None
+    
+    property upper_sequence:
+        """The upper-case sequence. It is computed once and cached until the
+        sequence is changed.
+        """
+        def __get__(self):
+            if self._upper is None:
+                self._upper = self.sequence.upper()
+            return self._upper
+    
+    property upper_bytes:
+        """The upper-case sequence encoded as ASCII bytes, cached like
+        upper_sequence.
+        """
+        def __get__(self):
+            if self._upper_bytes is None:
+                self._upper_bytes = self.upper_sequence.encode('ascii')
+            return self._upper_bytes
+    
+    property qualities:
+        def __get__(self):
+            if self._qual_view:
+                self._qualities = self._qualities[self._start:self._end]
+                self._qual_view = False
+            return self._qualities
+        
+        def __set__(self, str value):
+            self._qualities = value
+            self._qual_view = False
     
     def subseq(self, begin=0, end=None):
         if end is None:
@@ -95,7 +155,7 @@ cdef class Sequence(object):
         sequence = reverse_complement(self.sequence)
         qualities = clipped = match_info = None
         if self.qualities:
-            qualities = ''.join(reversed(self.qualities))
+            qualities = self.qualities[::-1]
         if self.match_info:
             match_info = [copy.copy(m) for m in self.match_info]
         
@@ -121,7 +181,43 @@ cdef class Sequence(object):
         return new_read
     
     def __getitem__(self, key):
-        """slicing"""
+        """Slicing. Contiguous slices return a view that shares the sequence
+        and qualities of this Sequence rather than copying them.
+        """
+        cdef int start, stop, step
+        cdef Sequence new_read
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                new_read = self.__class__.__new__(self.__class__)
+                new_read.name = self.name
+                new_read._sequence = self._sequence
+                new_read._qualities = self._qualities
+                new_read.name2 = self.name2
+                new_read.original_length = self.original_length
+                new_read.match = self.match
+                new_read.match_info = self.match_info
+                new_read.clipped = list(self.clipped)
+                new_read.insert_overlap = self.insert_overlap
+                new_read.merged = self.merged
+                new_read.corrected = self.corrected
+                if stop < start:
+                    stop = start
+                if (
+                        self._qualities is not None and
+                        self._seq_view != self._qual_view):
+                    # Only one of the strings is a view; materialize both so
+                    # that the offsets of new_read refer to the same base.
+                    new_read._sequence = self.sequence
+                    new_read._qualities = self.qualities
+                elif self._seq_view:
+                    start += self._start
+                    stop += self._start
+                new_read._seq_view = True
+                new_read._qual_view = self._qualities is not None
+                new_read._start = start
+                new_read._end = stop
+                return new_read
         return self.__class__(
             self.name,
             self.sequence[key],
@@ -144,7 +240,9 @@ cdef class Sequence(object):
             truncate_string(self.name), truncate_string(self.sequence), qstr)
 
     def __len__(self):
-        return len(self.sequence)
+        if self._seq_view:
+            return self._end - self._start
+        return len(self._sequence)
 
     def __richcmp__(self, other, int op):
         if 2 <= op <= 3:
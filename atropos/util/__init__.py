@@ -1,5 +1,6 @@
 """Widely useful utility methods.
 """
+from array import array
 from collections import OrderedDict, Iterable, Sequence
 from datetime import datetime
 import errno
@@ -86,6 +87,9 @@ def build_iso_nucleotide_table():
 
 BASE_COMPLEMENTS = build_iso_nucleotide_table()
 
+BASE_COMPLEMENT_TABLE = str.maketrans(BASE_COMPLEMENTS)
+"""Translation table for complementing strings with `str.translate`."""
+
 IUPAC_BASES = frozenset(('X',) + tuple(BASE_COMPLEMENTS.keys()))
 """Valid IUPAC bases, plus 'X'"""
 
@@ -102,13 +106,19 @@ LOG2 = math.log(2)
 
 class RandomMatchProbability(object):
     """Class for computing random match probability for DNA sequences based on
-    binomial expectation. Maintains a cache of factorials to speed computation.
+    binomial expectation. Probabilities for sequences of up to `max_size` bases
+    are looked up in a table, which is computed in log space the first time a
+    given pair of base probabilities is used. Probabilities for longer
+    sequences are computed on demand.
     
     Args:
-        init_size: Initial cache size.
+        init_size: Initial size of the factorial cache.
+        max_size: Maximum sequence size for which probabilities are tabulated.
+            Each table holds (max_size+1)*(max_size+2)/2 doubles.
     """
-    def __init__(self, init_size=150):
-        self.cache = {}
+    def __init__(self, init_size=150, max_size=300):
+        self.max_size = max_size
+        self.tables = {}
         self.factorials = [1] * init_size
         self.max_n = 1
         self.cur_array_size = init_size
@@ -124,34 +134,39 @@ class RandomMatchProbability(object):
         Returns:
             The probability.
         """
-        # First see if we have the result in the cache
-        key = (matches, size, match_prob)
-        prob = self.cache.get(key, None)
-        if prob:
-            return prob
-        
-        # When there are no mismatches, the probability is
-        # just that of observing a specific sequence of the
-        # given length by chance.
-        if matches == size:
-            prob = match_prob ** matches
-        
-        else:
-            nfac = self.factorial(size)
-            prob = 0.0
-            
-            for i in range(matches, size+1):
-                j = size - i
-                # use integer division in the case that the numbers are too
-                # large for floating point division
-                try:
-                    div = nfac / self.factorial(i) / self.factorial(j)
-                except OverflowError:
-                    div = nfac // self.factorial(i) // self.factorial(j)
-                prob += (mismatch_prob ** j) * (match_prob ** i) * div
-        
-        self.cache[key] = prob
-        return prob
+        if matches > size:
+            # Callers sometimes count matches over more than `size` bases
+            # (e.g. the adapter check in InsertAligner); the binomial tail
+            # is empty.
+            return 0.0
+        if size > self.max_size:
+            return self._tail_probabilities(
+                size, match_prob, mismatch_prob)[matches]
+        key = (match_prob, mismatch_prob)
+        table = self.tables.get(key, None)
+        if table is None:
+            table = self.tables[key] = [
+                self._tail_probabilities(num, match_prob, mismatch_prob)
+                for num in range(self.max_size + 1)]
+        return table[size][matches]
+    
+    @staticmethod
+    def _tail_probabilities(size, match_prob, mismatch_prob):
+        """Returns an array whose i'th element is the probability of observing
+        at least i matches in `size` random bases. Terms are computed in log
+        space so that large sizes don't overflow.
+        """
+        log_match_prob = math.log(match_prob)
+        log_mismatch_prob = math.log(mismatch_prob)
+        log_nfac = math.lgamma(size + 1)
+        tail = array('d', bytes(8 * (size + 1)))
+        total = 0.0
+        for i in range(size, -1, -1):
+            total += math.exp(
+                log_nfac - math.lgamma(i + 1) - math.lgamma(size - i + 1) +
+                i * log_match_prob + (size - i) * log_mismatch_prob)
+            tail[i] = total
+        return tail
     
     def factorial(self, num):
         """Returns `num`!.
@@ -471,14 +486,33 @@ def ordered_dict(iterable):
     return ordict
 
 def complement(seq):
-    """Returns the complement of nucleotide sequence `seq`.
+    """Returns the complement of nucleotide sequence `seq`. Characters that
+    are not IUPAC bases are left unchanged.
     """
-    return "".join(BASE_COMPLEMENTS[base] for base in seq)
+    return seq.translate(BASE_COMPLEMENT_TABLE)
 
 def reverse_complement(seq):
-    """Returns the reverse complement of nucleotide sequence `seq`.
+    """Returns the reverse complement of nucleotide sequence `seq`. Characters
+    that are not IUPAC bases are left unchanged.
+    """
+    return seq[::-1].translate(BASE_COMPLEMENT_TABLE)
+
+def reverse_complements(seqs, sep="\n"):
+    """Returns the reverse complements of a sequence of nucleotide sequences.
+    The sequences are packed into a single string so that the translation is
+    done in one pass.
+    
+    Args:
+        seqs: Sequence of nucleotide sequences.
+        sep: Separator character, which must not occur in any of `seqs`.
+    
+    Returns:
+        A list of reverse-complemented sequences, in the same order as `seqs`.
     """
-    return "".join(BASE_COMPLEMENTS[base] for base in reversed(seq))
+    if not seqs:
+        return []
+    packed = sep.join(seqs)[::-1].translate(BASE_COMPLEMENT_TABLE)
+    return packed.split(sep)[::-1]
 
 def sequence_complexity(seq):
     """Computes a simple measure of sequence complexity.
@@ -81,6 +81,10 @@ def check_cython_version():
 
 extensions = [
     Extension('atropos.align._align', sources=['atropos/align/_align.pyx']),
+    Extension('atropos.commands._stats', sources=['atropos/commands/_stats.pyx']),
+    Extension('atropos.commands.trim._errcorrect', sources=['atropos/commands/trim/_errcorrect.pyx']),
+    Extension('atropos.commands.detect._kmers', sources=['atropos/commands/detect/_kmers.pyx']),
+    Extension('atropos.commands.detect._search', sources=['atropos/commands/detect/_search.pyx']),
     Extension('atropos.commands.trim._qualtrim', sources=['atropos/commands/trim/_qualtrim.pyx']),
     Extension('atropos.io._seqio', sources=['atropos/io/_seqio.pyx']),
 ]
@@ -136,7 +140,6 @@ setup(
     extras_require = {
         'progressbar' : ['progressbar2'],
         'tqdm' : ['tqdm'],
-        'khmer' : ['khmer'],
         'pysam' : ['pysam'],
         'jinja' : ['jinja2'],
         'sra' : ['srastream>=0.1.3']
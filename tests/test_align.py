@@ -3,7 +3,8 @@ import math
 from .utils import approx_equal
 from atropos.adapters import BACK
 from atropos.align import (
-    locate, compare_prefixes, compare_suffixes, Aligner, InsertAligner)
+    locate, compare_prefixes, compare_suffixes, Aligner, InsertAligner,
+    SEMIGLOBAL)
 from atropos.util import RandomMatchProbability
 
 class TestAligner():
@@ -222,3 +223,90 @@ def test_multi_aligner_with_mismatches():
     assert matches[1][3] == 12
     assert matches[1][4] == 11
     assert matches[1][5] == 1
+
+def test_banded_multi_aligner():
+    from atropos.align._align import BandedMultiAligner, MultiAligner
+    from atropos.align import START_WITHIN_SEQ1, STOP_WITHIN_SEQ2
+    import random
+    rng = random.Random(1)
+    rmp = RandomMatchProbability()
+    banded = BandedMultiAligner(0.2, 1, 1E-6)
+    multi = MultiAligner(0.2, START_WITHIN_SEQ1 | STOP_WITHIN_SEQ2, 1)
+    for _ in range(200):
+        insert = ''.join(rng.choice('ACGT') for _ in range(rng.randint(5, 40)))
+        overhang = ''.join(rng.choice('ACGT') for _ in range(rng.randint(0, 20)))
+        query = (insert + overhang)[:40]
+        ref = ('TTAGACATAT' + insert)[-len(query):]
+        expected = []
+        for match in multi.locate(ref, query) or ():
+            prob = rmp(match[4], match[3] - match[2])
+            if prob <= 1E-6 and (match, prob) not in expected:
+                expected.append((match, prob))
+        expected.sort(key=lambda x: (x[1], x[0][3]))
+        actual = banded.locate(ref, query) or []
+        assert [m for m, _ in actual] == [m for m, _ in expected]
+        for (_, prob1), (_, prob2) in zip(actual, expected):
+            assert approx_equal(prob1, prob2, 1E-12)
+
+def test_banded_multi_aligner_max_matches():
+    from atropos.align._align import BandedMultiAligner
+    a = BandedMultiAligner(0.0, 3)
+    matches = a.locate('AAAAAAAA', 'AAAAAAAA', max_matches=2)
+    assert [m for m, _ in matches] == [
+        (0, 8, 0, 8, 8, 0), (1, 8, 0, 7, 7, 0)]
+    assert a.locate('CCCC', 'GGGG') is None
+
+def test_alignment_cache():
+    from atropos.align import AlignmentCache
+    cache = AlignmentCache(2)
+    calls = []
+    def func(key):
+        calls.append(key)
+        return key.lower()
+    assert cache.fetch('A', func, 'A') == 'a'
+    assert cache.fetch('B', func, 'B') == 'b'
+    assert cache.fetch('A', func, 'A') == 'a'
+    # 'B' is the least-recently used entry, so it is evicted
+    assert cache.fetch('C', func, 'C') == 'c'
+    assert cache.fetch('B', func, 'B') == 'b'
+    assert calls == ['A', 'B', 'C', 'B']
+    assert cache.summarize() == dict(hits=1, misses=4)
+
+def test_insert_align_cached():
+    a1_seq = 'TTAGACATATGG'
+    a2_seq = 'CAGTGGAGTATA'
+    aligner = InsertAligner(a1_seq, a2_seq, cache_size=10)
+    r1 = 'AGTCGAGCCCATTGCAGACT' + a1_seq[0:10]
+    r2 = 'AGTCTGCAATGGGCTCGACT' + a2_seq[0:10]
+    first = aligner.match_insert(r1, r2)
+    second = aligner.match_insert(r1, r2)
+    assert aligner.cache.summarize() == dict(hits=1, misses=1)
+    assert first[0] == second[0]
+    assert first[1] is not second[1]
+    assert str(first[1]) == str(second[1])
+
+def test_aligners_copy():
+    import copy
+    import pickle
+    from atropos.align._align import BandedMultiAligner, MultiAligner
+    ref = 'CTCCAGCTTAGACATATC'
+    query = 'CCAGCTTAGACATGCG'
+    aligner = Aligner(
+        ref, 0.1, flags=BACK, wildcard_ref=True, min_overlap=3,
+        indel_cost=2)
+    aligners = (
+        (aligner, (query,)),
+        (MultiAligner(0.1, BACK, 3), (ref, query)),
+        (BandedMultiAligner(0.2, 3, 1E-3, 0.3, 0.7), (ref[6:], query)))
+    for aligner, args in aligners:
+        for aligner_copy in (
+                copy.deepcopy(aligner), pickle.loads(pickle.dumps(aligner))):
+            assert aligner_copy is not aligner
+            assert aligner_copy.locate(*args) == aligner.locate(*args)
+
+def test_locate_bytes():
+    for flags in (BACK, SEMIGLOBAL):
+        aligner = Aligner('CTCCAGCTTAGACATATC', 0.1, flags)
+        for query in ('CCAGCTTAGACATGCG', 'TTTTTT', 'GGCTCCAGCTT', ''):
+            assert aligner.locate_bytes(query.encode('ascii')) == \
+                aligner.locate(query)
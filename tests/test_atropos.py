@@ -382,6 +382,12 @@ def test_linked():
     run('-a AAAAAAAAAA...TTTTTTTTTT', 'linked.fasta', 'linked.fasta')
 
 
+def test_linked_alignment_cache():
+    run(
+        '-a AAAAAAAAAA...TTTTTTTTTT --alignment-cache-size 10',
+        'linked.fasta', 'linked.fasta')
+
+
 def test_fasta():
     run('-a TTAGACATATCTCCGTCG', 'small.fasta', 'small.fastq')
 
@@ -21,10 +21,470 @@ def test_order_preserving_writer():
         result1 = "result1"
         handler.write_result(1, { path : result1 })
         handler.finish(total_batches=3)
-
+        
         # check that the results are in the right order
         with open(path, 'rt') as inp:
             assert inp.read() == (result1 + result2 + result3)
     finally:
         os.remove(path)
 
+def test_record_handler_batch_error():
+    from atropos import AtroposError
+    from atropos.commands.trim import RecordHandler
+    from atropos.commands.trim.modifiers import (
+        PairedEndModifiers, QualityTrimmer)
+    from atropos.io.seqio import Sequence
+    class BadFormatter(object):
+        def format(self, results, dest, read1, read2=None):
+            if read1.name == 'bad':
+                raise ValueError("cannot format")
+    class NoFilters(object):
+        def filter(self, read1, read2=None):
+            return None
+    modifiers = PairedEndModifiers('both')
+    modifiers.add_modifier(QualityTrimmer, cutoff_back=20)
+    handler = RecordHandler(modifiers, NoFilters(), BadFormatter())
+    reads = [
+        Sequence(name, 'ACGT', 'IIII') for name in ('ok', 'ok', 'bad', 'ok')]
+    with raises(AtroposError) as err:
+        handler.handle_records(
+            dict(index=5, results=None), reads, reads[::-1])
+    assert str(err.value) == "An error occurred at record 2 of batch 5"
+    assert isinstance(err.value.__cause__, ValueError)
+
+
+def test_position_counts():
+    from atropos.commands.stats import PositionCounts, TilePositionCounts
+    counts1 = PositionCounts()
+    counts1.add('ACGT')
+    counts1.add('AC')
+    counts2 = PositionCounts()
+    counts2.add('ANGTC')
+    assert counts1.merge(counts2) is counts1
+    assert len(counts1) == 5
+    assert counts1.total() == 11
+    assert counts1.total('CG') == 5
+    summary = counts1.summarize()
+    assert summary['columns'] == ('A', 'C', 'G', 'T', 'N')
+    assert summary['rows'] == {
+        1: (3, 0, 0, 0, 0),
+        2: (0, 2, 0, 0, 1),
+        3: (0, 0, 2, 0, 0),
+        4: (0, 0, 0, 2, 0),
+        5: (0, 1, 0, 0, 0)}
+    with raises(ValueError):
+        counts1.merge(TilePositionCounts())
+    
+    quals = PositionCounts(is_qualities=True, quality_base=33)
+    quals.add('I#')
+    assert quals.summarize() == dict(
+        columns=(2, 40), rows={1: (0, 1), 2: (1, 0)})
+    
+    tiles1 = TilePositionCounts(is_qualities=True, quality_base=33)
+    tiles1.add('1101', 'II')
+    tiles2 = TilePositionCounts(is_qualities=True, quality_base=33)
+    tiles2.add('1102', '#')
+    tiles1.merge(tiles2)
+    assert tiles1.summarize() == dict(
+        columns=(2, 40),
+        columns2=('1101', '1102'),
+        rows={
+            1: {'1101': (0, 1), '1102': (1, 0)},
+            2: {'1101': (0, 1), '1102': (0, 0)}})
+
+def test_read_statistics_no_qualities():
+    from atropos.commands.stats import SingleEndReadStatistics
+    from atropos.io.seqio import Sequence
+    stats = SingleEndReadStatistics()
+    stats.collect(Sequence('read1', 'ACGG'))
+    stats.collect(Sequence('read2', 'AT'))
+    assert stats.gc_pct == 0.5
+    summary = stats.summarize()['read1']
+    assert summary['counts'] == 2
+    assert 'base_qualities' not in summary
+    assert 'sketches' not in summary
+    assert summary['bases'].summarize()['rows'][2] == (0, 1, 0, 1, 0)
+
+def test_sequence_sketches():
+    from atropos.commands.stats import SequenceSketches
+    sketches1 = SequenceSketches(capacity=4, sample_size=8)
+    sketches2 = SequenceSketches(capacity=4, sample_size=8)
+    seqs = ['ACGT' * i for i in range(1, 21)]
+    for i, seq in enumerate(seqs):
+        sketches1.add(seq)
+        sketches2.add(seq)
+        sketches2.add('GGGG')
+    assert sketches1.merge(sketches2) is sketches1
+    assert len(sketches1.sample) <= 8
+    summary = sketches1.summarize()
+    assert summary['distinct'] == 21
+    assert summary['duplicate_pct'] == round((1 - 21 / 60) * 100, 2)
+    levels = summary['duplication_levels']['rows']
+    assert sum(pct for pct, _ in levels.values()) == 100
+    assert summary['overrepresented'][0] == ('GGGG', 20, round(2000 / 60, 2))
+    assert all(count == 2 for _, count, _ in summary['overrepresented'][1:])
+
+def test_kmer_profile():
+    from atropos.commands.stats import KmerProfile, kmer_keys
+    # A=0, C=1, G=2, T=3; k-mers containing N are skipped
+    assert list(kmer_keys('ACGNTT', 2)) == [1, (1 << 4) | 6, (4 << 4) | 15]
+    adapter = 'TTTTTTTT'
+    reads = ['ACGTACGTAC' + adapter] * 20 + ['ACGTACGTACGTACGTAC'] * 20
+    profiles = []
+    for k in (4, 7):
+        profile1 = KmerProfile(k=k, min_enrichment=2, min_count=5)
+        profile2 = KmerProfile(k=k, min_enrichment=2, min_count=5)
+        assert profile1.dense == (k == 4)
+        for read in reads:
+            profile1.add(read)
+            profile2.add(read)
+        assert profile1.merge(profile2) is profile1
+        profiles.append(profile1.summarize())
+    for summary, k in zip(profiles, (4, 7)):
+        assert summary['k'] == k
+        rows = dict((row[0], row[1:]) for row in summary['rows'])
+        assert rows['T' * k][2:] == (11, True)
+        assert not rows['ACGTACG'[:k]][3]
+
+def test_convergence_monitor():
+    from atropos.commands.base import ConvergenceMonitor
+    monitor = ConvergenceMonitor(tolerance=0.01, window=2)
+    assert not monitor.update((1.0, 2.0), (10, 10))
+    assert not monitor.update((1.5, 2.0), (28, 20))
+    assert not monitor.update((1.5, 2.001), (39, 30))
+    assert monitor.stable_batches == 1
+    assert monitor.update((1.5, 2.001), (48, 40))
+    summary = monitor.summarize()
+    assert summary['converged']
+    assert summary['batches'] == 4
+    assert summary['estimate'] == 1.2
+    # per-batch estimates are 1.0, 1.8, 1.1, 0.9
+    low, high = summary['confidence_interval']
+    assert round(high - 1.2, 6) == round(1.2 - low, 6)
+    assert round((high - low) / 2, 4) == round(1.96 * (0.5 / 3 / 4) ** 0.5, 4)
+    # a change in the number of metrics resets the count
+    assert not monitor.update((1.5,), (48, 40))
+
+def test_kmer_graph():
+    from atropos.commands.detect.kmers import (
+        KmerCounter, KmerGraph, encode_kmer, decode_kmer)
+    assert encode_kmer('ACGT') == 0b00011011
+    assert decode_kmer(0b00011011, 4) == 'ACGT'
+    with raises(ValueError):
+        encode_kmer('ACNT')
+    with raises(ValueError):
+        KmerCounter(33)
+    adapter = 'AGATCGGAAGAGC'
+    inserts = ['ACCTGC', 'GTTACT', 'CAGGTG']
+    reads = [insert + adapter for insert in inserts] * 6 + ['C' * 11]
+    counter = KmerCounter(5, width=1024)
+    for read in reads:
+        counter.add(read)
+    counts = counter.count_frequent(reads, 7)
+    assert set(decode_kmer(code, 5) for code in counts) == set(
+        adapter[i:i+5] for i in range(len(adapter) - 4)) | set(('CCCCC',))
+    assert counts[encode_kmer('AGATC')] == 18
+    assert counts[encode_kmer('CCCCC')] == 7
+    results = KmerGraph(counts, 5).assemble()
+    assert results == [(adapter, 18 * 9), ('CCCCC', 7)]
+
+def test_kmer_sketch():
+    from atropos.commands.detect.kmers import KmerSketch, encode_kmer
+    adapter = 'AGATCGGAAGAGC'
+    reads = ['ACCTGC' + adapter, 'GTTACT' + adapter, 'CAGGTG' + adapter]
+    sketch1 = KmerSketch(5, width=1024, capacity=10)
+    sketch2 = KmerSketch(5, width=1024, capacity=10)
+    sketch1.add_all(reads * 3)
+    for read in reads * 2:
+        sketch2.add(read)
+    assert sketch1.num_kmers == 9 * 15
+    assert sketch1.estimate(encode_kmer('AGATC')) == 9
+    # conservative update never underestimates
+    assert all(
+        sketch1.estimate(encode_kmer(read[i:i+5])) >= 3
+        for read in reads for i in range(len(read) - 4))
+    assert len(sketch1.tracked) <= 20
+    assert sketch1.merge(sketch2) is sketch1
+    assert sketch1.num_kmers == 15 * 15
+    frequent = sketch1.frequent(15)
+    assert all(count == 15 for _, count in frequent)
+    assert set(kmer for kmer, _ in frequent) == set(
+        adapter[i:i+5] for i in range(len(adapter) - 4))
+    with raises(ValueError):
+        sketch1.merge(KmerSketch(5, width=512))
+
+def test_contaminant_index():
+    from atropos.commands.detect import ContaminantMatcher, ContaminantIndex
+    from atropos.util import reverse_complement
+    contams = ('AGATCGGAAGAGCACACGTC', 'GACGTGTGCTCTTCCGATCT', 'ACGTACGTAC')
+    seqs = (
+        'TTTTAGATCGGAAGAGCACA', 'GTGTGCTCTTCCGATCTTTT', 'CCCCCCCCCCCCCCCC',
+        'ACGTACGTACAGATCGGAAG')
+    matchers1 = [ContaminantMatcher(seq, [str(i)], 5)
+                 for i, seq in enumerate(contams)]
+    matchers2 = [ContaminantMatcher(seq, [str(i)], 5)
+                 for i, seq in enumerate(contams)]
+    index = ContaminantIndex(matchers2, 5)
+    for seq in seqs:
+        seqrc = reverse_complement(seq)
+        expected = [
+            (matcher,) + matcher.match(seq, seqrc) for matcher in matchers1]
+        expected = [
+            (matchers2[matchers1.index(result[0])],) + result[1:]
+            for result in expected if result[1] > 0]
+        assert index.match(seq, seqrc) == expected
+    assert [m.matches for m in matchers1] == [m.matches for m in matchers2]
+    assert matchers2[0].matches > 0
+
+def test_detector_merge():
+    import pickle
+    import random
+    from atropos.adapters import AdapterCache
+    from atropos.commands.detect import (
+        HeuristicDetector, KnownContaminantDetector, SketchDetector)
+    from atropos.io.seqio import Sequence
+    rand = random.Random(1)
+    adapter = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC'
+    def random_seq(size):
+        return ''.join(rand.choice('ACGT') for _ in range(size))
+    reads = [
+        Sequence('read{}'.format(i), random_seq(30) + adapter[:36])
+        for i in range(200)]
+    reads.extend(
+        Sequence('read{}'.format(i), random_seq(66)) for i in range(200, 400))
+    rand.shuffle(reads)
+    cache = AdapterCache(path=None)
+    cache.add('adapter', adapter)
+    cache.add('other', 'GTTCAGAGTTCTACAGTCCGACGATCGTTAGC')
+    for detector_class, kwargs in (
+            (HeuristicDetector, {}), (SketchDetector, {}),
+            (KnownContaminantDetector, dict(known_contaminants=cache))):
+        detectors = [
+            detector_class(kmer_size=12, n_reads=400, **kwargs)
+            for _ in range(3)]
+        detectors[0].handle_records(dict(size=400, bp=[0, 0]), reads)
+        detectors[1].handle_records(dict(size=250, bp=[0, 0]), reads[:250])
+        detectors[2].handle_records(dict(size=150, bp=[0, 0]), reads[250:])
+        # Detectors are sent from workers to the main process
+        detectors[2] = pickle.loads(pickle.dumps(detectors[2]))
+        assert detectors[1].merge(detectors[2]) is detectors[1]
+        serial = detectors[0].summarize_matches()
+        merged = detectors[1].summarize_matches()
+        assert len(serial[0]) > 0
+        assert serial == merged
+        assert serial[0][0]['longest_kmer'] in adapter
+        if detector_class is SketchDetector:
+            # Reads are not kept, so abundance is unknown
+            assert serial[0][0]['abundance'] is None
+    # The known detector does not store reads, and only sends its counts
+    assert len(detectors[0]._read_sequences) == 0
+    assert len(detectors[2]._read_hashes) == 0
+    assert serial[0][0]['known_names'] == ('adapter',)
+    assert serial[0][0]['abundance'] == 200
+
+def test_paired_detector_summarize_matches():
+    import random
+    from atropos.commands.detect import (
+        HeuristicDetector, PairedDetector, SketchDetector)
+    from atropos.io.seqio import Sequence
+    rand = random.Random(1)
+    adapter1 = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC'
+    adapter2 = 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGT'
+    def random_seq(size):
+        return ''.join(rand.choice('ACGT') for _ in range(size))
+    records = []
+    for i in range(200):
+        insert = random_seq(30)
+        records.append((
+            Sequence('read{}'.format(i), insert + adapter1[:30]),
+            Sequence('read{}'.format(i), insert + adapter2[:30])))
+    for detector_class, kwargs in (
+            (HeuristicDetector, {}),
+            (SketchDetector, dict(sketch_width=2**16))):
+        detector = PairedDetector(
+            detector_class, kmer_size=12, n_reads=200, **kwargs)
+        detector.process_batch(
+            (dict(index=1, source=0, size=len(records)), records))
+        serial = detector.summarize_matches()
+        assert len(serial[0]) > 0 and len(serial[1]) > 0
+        for backend in ('processes', 'threads'):
+            assert detector.summarize_matches(
+                threads=2, backend=backend) == serial
+
+def test_pattern_search():
+    from atropos.commands.detect import Match, search_matches
+    from atropos.commands.detect.search import PatternSearch
+    search = PatternSearch(('ACG', 'CGT', 'GTTT', 'ACGTA', 'T'))
+    assert sorted(search.find_first('NACGTTTACGTAT')) == [
+        (0, 1), (1, 2), (2, 3), (3, 7), (4, 4)]
+    assert search.find_first('NNNN') == []
+    reads = ['TTACGTAA', 'ACGTCCCC', 'GGGGGGGG', 'CCACGTACGT']
+    matches1 = [Match('ACGT'), Match('GGGG'), Match('ACGTACGT')]
+    matches2 = [Match('ACGT'), Match('GGGG'), Match('ACGTACGT')]
+    for match in matches1:
+        match.estimate_abundance(reads)
+        match.set_longest_match([read for read in reads if match.seq in read])
+    search_matches(matches2, reads)
+    for match1, match2 in zip(matches1, matches2):
+        assert match1.abundance == match2.abundance
+        assert match1.longest_match == match2.longest_match
+    assert [match.abundance for match in matches2] == [3, 1, 1]
+    assert matches2[0].longest_match == ('ACGTCCCC', 4)
+
+def test_detect_known_adapters():
+    import random
+    from atropos.adapters import AdapterCache
+    from atropos.commands.detect import detect_known_adapters
+    from atropos.io.seqio import Sequence
+    from atropos.util import reverse_complement
+    rand = random.Random(1)
+    adapter1 = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC'
+    adapter2 = 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGT'
+    cache = AdapterCache(path=None)
+    cache.add('adapter1', adapter1)
+    # The second adapter is listed in the opposite orientation
+    cache.add('adapter2', reverse_complement(adapter2))
+    cache.add('other', 'GTTCAGAGTTCTACAGTCCGACGATCGTTAGC')
+    def random_seq(size):
+        return ''.join(rand.choice('ACGT') for _ in range(size))
+    records = []
+    for i in range(200):
+        insert = random_seq(rand.randint(20, 40))
+        records.append((
+            Sequence('read{}'.format(i), (insert + adapter1)[:60]),
+            Sequence('read{}'.format(i), (insert + adapter2)[:60])))
+    assert detect_known_adapters(records, cache, paired=True) == [
+        [adapter1], [adapter2]]
+    assert detect_known_adapters(
+        [read2 for _, read2 in records], cache) == [[adapter2]]
+    assert detect_known_adapters(
+        [Sequence('read', random_seq(60)) for _ in range(50)], cache) == [[]]
+
+def test_shadow_regression():
+    import random
+    from atropos import AtroposError
+    from atropos.commands.error import ShadowRegressionErrorEstimator
+    from atropos.io.seqio import Sequence
+    rand = random.Random(1)
+    reads = []
+    for _ in range(50):
+        founder = ''.join(rand.choice('ACGT') for _ in range(50))
+        for _ in range(rand.randint(20, 200)):
+            seq = list(founder)
+            for i, base in enumerate(seq):
+                if rand.random() < 0.01:
+                    seq[i] = rand.choice([b for b in 'ACGT' if b != base])
+            reads.append(Sequence('read', ''.join(seq), '#' * 50))
+    rand.shuffle(reads)
+    estimators = [ShadowRegressionErrorEstimator() for _ in range(3)]
+    estimators[0].handle_records(dict(size=len(reads), bp=[0, 0]), reads)
+    estimators[1].handle_records(dict(size=1000, bp=[0, 0]), reads[:1000])
+    estimators[2].handle_records(dict(size=1000, bp=[0, 0]), reads[1000:])
+    assert estimators[1].merge(estimators[2]) is estimators[1]
+    estimate, details = estimators[0].estimate()
+    assert abs(estimate - 0.01) < 0.002
+    assert len(details['per_cycle']) == 50
+    assert estimators[1].estimate() == (estimate, details)
+    sampled = ShadowRegressionErrorEstimator(capacity=500)
+    sampled.handle_records(dict(size=len(reads), bp=[0, 0]), reads)
+    assert sampled.level > 0
+    assert len(sampled.seqs) <= 500
+    assert sampled.total_len == estimators[0].total_len
+    with raises(AtroposError):
+        ShadowRegressionErrorEstimator().estimate()
+
+def test_shadow_regression_varying_lengths():
+    import random
+    from atropos.commands.error import ShadowRegressionErrorEstimator
+    from atropos.io.seqio import Sequence
+    rand = random.Random(1)
+    reads = []
+    for length in (50,) * 20 + (60,) * 3:
+        founder = ''.join(rand.choice('ACGT') for _ in range(length))
+        # The three long founders have identical, error-free counts, so
+        # cycles past 50 cannot be regressed.
+        if length == 60:
+            reads.extend(
+                Sequence('read', founder, '#' * length) for _ in range(50))
+            continue
+        for _ in range(rand.randint(20, 200)):
+            seq = list(founder)
+            for i, base in enumerate(seq):
+                if rand.random() < 0.01:
+                    seq[i] = rand.choice([b for b in 'ACGT' if b != base])
+            reads.append(Sequence('read', ''.join(seq), '#' * length))
+    estimator = ShadowRegressionErrorEstimator()
+    estimator.handle_records(dict(size=len(reads), bp=[0, 0]), reads)
+    estimate, details = estimator.estimate()
+    assert 0 < estimate < 0.02
+    assert len(details['per_cycle']) == 50
+
+def test_base_quality_error():
+    from atropos.commands.error import (
+        BaseQualityErrorEstimator, PairedErrorEstimator)
+    from atropos.io.seqio import Sequence
+    from atropos.util import qual2prob
+    reads = [
+        Sequence('read1', 'ACGTACGT', '!+5?IIII'),
+        Sequence('read2', 'ACGTAC', '5555++'),
+        Sequence('read3', 'ACGTACGTAC', 'IIIII+++++')]
+    estimators = [BaseQualityErrorEstimator() for _ in range(3)]
+    estimators[0].handle_records(dict(size=3, bp=[0, 0]), reads)
+    estimators[1].handle_records(dict(size=1, bp=[0, 0]), reads[:1])
+    estimators[2].handle_records(dict(size=2, bp=[0, 0]), reads[1:])
+    assert estimators[1].merge(estimators[2]) is estimators[1]
+    expected = (
+        sum(qual2prob(qchar) for read in reads for qchar in read.qualities) /
+        sum(len(read) for read in reads))
+    for estimator in estimators[:2]:
+        estimate, details = estimator.estimate()
+        assert abs(estimate - expected) < 1e-9
+        assert estimator.total_len == 24
+        per_cycle = details['per_cycle']
+        assert len(per_cycle) == 10
+        assert per_cycle[0][0] == 1
+        assert abs(per_cycle[0][1] - (1 + 0.01 + 0.0001) / 3) < 1e-9
+        assert abs(per_cycle[9][1] - 0.1) < 1e-9
+    truncated = BaseQualityErrorEstimator(max_read_len=4)
+    truncated.handle_records(dict(size=3, bp=[0, 0]), reads)
+    assert truncated.total_len == 12
+    assert len(truncated.estimate()[1]['per_cycle']) == 4
+    paired = PairedErrorEstimator(max_read_len=4)
+    paired.handle_records(
+        dict(size=3, bp=[0, 0]), list(zip(reads, reversed(reads))))
+    summary = paired.summarize()
+    assert summary['total_len'] == (12, 12)
+    assert summary['estimate'][0] == truncated.estimate()[0]
+
+def test_read_statistics_merge():
+    import pickle
+    import random
+    from atropos.commands.stats import PairedEndReadStatistics
+    from atropos.io.seqio import Sequence
+    rand = random.Random(1)
+    def random_read(i):
+        size = rand.randint(20, 40)
+        return Sequence(
+            'read{}'.format(i),
+            ''.join(rand.choice('ACGT') for _ in range(size)),
+            ''.join(rand.choice('#5I') for _ in range(size)))
+    pairs = [(random_read(i), random_read(i)) for i in range(100)]
+    def collect(records):
+        stats = PairedEndReadStatistics(qualities=True, quality_base=33)
+        for read1, read2 in records:
+            stats.collect(read1, read2)
+        return stats
+    serial = collect(pairs)
+    stats1 = collect(pairs[:60])
+    stats2 = pickle.loads(pickle.dumps(collect(pairs[60:])))
+    assert stats1.merge(stats2) is stats1
+    for read in ('read1', 'read2'):
+        expected = getattr(serial, read)
+        merged = getattr(stats1, read)
+        assert merged.count == 100
+        assert merged.sequence_lengths == expected.sequence_lengths
+        assert merged.bases.summarize() == expected.bases.summarize()
+        assert (
+            merged.base_qualities.summarize() ==
+            expected.base_qualities.summarize())
+        assert merged.gc_pct == expected.gc_pct
@@ -46,6 +46,67 @@ def test_quality_trimmer():
     qt = QualityTrimmer(10, 0, 33)
     assert qt(read) == Sequence('read1', 'GTTTACGTA', '456789###')
 
+def test_modify_batch():
+    import random
+    random.seed(1)
+    reads = [Sequence('read1', '', '')]
+    for _ in range(200):
+        size = random.randint(0, 30)
+        reads.append(Sequence(
+            'read1',
+            ''.join(random.choice('ACGTNG') for _ in range(size)),
+            ''.join(chr(random.randint(30, 75)) for _ in range(size))))
+    for mod_class, kwargs in (
+            (QualityTrimmer, dict(cutoff_front=10, cutoff_back=20)),
+            (NextseqQualityTrimmer, dict(cutoff=20)),
+            (NEndTrimmer, {}),
+            (UnconditionalCutter, dict(lengths=[3, -2])),
+            (ZeroCapper, {})):
+        mod1 = mod_class(**kwargs)
+        mod2 = mod_class(**kwargs)
+        assert mod1.supports_batch
+        expected = [mod1(read) for read in reads]
+        actual = mod2.modify_batch(reads)
+        assert actual == expected
+        assert mod1.summarize() == mod2.summarize()
+    
+    m = PairedEndModifiers('both')
+    m.add_modifier(UnconditionalCutter, lengths=[2])
+    m.add_modifier(QualityTrimmer, cutoff_front=0, cutoff_back=20)
+    assert m.supports_batch
+    assert m.modify_batch(reads, reads[::-1]) == [
+        m.modify(read1, read2) for read1, read2 in zip(reads, reads[::-1])]
+    m.add_modifier(MergeOverlapping)
+    assert not m.supports_batch
+
+def test_adapter_cutter_best_match():
+    import random
+    rng = random.Random(2)
+    parser = AdapterParser()
+    adapters = [
+        parser.parse_from_spec(seq) for seq in (
+            'AGATCGGAAGAGC', 'AGATCGGAAG', 'CTGTCTCTTATA', 'AGATCGG',
+            'TGGAATTCTCGG', 'CTGTCTCTTATACACATCT')]
+    cutter = AdapterCutter(adapters, reorder_interval=7)
+    for _ in range(300):
+        adapter = rng.choice(adapters).sequence
+        insert = ''.join(rng.choice('ACGT') for _ in range(rng.randint(0, 30)))
+        read = Sequence('read', (insert + adapter)[:rng.randint(1, 40)])
+        expected = None
+        for adapter in adapters:
+            match = adapter.match_to(read)
+            if match and (expected is None or match.matches > expected.matches):
+                expected = match
+        actual = cutter._best_match(read)
+        if expected is None:
+            assert actual is None
+        else:
+            assert actual.adapter is expected.adapter
+            assert actual.matches == expected.matches
+    assert cutter.skipped_evaluations > 0
+    assert cutter.summarize()['skipped_evaluations'] == cutter.skipped_evaluations
+    assert cutter._order != list(range(len(adapters)))
+
 def test_Modifiers_single():
     m = SingleEndModifiers()
     m.add_modifier(UnconditionalCutter, lengths=[5])
@@ -329,6 +390,39 @@ def test_error_correction():
     assert new_read2.insert_overlap
     assert new_read2.sequence == reverse_complement(correct_frag)
 
+def test_merge_uses_insert_match():
+    a1 = 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTC'
+    a2 = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACGAGTTA'
+    frag = 'CCAAGCAGACATTCACTCAGATTGCA'
+    r1 = 'CCAAGTAGACATTCACTCAGATTGCA'
+    q1 = 'A' * 26
+    r2 = reverse_complement(frag)
+    q2 = '#' * 26
+    
+    parser = AdapterParser()
+    cutter = InsertAdapterCutter(
+        parser.parse_from_spec(a1), parser.parse_from_spec(a2),
+        mismatch_action='liberal')
+    merger = MergeOverlapping(min_overlap=10, error_rate=0.1)
+    
+    read1, read2 = cutter(
+        Sequence('foo', (r1 + a1)[0:40], q1 + '#' * 14),
+        Sequence('foo', (r2 + a2)[0:40], q2 + '#' * 14))
+    # The mismatch was corrected, so the stored overlap has no errors
+    assert read1.insert_match == (0, 26, 0, 26, 26, 0)
+    assert read1.insert_match is read2.insert_match
+    # Slicing invalidates the stored overlap
+    assert read1[1:].insert_match is None
+    
+    realigned1 = Sequence('foo', read1.sequence, read1.qualities)
+    realigned2 = Sequence('foo', read2.sequence, read2.qualities)
+    merged, _ = merger(read1, read2)
+    expected, _ = merger(realigned1, realigned2)
+    assert merged.merged
+    assert merged.sequence == expected.sequence == r1
+    assert merged.qualities == expected.qualities
+    assert merged.insert_match is None
+
 def test_error_correction_no_insert_match_one_adapter_match():
     a1 = 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTC'
     a2 = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACGAGTTA'
@@ -483,3 +577,30 @@ def test_overwrite_read():
     assert new_read2.sequence == highseq
     assert new_read2.qualities == ints2quals(highq)
     assert new_read1.corrected == new_read2.corrected == 0
+
+def test_correct_overlap():
+    from atropos.commands.trim._errcorrect import correct_overlap
+    # read2 is the reverse-complement of read1 with one N and one mismatch
+    seq1 = bytearray(b'ACGTNCGTTC')
+    seq2 = bytearray(b'GTACGTACGT')
+    qual1 = bytearray(b'IIIIIIII#I')
+    qual2 = bytearray(b'IIIIIIIIII')
+    assert correct_overlap(
+        seq1, seq2, qual1, qual2, 0, 10, 0, 10, 'conservative') == (2, 0)
+    assert seq1 == bytearray(b'ACGTACGTAC')
+    assert qual1 == bytearray(b'IIIIIIIIII')
+    
+    seq1 = bytearray(b'ACGTTCGTAC')
+    seq2 = bytearray(b'GTACGTACGT')
+    assert correct_overlap(seq1, seq2, None, None, 2, 8, 2, 8, 'N') == (1, 1)
+    assert seq1 == bytearray(b'ACGTNCGTAC')
+    assert seq2 == bytearray(b'GTACGNACGT')
+    
+    # Equal qualities: the read with the better mean quality wins
+    seq1 = bytearray(b'ACGTTCGTAC')
+    seq2 = bytearray(b'GTACGTACGT')
+    qual1 = bytearray(b'IIII5IIIII')
+    qual2 = bytearray(b'#####5####')
+    assert correct_overlap(
+        seq1, seq2, qual1, qual2, 0, 10, 0, 10, 'liberal') == (0, 1)
+    assert seq2 == bytearray(b'GTACGAACGT')
@@ -3,7 +3,9 @@ from pytest import raises
 import io
 from multiprocessing import Process, Queue
 import time
+from atropos.commands.base import Pipeline, Summary
 from atropos.commands.multicore import *
+from atropos.util import CountingDict
 
 class TimeoutException(Exception): pass
 
@@ -69,6 +71,56 @@ def test_dequeue_timeout():
     with raises(TimeoutException):
         dequeue(Queue(1), timeout=1, block_timeout=2, timeout_callback=TimeoutException)
 
+class LengthPipeline(Pipeline):
+    supports_deltas = True
+    
+    def __init__(self):
+        super().__init__()
+        self.lengths = CountingDict()
+    
+    def handle_records(self, context, records):
+        for record in records:
+            self.lengths.increment(len(record))
+    
+    def delta(self, summary):
+        super().delta(summary)
+        summary['lengths'] = self.lengths
+        self.lengths = CountingDict()
+    
+    def finish(self, summary, **kwargs):
+        super().finish(summary)
+        summary['lengths'] = self.lengths
+
+class MockCommandRunner(object):
+    threads = 3
+    process_timeout = 5
+    parallel_backend = 'threads'
+    read_queue_size = 2
+    
+    def __init__(self, batches):
+        self.batches = batches
+        self.summary = Summary()
+    
+    def iterator(self):
+        return iter(self.batches)
+
+def test_summary_deltas():
+    batches = [
+        (dict(index=i, source=0, size=2), ['A' * i, 'C' * i])
+        for i in range(1, 21)]
+    command_runner = MockCommandRunner(batches)
+    pipeline_class = type(
+        'LengthPipelineImpl', (ParallelPipelineMixin, LengthPipeline), {})
+    runner = ParallelPipelineRunner(
+        command_runner, pipeline_class(), summary_interval=0)
+    assert runner.run() == 0
+    summary = command_runner.summary
+    assert summary['total_record_count'] == 40
+    assert summary['record_counts'] == {0: 40}
+    assert dict(summary['lengths']) == dict((i, 2) for i in range(1, 21))
+    assert sum(
+        worker['records'] for worker in summary['workers'].values()) == 40
+
 # TODO: port tests from testparallel here
 # Test worker vs writer compression
 # Test without writer process
@@ -175,6 +175,23 @@ def test_paired_end():
         aligners=BACK_ALIGNERS
     )
 
+def test_paired_end_alignment_cache():
+    def check_cache(aligner, infiles, outfiles, result):
+        summary = result[1]
+        modifiers = summary['trim']['modifiers']
+        if aligner == 'insert':
+            cache = modifiers['InsertAdapterCutter']['alignment_cache']
+        else:
+            adapters = modifiers['AdapterCutter']['adapters'][0]
+            cache = tuple(adapters.values())[0]['alignment_cache']
+        assert cache['hits'] + cache['misses'] > 0
+    
+    run_paired('-a TTAGACATAT -A CAGTGGAGTA -m 14 --alignment-cache-size 2',
+        in1='paired.1.fastq', in2='paired.2.fastq',
+        expected1='paired_{aligner}.1.fastq', expected2='paired_{aligner}.2.fastq',
+        aligners=BACK_ALIGNERS, callback=check_cache
+    )
+
 def test_paired_anchored_back_no_indels():
     run_paired("-a BACKADAPTER$ -A BACKADAPTER$ -N --no-indels",
         in1='anchored-back.fasta', in2='anchored-back.fasta',
@@ -354,6 +371,37 @@ def test_no_writer_process():
         callback=check_multifile
     )
 
+def test_thread_backend():
+    run_paired('--threads 3 --parallel-backend threads --batch-size 10 --preserve-order -a AGATCGGAAGAGCACACGTCTGAACTCCAGTCACCAGATCATCTCGTATGCCGTCTTCTGCTTG -A AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTCGGTGGTCGCCGTATCATT -e 0.3 --adapter-max-rmp 0.001 -m 25 -q 0 --trim-n',
+        in1='insert.1.fastq', in2='insert.2.fastq',
+        expected1='insert.1.fastq', expected2='insert.2.fastq',
+        aligners=('insert',)
+    )
+
+def test_auto_adapters():
+    adapter1 = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCACACAGTGATCTCGTATGCCGTCTTCTGCTTG'
+    adapter2 = 'AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTAGATCTCGGTGGTCGCCGTATCATT'
+    def check_summary(aligner, infiles, outfiles, result):
+        summary = result[1]
+        # The sampled reads span two batches, and are all trimmed exactly once
+        assert summary['record_counts'] == {0: 100}
+        assert summary['auto_adapters'] == dict(
+            reads=30, adapters=[[adapter1], [adapter2]])
+    # The output is the same as with '-a adapter1 -A adapter2'
+    for params in (
+            '', '--threads 2 --preserve-order',
+            '--threads 2 --parallel-backend threads --preserve-order'):
+        run_paired(
+            params.split() + [
+                '--auto-adapters', '--auto-adapters-reads', '30',
+                '--batch-size', '16', '--no-default-adapters',
+                '--no-cache-adapters', '-F', datapath('big_adapters.fa')],
+            in1='big.1.fq', in2='big.2.fq',
+            expected1='big_auto_adapters.1.fastq',
+            expected2='big_auto_adapters.2.fastq',
+            callback=check_summary
+        )
+
 def test_summary():
     def check_summary(aligner, infiles, outfiles, result):
         summary = result[1]
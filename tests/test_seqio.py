@@ -45,6 +45,53 @@ class TestSequence:
     def test_invalid_primer(self):
         with raises(FormatError):
             ColorspaceSequence(name="name", sequence="K0123", qualities="####")
+    
+    def test_upper_sequence(self):
+        read = Sequence("name", "acgtN", "#####")
+        assert read.upper_sequence == "ACGTN"
+        assert read.upper_bytes == b"ACGTN"
+        assert read.upper_bytes is read.upper_bytes
+        assert read[1:3].upper_bytes == b"CG"
+        read.sequence = "ttt"
+        assert read.upper_sequence == "TTT"
+        assert read.upper_bytes == b"TTT"
+    
+    def test_slice_views(self):
+        seq = "ACGTACGTAC"
+        qual = "0123456789"
+        read = Sequence("name", seq, qual)
+        view = read[2:-1]
+        assert len(view) == 7
+        assert view.clipped is not read.clipped
+        # slicing a view, with one or both strings already materialized
+        assert view[1:4].sequence == seq[2:-1][1:4]
+        assert view.qualities == qual[2:-1]
+        sub = view[1:4]
+        assert sub.sequence == seq[3:6]
+        assert sub.qualities == qual[3:6]
+        assert view[5:2].sequence == ""
+        assert view[::2].sequence == seq[2:-1][::2]
+        # assigning to a view replaces its content
+        view.sequence = "TT"
+        view.qualities = "##"
+        assert len(view) == 2
+        assert view[1:].sequence == "T"
+        assert read.sequence == seq
+        # random slices of random slices
+        for _ in range(100):
+            cur = read
+            cur_seq = seq
+            cur_qual = qual
+            for _ in range(3):
+                i, j = random.randint(-12, 12), random.randint(-12, 12)
+                cur = cur[i:j]
+                cur_seq = cur_seq[i:j]
+                cur_qual = cur_qual[i:j]
+                assert len(cur) == len(cur_seq)
+                if random.random() < 0.3:
+                    assert cur.qualities == cur_qual
+            assert cur.sequence == cur_seq
+            assert cur.qualities == cur_qual
 
 
 class TestFastaReader:
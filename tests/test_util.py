@@ -0,0 +1,37 @@
+# coding: utf-8
+from atropos.util import (
+    BASE_COMPLEMENTS, complement, reverse_complement, reverse_complements)
+
+def test_complement():
+    assert complement('ACGTN') == 'TGCAN'
+    assert complement('acgtn') == 'tgcan'
+    for base, comp in BASE_COMPLEMENTS.items():
+        assert complement(base) == comp
+
+def test_reverse_complement():
+    assert reverse_complement('') == ''
+    assert reverse_complement('AACGTRY') == 'RYACGTT'
+    assert reverse_complement('AAcgN') == 'NcgTT'
+
+def test_reverse_complements():
+    seqs = ['AACG', '', 'TTTGGC', 'N']
+    assert reverse_complements(seqs) == [reverse_complement(s) for s in seqs]
+    assert reverse_complements([]) == []
+
+def test_random_match_probability():
+    from atropos.util import RandomMatchProbability
+    import math
+    def exact(matches, size, match_prob=0.25, mismatch_prob=0.75):
+        return sum(
+            math.factorial(size) // math.factorial(i) // math.factorial(size - i) *
+            (match_prob ** i) * (mismatch_prob ** (size - i))
+            for i in range(matches, size + 1))
+    rmp = RandomMatchProbability(max_size=50)
+    for size, matches in ((1, 0), (1, 1), (5, 3), (20, 12), (50, 50), (80, 60)):
+        for probs in ((0.25, 0.75), (0.33, 0.67)):
+            expected = exact(matches, size, *probs)
+            assert math.isclose(
+                rmp(matches, size, *probs), expected, rel_tol=1E-9)
+    assert len(rmp.tables) == 2
+    assert len(rmp.tables[(0.25, 0.75)]) == 51
+    assert rmp(10, 6) == 0.0